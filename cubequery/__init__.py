@@ -2,6 +2,7 @@
 # init the config here so it is available in many places.
 import configparser
 import logging
+import os
 from os import environ
 import json
 
@@ -15,10 +16,20 @@ _config = configparser.ConfigParser()
 _config.read(["config.cfg", "/etc/datacube.conf"])
 
 settings_json = ""
+_settings_path = 'input_conditions.json'
+_settings_mtime = None
+
+
+def _load_form_settings():
+    global settings_json, _settings_mtime
+    _settings_mtime = os.stat(_settings_path).st_mtime
+    with open(_settings_path) as res_json:
+        settings_json = json.load(res_json)
+
+
+_load_form_settings()
+
 
-with open('input_conditions.json') as res_json:
-    settings_json = json.load(res_json)
-        
 def get_config(section, key):
     """
     Get a configuration value from the environment if it is available if not fall back to the config file.
@@ -37,11 +48,24 @@ def get_config(section, key):
 
 def fetch_form_settings():
     """
-    Gets dynamic form settings loaded from a JSON file
+    Gets dynamic form settings loaded from a JSON file, reloading it if the file has changed since it was last read.
     """
-    global settings_json
+    try:
+        if os.stat(_settings_path).st_mtime != _settings_mtime:
+            logging.info(f"{_settings_path} has changed, reloading")
+            _load_form_settings()
+    except (OSError, ValueError) as e:
+        logging.warning(f"could not reload {_settings_path}, keeping previous settings: {e}")
     return settings_json
 
+
+def form_settings_version():
+    """
+    A value that changes whenever the form settings are reloaded.
+    """
+    fetch_form_settings()
+    return _settings_mtime
+
 # also configure the console logging just in case
 console = logging.StreamHandler()
 console.setLevel(logging.DEBUG)
@@ -0,0 +1,35 @@
+from shapely import wkb, wkt
+
+
+class AOI(str):
+    """
+    A WKT parameter value that has been parsed.
+
+    This is still the WKT string so anything expecting the text, including existing notebooks, keeps working, but it
+    also carries the parsed geometry so the api's validation steps and the worker don't each parse it again.
+    On the way to the worker the geometry travels as WKB alongside the text, which is much cheaper to decode.
+    """
+
+    def __new__(cls, text, geometry=None):
+        result = super().__new__(cls, text)
+        result.geometry = geometry if geometry is not None else wkt.loads(text)
+        return result
+
+    @classmethod
+    def from_wkb(cls, text, wkb_hex):
+        """
+        Rebuild an AOI from its text and the hex WKB of its geometry.
+        """
+        return cls(text, wkb.loads(wkb_hex, hex=True))
+
+    @property
+    def bounds(self):
+        return self.geometry.bounds
+
+    @property
+    def area(self):
+        return self.geometry.area
+
+    @property
+    def wkb_hex(self):
+        return self.geometry.wkb_hex
@@ -1,21 +1,30 @@
+import gzip
+import hashlib
 import json
 import logging
 import os
-from io import BytesIO
+from datetime import timezone
 
-from celery import Celery
-from flask import Flask, request, abort, render_template, jsonify, send_file
+from botocore.exceptions import ClientError
+from celery import Celery, group
+from flask import Flask, Response, request, abort, render_template, jsonify, redirect, stream_with_context
 from flask_caching import Cache
 from flask_cors import CORS
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, SignatureExpired, BadSignature
 from jobtastic.cache import WrappedCache
 
-from cubequery import get_config, users, git_packages, fetch_form_settings
+from cubequery import get_config, users, git_packages, fetch_form_settings, form_settings_version, task_index
+from cubequery import estimates
 
+from cubequery.login_throttle import FailedLoginThrottle
+from cubequery.token_cache import TokenCache
 from cubequery.packages import is_valid_task, load_task_instance, list_processes, add_extra_lib_path
-from cubequery.tasks import validate_standard_spatial_query, check_database_spatial
-from cubequery.users import is_username_valid
-from libcatapult.storage.s3_tools import S3Utils
+from cubequery.resources import s3_client
+from cubequery.tasks import validate_standard_spatial_query, check_database_spatial, DatabaseBusyError, \
+    ValidatedRequest
+from cubequery.users import is_username_valid, LoginBusyError
+from werkzeug.datastructures import ContentRange
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 
 
 def _to_bool(input):
@@ -53,9 +62,22 @@ celery_app.conf.update(
     task_publish_retry=True,
     task_ignore_result=False,
     task_track_started=True,
+    task_send_sent_event=True,
+    # submissions are routed to the small, medium or large queue by cost, anything sent without a route goes here.
+    task_default_queue="medium",
+    # let redis honour message priorities, lower numbers are taken first.
+    broker_transport_options={'priority_steps': list(range(10)), 'queue_order_strategy': 'priority'},
+    # a worker shouldn't hold on to queued runs it can't start yet when another worker is free.
+    worker_prefetch_multiplier=1,
     JOBTASTIC_CACHE=cache,
 )
 
+token_cache = TokenCache(max_size=int(get_config("App", "token_cache_size")))
+users.add_removal_listener(token_cache.evict_user)
+login_throttle = FailedLoginThrottle(max_failures=int(get_config("App", "login_max_failures")),
+                                     window=int(get_config("App", "login_failure_window")))
+serializer = Serializer(get_config("App", "secret_key"), expires_in=int(get_config("App", "token_duration")))
+
 add_extra_lib_path()
 
 packages = [m['name'].replace("/", ".") for m in list_processes()]
@@ -81,15 +103,53 @@ def describe():
     If the type is "int", "date" or "float" and there are more than two entries then it is a complete list of possible
         values.
 
+    The response is built once per version of the notebook repo and form settings and carries an etag, so
+    conditional requests get a 304. The gzipped and plain bodies differ byte for byte so each has its own etag.
+
     :return: a JSON encoded list of task description objects.
     """
     validate_app_key()
 
-    result = list_processes()
-    
-    dynamic_settings = fetch_form_settings()
+    document = _describe_document()
+    gzipped = 'gzip' in request.accept_encodings
+    etag = f"{document['etag']}-gzip" if gzipped else document['etag']
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif gzipped:
+        response = Response(document['gzip'], mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(document['body'], mimetype='application/json')
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    return response
+
 
-    return jsonify({'result':result, 'settings':dynamic_settings})
+_describe_cache = None
+
+
+def _describe_document():
+    """
+    Build the serialised describe response, only rebuilding it when the notebook repo or the form settings change.
+
+    :return: a dictionary with the json body, a gzipped copy of it and its etag.
+    """
+    global _describe_cache
+    version = (git_packages.repo_version(), form_settings_version())
+    document = _describe_cache
+    if document is None or document['version'] != version:
+        body = json.dumps({'result': list_processes(), 'settings': fetch_form_settings()}).encode("utf-8")
+        # built in full then swapped in, so requests on other threads never see half of an old and half of a new one.
+        document = {
+            'version': version,
+            'body': body,
+            'gzip': gzip.compress(body),
+            'etag': hashlib.sha256(body).hexdigest(),
+        }
+        _describe_cache = document
+        logging.info(f"rebuilt describe document for version {version}")
+    return document
 
 
 @app.route('/task/<task_id>', methods=['GET'])
@@ -97,45 +157,153 @@ def task_id(task_id):
     validate_app_key()
 
     logging.info(f"looking up task by id {task_id}")
-    i = celery_app.control.inspect()
+    task = task_index.get_task(task_id)
+
+    return jsonify([task] if task else [])
 
-    return jsonify(normalise_single_task(i.query_task(task_id)))
+
+def _int_arg(name, default, minimum):
+    """
+    Get a whole number query parameter, aborting with a 400 if it isn't one or is below the minimum.
+    """
+    value = request.args.get(name, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        abort(400, f"{name} must be a whole number")
+    if value < minimum:
+        abort(400, f"{name} must be at least {minimum}")
+    return value
 
 
 @app.route('/task/', methods=['GET'])
 def all_tasks():
-    validate_app_key()
+    """
+    List tasks from the task index, newest first.
 
-    logging.info("looking up all tasks...")
-    # note there must be a worker running or this won't return...
-    i = celery_app.control.inspect()
-    logging.info(f"got inspected {i}")
-    result = []
+    Optional query parameters `user` and `state` filter the list, `offset` and `limit` page through it. A limit over
+    `[App] max_task_page` is cut down to it.
+    """
+    validate_app_key()
 
-    result += [i.scheduled()]
-    logging.info("got schedules")
-    result += [i.active()]
-    logging.info("got active")
-    result += [i.reserved()]
-    logging.info("got reserved")
+    offset = _int_arg('offset', 0, minimum=0)
+    limit = min(_int_arg('limit', 100, minimum=1), int(get_config("App", "max_task_page")))
 
-    # TODO: normalise the details here. No one outside of the cluster cares about which tasks things are on
-    # That should not be a top level breakdown.
+    logging.info("looking up all tasks...")
+    result = task_index.list_tasks(
+        user=request.args.get('user'),
+        state=request.args.get('state'),
+        offset=offset,
+        limit=limit,
+    )
 
-    return jsonify(normalise_task_info(result))
+    return jsonify(result)
 
 
 @app.route('/result/<task_id>', methods=['GET'])
 def get_result(task_id):
+    """
+    Download the output zip of a task.
+
+    The S3 object is streamed through to the client in chunks rather than read into memory. Single Range and If-Range
+    requests are honoured so interrupted downloads can be resumed and If-None-Match is answered with a 304. Requests
+    for several ranges get the whole file.
+    If `AWS_PRESIGN_RESULTS` is set the client is redirected to a pre-signed S3 url instead.
+
+    :param task_id: id of the task to fetch the results of.
+    :return: a streamed response of the zip file.
+    """
     validate_app_key()
-    source_file_path = os.path.join(get_config("AWS", "path_prefix"), task_id + "_output.zip")
+    file_name = task_id + "_output.zip"
+    source_file_path = os.path.join(get_config("AWS", "path_prefix"), file_name)
+    bucket = get_config("AWS", "bucket")
+
+    s3 = s3_client(get_config("AWS", "end_point"))
+
+    if _to_bool(get_config("AWS", "presign_results")):
+        url = s3.generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': bucket,
+                'Key': source_file_path,
+                'ResponseContentDisposition': f"attachment; filename={file_name}",
+            },
+            ExpiresIn=int(get_config("AWS", "presign_expiry")),
+        )
+        return redirect(url)
+
+    try:
+        head = s3.head_object(Bucket=bucket, Key=source_file_path)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            abort(404, "no result found")
+        raise
+
+    etag = head['ETag'].strip('"')
+    size = head['ContentLength']
+    last_modified = head.get('LastModified')
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    byte_range = None
+    # several ranges would need a multipart response, the whole file is sent instead as the range header allows.
+    if request.range and len(request.range.ranges) == 1 and _if_range_matches(request.if_range, etag, last_modified):
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            raise RequestedRangeNotSatisfiable(length=size)
+
+    get_args = {}
+    if byte_range:
+        get_args['Range'] = f"bytes={byte_range[0]}-{byte_range[1] - 1}"
+    body = s3.get_object(Bucket=bucket, Key=source_file_path, **get_args)['Body']
+
+    response = Response(stream_with_context(_stream_body(body)), mimetype='application/zip', direct_passthrough=True)
+    response.headers['Content-Disposition'] = f"attachment; filename={file_name}"
+    response.accept_ranges = "bytes"
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    if byte_range:
+        response.status_code = 206
+        response.content_range = ContentRange("bytes", byte_range[0], byte_range[1], size)
+        response.content_length = byte_range[1] - byte_range[0]
+    else:
+        response.content_length = size
+    return response
+
+
+def _utc(moment):
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment.astimezone(timezone.utc)
+
+
+def _if_range_matches(if_range, etag, last_modified):
+    """
+    Check the If-Range of a range request, if the file has changed since the client got its copy the whole file is
+    sent rather than the range.
+
+    :param if_range: the parsed If-Range header, either an etag or an HTTP date.
+    :return: True if the range can be sent.
+    """
+    if if_range.etag:
+        return if_range.etag == etag
+    if if_range.date:
+        # HTTP dates are to the second, so only an exact match of the last modified time counts.
+        return last_modified is not None and _utc(if_range.date) == _utc(last_modified).replace(microsecond=0)
+    return True
+
 
-    s3_tools = S3Utils(get_config("AWS", "access_key_id"), get_config("AWS", "secret_access_key"),
-                       get_config("AWS", "bucket"), get_config("AWS", "end_point"),
-                       get_config("AWS", "region"))
-    obj = s3_tools.s3.Object(get_config("AWS", "bucket"), source_file_path)
-    stream = obj.get()['Body']
-    return send_file(BytesIO(stream.read()), mimetype='application/zip', as_attachment=True, attachment_filename=task_id + "_output.zip")
+def _stream_body(body):
+    """
+    Yield chunks from an S3 streaming body, making sure it is closed when the client goes away.
+    """
+    try:
+        for chunk in body.iter_chunks(int(get_config("AWS", "download_chunk_size"))):
+            yield chunk
+    finally:
+        body.close()
 
 
 @app.route('/token', methods=['POST'])
@@ -156,66 +324,298 @@ def get_token():
 
     logging.info(f"log in request for {payload['name']} from {request.remote_addr}")
 
-    if not users.check_user(user, payload['pass'], request.remote_addr):
+    throttle_keys = (f"user:{user}", f"ip:{request.remote_addr}")
+    if login_throttle.is_blocked(*throttle_keys):
+        logging.warning(f"too many failed log ins for {user} from {request.remote_addr}")
+        abort(429, "too many failed log in attempts")
+
+    try:
+        valid = users.check_user(user, payload['pass'], request.remote_addr)
+    except LoginBusyError:
+        abort(429, "server busy, try again later")
+
+    if not valid:
+        login_throttle.record_failure(*throttle_keys)
         abort(403, "bad creds")
+    login_throttle.reset(*throttle_keys)
 
-    s = Serializer(get_config("App", "secret_key"), expires_in=int(get_config("App", "token_duration")))
-    return jsonify({'token': s.dumps({'id': payload['name']}).decode("utf-8")})
+    return jsonify({'token': serializer.dumps({'id': payload['name']}).decode("utf-8")})
 
 
 @app.route('/refresh-token', methods=['POST'])
 def refresh_token():
     auth_response = validate_app_key()
     user_id = auth_response['user_id']
-    s = Serializer(get_config("App", "secret_key"), expires_in=int(get_config("App", "token_duration")))
-    return jsonify({'token': s.dumps({'id': user_id}).decode("utf-8")})
+    return jsonify({'token': serializer.dumps({'id': user_id}).decode("utf-8")})
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """
+    Counters from the api's internal caches, useful for checking they are doing their job.
+    """
+    validate_app_key()
+    return jsonify({'token_cache': token_cache.stats()})
+
+
+@app.route('/stats/tasks', methods=['GET'])
+def task_stats():
+    """
+    Summary of the recorded run times and resource use of each task type, per notebook version, so a change in a
+    notebook's cost shows up. The optional `name` query parameter limits it to one task type.
+    """
+    validate_app_key()
+    return jsonify(task_index.task_summaries(name=request.args.get('name')))
 
 
 @app.route('/task', methods=['POST'])
 def create_task():
     auth_response = validate_app_key()
 
-    global celery_app
+    payload = request.get_json()
+
+    try:
+        thing, validated, errors = _prepare_submission(payload, auth_response['user_id'])
+    except ValueError as e:
+        abort(400, str(e))
+
+    if errors:
+        logging.warning(f"invalid request: {errors}")
+        error_message = jsonify(errors)
+        error_message.status_code = 400
+        return error_message
+
+    args = validated.args
+    param_block = validated.to_params()
+    publish = payload.get('publish', None)
+    result_key = thing.result_cache_key(args, git_packages.repo_version())
+
+    memory_error = _memory_error(thing, args)
+    if memory_error:
+        abort(400, memory_error)
+
+    split = thing.split_submission(args)
+    # cheap submissions go to their own queue so they aren't stuck behind long runs.
+    route = thing.route(args)
+    kwargs = {'params': param_block, 'result_key': result_key}
+
+    if payload.get('profile'):
+        if not _is_admin(auth_response['user_id']):
+            abort(403, "only admin users can profile tasks")
+        if split:
+            abort(400, "runs split into parts can not be profiled, use a smaller AOI or date range")
+        # a profile is only useful from a real run, so never hand back a cached result.
+        future = thing.async_uncached(args=(publish,), kwargs=dict(kwargs, profile=True), **route)
+    # identical requests share a result unless the caller opts out, or wants the result published for them.
+    elif payload.get('use_cache', True) and not publish:
+        existing = thing.find_cached_result(result_key)
+        if existing:
+            logging.info(f"reusing task {existing} for {thing.name}")
+            return jsonify({'task_id': existing, 'cached': True})
+        if split:
+            future = thing.delay_parts(publish, validated, result_key, *split)
+        else:
+            future = thing.async_or_fail(args=(publish,), kwargs=kwargs, **route)
+    elif split:
+        future = thing.delay_parts(publish, validated, result_key, *split)
+    else:
+        future = thing.async_uncached(args=(publish,), kwargs=kwargs, **route)
+    # a split run starts once its parts are done, that isn't time spent waiting on the queue.
+    task_index.record_submission(future.task_id, thing.name, args, queue=None if split else route['queue'])
+
+    return jsonify({'task_id': future.task_id, 'cached': False, 'queue': route['queue']})
+
+
+@app.route('/tasks/batch', methods=['POST'])
+def create_task_batch():
+    """
+    Submit many tasks at once.
+
+    The payload has a `tasks` list where each entry looks like the payload of a single `/task` submission, and
+    optional `publish` and `use_cache` defaults. Every entry is validated. As with `/task`, an entry that isn't
+    published and doesn't opt out of the cache reuses a finished or running task with the same result, including an
+    identical entry earlier in the batch. The rest are published together as one celery group over a single broker
+    connection.
+
+    :return: the group id, null if nothing new was started, and, in submission order, either the task id and whether
+        it was reused or the validation errors of each entry.
+    """
+    auth_response = validate_app_key()
+
+    payload = request.get_json()
+    submissions = payload.get('tasks') if payload else None
+    if not submissions:
+        abort(400, "no tasks")
+
+    max_batch_size = int(get_config("App", "max_batch_size"))
+    if len(submissions) > max_batch_size:
+        abort(400, f"too many tasks, at most {max_batch_size} can be submitted at once")
+
+    instances = {}
+    results = []
+    signatures = []
+    valid = []
+    # result keys of the entries being started by this batch, to the position of their signature.
+    started = {}
+    repeated = []
+    for index, submission in enumerate(submissions):
+        try:
+            thing, validated, errors = _prepare_submission(submission, auth_response['user_id'], instances)
+        except ValueError as e:
+            errors = [str(e)]
+
+        if not errors and thing.split_submission(validated.args):
+            errors = ["too large for a batch submission, submit it on its own to have it split into parts"]
+        if not errors:
+            memory_error = _memory_error(thing, validated.args)
+            if memory_error:
+                errors = [memory_error]
+
+        if errors:
+            results.append({'index': index, 'errors': errors})
+            continue
+
+        publish = submission.get('publish', payload.get('publish', None))
+        result_key = thing.result_cache_key(validated.args, git_packages.repo_version())
+        if submission.get('use_cache', payload.get('use_cache', True)) and not publish:
+            existing = thing.find_cached_result(result_key)
+            if existing:
+                logging.info(f"reusing task {existing} for {thing.name}")
+                results.append({'index': index, 'task_id': existing, 'cached': True})
+                continue
+            if result_key in started:
+                repeated.append((index, started[result_key]))
+                continue
+            started[result_key] = len(signatures)
+        route = thing.route(validated.args)
+        signatures.append(thing.signature(args=(publish,),
+                                          kwargs={"params": validated.to_params(), "result_key": result_key},
+                                          **route))
+        valid.append((index, thing, validated.args, route['queue']))
+
+    if not signatures and all('errors' in r for r in results):
+        logging.warning(f"invalid batch request: {results}")
+        error_message = jsonify({'group_id': None, 'tasks': results})
+        error_message.status_code = 400
+        return error_message
+
+    group_id = None
+    if signatures:
+        group_result = group(signatures, app=celery_app).apply_async()
+        group_result.save()
+        group_id = group_result.id
+
+        for (index, thing, args, queue), future in zip(valid, group_result.results):
+            task_index.record_submission(future.task_id, thing.name, args, queue=queue)
+            results.append({'index': index, 'task_id': future.task_id, 'cached': False})
+        for index, position in repeated:
+            results.append({'index': index, 'task_id': group_result.results[position].task_id, 'cached': True})
+
+    results.sort(key=lambda r: r['index'])
+    return jsonify({'group_id': group_id, 'tasks': results})
+
+
+@app.route('/estimate', methods=['POST'])
+def estimate_task():
+    """
+    Estimate how long a submission will take, how much memory it will need and how long it will wait to start,
+    from the history of runs of the same task. Takes the same payload as `/task`.
+
+    :return: the queue it would be sent to, its cost and the estimates, which are null until the task has been run
+        enough times to estimate it.
+    """
+    auth_response = validate_app_key()
 
     payload = request.get_json()
+    try:
+        thing, validated, errors = _prepare_submission(payload, auth_response['user_id'])
+    except ValueError as e:
+        abort(400, str(e))
+
+    if errors:
+        error_message = jsonify(errors)
+        error_message.status_code = 400
+        return error_message
+
+    args = validated.args
+    route = thing.route(args)
+    expected = estimates.estimate_submission(thing, args) or {}
+    return jsonify({
+        'task': thing.name,
+        'queue': route['queue'],
+        'cost': round(thing.estimate_cost(args), 3),
+        'seconds': expected.get('seconds'),
+        'peak_memory_bytes': expected.get('peak_memory_bytes'),
+        'parts': expected.get('parts', 1),
+        'samples': expected.get('samples', 0),
+        'queue_wait_seconds': estimates.queue_wait(route['queue']),
+    })
+
+
+def _memory_error(thing, args):
+    """
+    Check a submission isn't expected to need more memory than a worker has, when a limit is configured.
+
+    :return: an error message, or None if it is fine or there isn't enough history to tell.
+    """
+    limit = int(get_config("Estimates", "max_memory_bytes"))
+    if not limit:
+        return None
+    expected = estimates.estimate_submission(thing, args)
+    if expected and expected['peak_memory_bytes'] > limit:
+        return f"expected to need {expected['peak_memory_bytes']} bytes of memory, more than the {limit} a worker has. " \
+               f"Use a smaller AOI, shorter date range or coarser resolution"
+    return None
 
-    if not is_valid_task(payload['task']):
-        logging.info(f"invalid task payload {payload}")
-        abort(400, "invalid task")
 
-    thing = load_task_instance(payload['task'])
-    thing.app = celery_app
+def _is_admin(user_id):
+    admins = [u.strip() for u in get_config("App", "admin_users").split(",")]
+    return bool(user_id) and user_id in admins
+
+
+def _prepare_submission(payload, user_id, instances=None):
+    """
+    Validate a task submission and build its arguments.
+
+    :param payload: the submission, with the `task` name and its `args`.
+    :param user_id: the user making the submission.
+    :param instances: optional dictionary of already loaded task instances by name, to share between submissions.
+    :return: a tuple of the task instance, the ValidatedRequest and a list of validation errors.
+    :raises ValueError: if the task or one of its parameters is not valid.
+    """
+    if not is_valid_task(payload.get('task')):
+        logging.info(f"invalid task payload {payload}")
+        raise ValueError("invalid task")
+
+    if instances is not None and payload['task'] in instances:
+        thing = instances[payload['task']]
+    else:
+        thing = load_task_instance(payload['task'])
+        thing.app = celery_app
+        if instances is not None:
+            instances[payload['task']] = thing
     logging.info(f"found {thing.name} wanted {payload['task']}")
     logging.info(f"parms: {[p.name for p in thing.parameters]}")
     # work out the args mapping
-    args = {'user': auth_response['user_id']}
+    args = {'user': user_id}
 
     for (k, v) in payload['args'].items():
+        v = thing.parse_arg(k, v)
         valid, msg = thing.validate_arg(k, v)
         if valid:
             args[k] = v
         else:
             logging.info(f"invalid request. Parameter '{k}' of task '{payload['task']}' failed validation, {msg}")
-            abort(400, f"invalid parameter {k}, {msg}")
+            raise ValueError(f"invalid parameter {k}, {msg}")
 
     errors = thing.standard_validation(args)
-    
+
     if hasattr(thing, 'validate_args'):
         process_specific_validation = thing.validate_args(args)
         if process_specific_validation:
             errors += process_specific_validation
 
-    if errors:
-        logging.warning(f"invalid request: {errors}")
-        error_message = jsonify(errors)
-        error_message.status_code = 400
-        return error_message
-
-    param_block = json.dumps(args)
-
-    future = thing.delay_or_fail(payload.get('publish', None), **{"params": param_block}, use_cache=False)
-
-    return jsonify({'task_id': future.task_id})
+    return thing, ValidatedRequest(thing, args), errors
 
 
 @app.route('/validate-aoi', methods=['POST'])
@@ -234,46 +634,12 @@ def check_data_availability():
     validate_app_key()
 
     data = request.get_json()
-    return check_database_spatial(data['aoi'], data['platform'], data['startDate'], data['endDate'])
-
-def normalise_single_task(info):
-    result = []
-    if info:
-        for (server, things) in info.items():
-            if things:
-                for (_, tasks) in things.items():
-                    (state, t) = tasks
-
-                    result += [{
-                        "id": t['id'],
-                        "name": t['name'],
-                        "time_start": t['time_start'],
-                        "args": t['kwargs'],
-                        "ack": t['acknowledged'],
-                        "server": server,
-                        "state": state
-                    }]
-
-    return result
-
-
-def normalise_task_info(info):
-    result = []
-
-    for section in info:
-        if section:
-            for (server, tasks) in section.items():
-                for t in tasks:
-                    result += [{
-                        "id": t['id'],
-                        "name": t['name'],
-                        "time_start": t['time_start'],
-                        "args": t['kwargs'],
-                        "ack": t['acknowledged'],
-                        "server": server
-                    }]
-
-    return result
+    try:
+        return check_database_spatial(data['aoi'], data['platform'], data['startDate'], data['endDate'],
+                                      exists_only=_to_bool(str(data.get('existsOnly', False))))
+    except DatabaseBusyError as e:
+        logging.warning(f"data availability check refused: {e}")
+        abort(503, "database busy, try again later")
 
 
 def validate_app_key():
@@ -284,11 +650,18 @@ def validate_app_key():
 
     if _to_bool(get_config("App", "require_auth")):
         if 'APP_KEY' in request.args:
-            s = Serializer(get_config("App", "secret_key"))
+            token = request.args['APP_KEY']
+            user_id = token_cache.get(token)
+            if user_id is not None:
+                return {
+                    'user_id': user_id,
+                    'valid_user': True
+                }
             try:
-                data = s.loads(request.args['APP_KEY'])
+                data, header = serializer.loads(token, return_header=True)
                 if not is_username_valid(data['id']):
                     abort(403, "Invalid Username")
+                token_cache.put(token, data['id'], header['exp'])
                 return {
                     'user_id': data['id'],
                     'valid_user': True
@@ -0,0 +1,305 @@
+"""
+Building the output zip archives.
+
+Every file gets its own compression. Formats that are already compressed (PNG, JPEG, zips, ...) are stored as they
+are. For everything else a sample is taken from the start, middle and end of the file and compressed, if that doesn't
+shrink it by much, e.g. a GeoTIFF with internal compression, the file is stored, otherwise it is deflated.
+
+Deflating big files is the slow part of building an archive, so files over `parallel_threshold` are cut into blocks
+that are compressed on a pool of threads, zlib lets go of the GIL while it works, and joined back into a single
+deflate stream the same way pigz does it.
+
+zipfile can't be handed a stream that is already compressed, so the archive is written by `ZipWriter`, which streams
+each member followed by its crc and sizes the same way zipfile does for outputs it can't seek in. The result is an
+ordinary zip any reader can open.
+"""
+import collections
+import logging
+import os
+import struct
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from cubequery import get_config
+
+_stored_extensions = frozenset([
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.jp2',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.kmz',
+])
+
+_window_size = 32 * 1024  # deflate can only refer back this far, so this is all of the last block the next one needs
+
+
+class ParallelDeflater(object):
+    """
+    A raw deflate compressor with the same compress and flush methods as a zlib one, compressing blocks of the input
+    on a thread pool.
+
+    Each block is compressed on its own, primed with the end of the block before it, and finished with a sync flush
+    so the compressed blocks can simply be joined together. At most `max_pending` blocks are held at once.
+    """
+
+    def __init__(self, pool, level=6, block_size=1024 * 1024, max_pending=8):
+        self.level = level
+        self.block_size = block_size
+        self._pool = pool
+        self._max_pending = max_pending
+        self._buffer = bytearray()
+        self._previous = b''
+        self._pending = collections.deque()
+        self._ready = []
+
+    def _compress_block(self, block, dictionary):
+        if dictionary:
+            c = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+        else:
+            c = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return c.compress(block) + c.flush(zlib.Z_SYNC_FLUSH)
+
+    def _submit(self, block):
+        while len(self._pending) >= self._max_pending:
+            self._ready.append(self._pending.popleft().result())
+        self._pending.append(self._pool.submit(self._compress_block, block, self._previous))
+        self._previous = block[-_window_size:]
+
+    def _take_ready(self):
+        while self._pending and self._pending[0].done():
+            self._ready.append(self._pending.popleft().result())
+        data = b''.join(self._ready)
+        self._ready = []
+        return data
+
+    def compress(self, data):
+        self._buffer.extend(data)
+        while len(self._buffer) >= self.block_size:
+            block = bytes(self._buffer[:self.block_size])
+            del self._buffer[:self.block_size]
+            self._submit(block)
+        return self._take_ready()
+
+    def flush(self):
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while self._pending:
+            self._ready.append(self._pending.popleft().result())
+        # an empty final block marks the end of the stream.
+        self._ready.append(zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS).flush())
+        return self._take_ready()
+
+
+_zip64_limit = 0xFFFFFFFF
+_zip_version = 45  # zip64
+_unix = 3
+_utf8_names = 0x800
+_data_descriptor = 0x08
+
+
+def _dos_time(timestamp):
+    year, month, day, hour, minute, second = time.localtime(timestamp)[:6]
+    if year < 1980:
+        return 0, (1 << 5) | 1
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+class ZipWriter(object):
+    """
+    Writes a zip archive a member at a time to anything with a write method. Each member's data is followed by a
+    data descriptor with its crc and zip64 sizes, so nothing has to be gone back and changed and members can be any
+    size.
+
+    :param output: file object to write the archive to, offsets are counted from where it is when given.
+    """
+
+    def __init__(self, output):
+        self._output = output
+        self._position = 0
+        self._entries = []
+
+    def _write(self, data):
+        self._output.write(data)
+        self._position += len(data)
+
+    @property
+    def bytes_written(self):
+        return self._position
+
+    def add(self, file_path, arcname, compress_type, compressor=None, chunk_size=1024 * 1024):
+        """
+        Add a file to the archive.
+
+        :param compress_type: zipfile.ZIP_STORED or zipfile.ZIP_DEFLATED.
+        :param compressor: for deflated files, something with the compress and flush methods of a raw deflate zlib
+            compressor.
+        """
+        stat = os.stat(file_path)
+        name = arcname.encode('utf-8')
+        flags = _data_descriptor | (0 if len(name) == len(arcname) else _utf8_names)
+        dos_time, dos_date = _dos_time(stat.st_mtime)
+        offset = self._position
+
+        # zeros for the crc and sizes, they come after the data. The zip64 extra says the descriptor sizes are 8 bytes.
+        extra = struct.pack('<HHQQ', 1, 16, 0, 0)
+        self._write(struct.pack('<4sHHHHHLLLHH', b'PK\x03\x04', _zip_version, flags, compress_type, dos_time,
+                                dos_date, 0, 0, 0, len(name), len(extra)) + name + extra)
+
+        crc = 0
+        size = 0
+        compressed_size = 0
+        with open(file_path, 'rb') as src:
+            for chunk in iter(lambda: src.read(chunk_size), b''):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                compressed_size += len(chunk)
+                self._write(chunk)
+        if compressor is not None:
+            tail = compressor.flush()
+            compressed_size += len(tail)
+            self._write(tail)
+
+        self._write(struct.pack('<4sLQQ', b'PK\x07\x08', crc, compressed_size, size))
+        self._entries.append((name, flags, compress_type, dos_time, dos_date, crc, compressed_size, size,
+                              (stat.st_mode & 0xFFFF) << 16, offset))
+
+    def close(self):
+        """
+        Write the central directory, the archive is complete after this.
+        """
+        start = self._position
+        for name, flags, compress_type, dos_time, dos_date, crc, compressed_size, size, attributes, offset in \
+                self._entries:
+            # anything too big for the usual fields goes in a zip64 extra, in this order.
+            large = [v for v in (size, compressed_size, offset) if v >= _zip64_limit]
+            extra = struct.pack(f'<HH{len(large)}Q', 1, 8 * len(large), *large) if large else b''
+            self._write(struct.pack('<4sBBBBHHHHLLLHHHHHLL', b'PK\x01\x02', _zip_version, _unix, _zip_version, 0,
+                                    flags, compress_type, dos_time, dos_date, crc,
+                                    min(compressed_size, _zip64_limit), min(size, _zip64_limit), len(name),
+                                    len(extra), 0, 0, 0, attributes, min(offset, _zip64_limit)) + name + extra)
+        directory_size = self._position - start
+        count = len(self._entries)
+
+        if count >= 0xFFFF or start >= _zip64_limit or directory_size >= _zip64_limit:
+            end = self._position
+            self._write(struct.pack('<4sQHHLLQQQQ', b'PK\x06\x06', 44, _zip_version, _zip_version, 0, 0, count, count,
+                                    directory_size, start))
+            self._write(struct.pack('<4sLQL', b'PK\x06\x07', 0, end, 1))
+        self._write(struct.pack('<4sHHHHLLH', b'PK\x05\x06', 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                                min(directory_size, _zip64_limit), min(start, _zip64_limit), 0))
+
+
+class ArchivePolicy(object):
+    """
+    Decides how each file is compressed and writes the archives.
+
+    :param level: deflate level used for files that are compressed.
+    :param probe_size: size of each of the three samples taken to see how well a file compresses.
+    :param store_ratio: files whose sample doesn't compress below this fraction of its size are stored.
+    :param parallel_threshold: deflated files at least this big are compressed on several threads.
+    :param block_size: size of the blocks files are cut into for parallel compression.
+    :param threads: threads used for parallel compression, 0 for one per cpu.
+    """
+
+    def __init__(self, level=6, probe_size=64 * 1024, store_ratio=0.9, parallel_threshold=32 * 1024 * 1024,
+                 block_size=1024 * 1024, threads=0):
+        self.level = level
+        self.probe_size = probe_size
+        self.store_ratio = store_ratio
+        self.parallel_threshold = parallel_threshold
+        self.block_size = block_size
+        self.threads = threads or os.cpu_count() or 1
+
+    def _sample(self, file_path, size):
+        with open(file_path, 'rb') as f:
+            if size <= self.probe_size * 3:
+                return f.read()
+            chunks = []
+            for offset in (0, (size - self.probe_size) // 2, size - self.probe_size):
+                f.seek(offset)
+                chunks.append(f.read(self.probe_size))
+            return b''.join(chunks)
+
+    def choose(self, file_path, size=None):
+        """
+        Work out how a file should be compressed.
+
+        :return: zipfile.ZIP_STORED or zipfile.ZIP_DEFLATED
+        """
+        if os.path.splitext(file_path)[1].lower() in _stored_extensions:
+            return zipfile.ZIP_STORED
+        if size is None:
+            size = os.path.getsize(file_path)
+        sample = self._sample(file_path, size)
+        if not sample or len(zlib.compress(sample, 1)) > len(sample) * self.store_ratio:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def write(self, output, files):
+        """
+        Write files into a zip archive.
+
+        :param output: path or file object to write the archive to.
+        :param files: list of (path, name in the archive) tuples.
+        :return: a dictionary of how long the archive took to build, its size and how the files were compressed.
+        """
+        if not hasattr(output, 'write'):
+            with open(output, 'wb') as f:
+                return self.write(f, files)
+
+        start = time.perf_counter()
+        stats = {'files': 0, 'input_bytes': 0, 'stored': 0, 'deflated': 0, 'parallel': 0}
+
+        writer = ZipWriter(output)
+        pool = None
+        try:
+            for file_path, arcname in files:
+                size = os.path.getsize(file_path)
+                compression = self.choose(file_path, size)
+                compressor = None
+                if compression == zipfile.ZIP_DEFLATED and size >= self.parallel_threshold:
+                    if pool is None:
+                        pool = ThreadPoolExecutor(max_workers=self.threads)
+                    compressor = ParallelDeflater(pool, self.level, self.block_size, max_pending=self.threads * 2)
+                    stats['parallel'] += 1
+                elif compression == zipfile.ZIP_DEFLATED:
+                    compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+                writer.add(file_path, arcname, compression, compressor, self.block_size)
+                stats['stored' if compression == zipfile.ZIP_STORED else 'deflated'] += 1
+                stats['files'] += 1
+                stats['input_bytes'] += size
+            writer.close()
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True)
+
+        stats['output_bytes'] = writer.bytes_written
+        stats['seconds'] = round(time.perf_counter() - start, 3)
+        return stats
+
+
+def archive_policy():
+    """
+    Get the archive policy set up in the config file.
+    """
+    return ArchivePolicy(
+        level=int(get_config("Archive", "deflate_level")),
+        probe_size=int(get_config("Archive", "probe_size")),
+        store_ratio=float(get_config("Archive", "store_ratio")),
+        parallel_threshold=int(get_config("Archive", "parallel_threshold")),
+        block_size=int(get_config("Archive", "block_size")),
+        threads=int(get_config("Archive", "threads")),
+    )
+
+
+if __name__ == '__main__':
+    # time building an archive from the files given on the command line.
+    import io
+    import sys
+
+    buffer = io.BytesIO()
+    result = ArchivePolicy().write(buffer, [(f, os.path.basename(f)) for f in sys.argv[1:]])
+    logging.basicConfig(level=logging.INFO)
+    logging.info(f"archive stats {result}")
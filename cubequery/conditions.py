@@ -0,0 +1,168 @@
+"""
+The conditions from input_conditions.json compiled into validators.
+
+input_conditions.json maps a parameter (e.g. platform) to a list of values, each with a list of conditions that other
+parameters must meet when that value is chosen. Rather than walk that structure on every submission it is compiled
+once into a lookup from (parameter, value) to validator functions, with the list for each process worked out the
+first time that process is seen. The compiled conditions are rebuilt when the settings file changes.
+
+New condition types can be added with the `condition_type` decorator. A builder takes the condition dictionary from
+the json and returns a function that takes the submission arguments and returns how many of them fail the condition,
+each failure is reported as an error.
+"""
+import logging
+from datetime import datetime
+
+from cubequery import fetch_form_settings, form_settings_version
+
+_condition_builders = {}
+
+
+def condition_type(name):
+    """
+    Register a builder for a type of condition.
+    """
+    def register(builder):
+        _condition_builders[name] = builder
+        return builder
+    return register
+
+
+def create_error_message(condition):
+    return {'Key': condition['id'], 'Error': condition['error_message'], 'Comment': condition['_comment']}
+
+
+def _range_check(lower, upper, convert):
+    def check(value):
+        try:
+            value = convert(value)
+        except (TypeError, ValueError):
+            return False
+        if value < lower:
+            return False
+        return upper is None or value <= upper
+    return check
+
+
+def _check_ids(condition, check):
+    ids = condition['id']
+
+    def validate(args):
+        return sum(1 for c in ids if c in args and not check(args[c]))
+    return validate
+
+
+@condition_type('int_range')
+def _int_range(condition):
+    lower = condition['value'][0]
+    upper = condition['value'][1] if len(condition['value']) == 2 else None
+    return _check_ids(condition, _range_check(lower, upper, int))
+
+
+def _iso_date(value):
+    """
+    Normalise a date string to YYYY-MM-DD so dates can be compared as strings.
+    Dates already in that form, the vast majority, are used as they are rather than parsed.
+    """
+    if len(value) == 10 and value[4] == '-' and value[7] == '-':
+        return value
+    return datetime.strptime(value, "%Y-%m-%d").date().isoformat()
+
+
+@condition_type('date_range')
+def _date_range(condition):
+    lower = _iso_date(condition['value'][0])
+    upper = _iso_date(condition['value'][1]) if len(condition['value']) == 2 else None
+    return _check_ids(condition, _range_check(lower, upper, _iso_date))
+
+
+class CompiledConditions(object):
+    def __init__(self, settings):
+        # in the order the settings declare them, so errors always come back in the same order.
+        self.parameters = []
+        self._rules = {}
+        self._by_process = {}
+
+        for parameter, values in settings.items():
+            self.parameters.append(parameter)
+            for d in values:
+                rules = self._rules.setdefault((parameter, d['name']), [])
+                for condition in d['conditions']:
+                    builder = _condition_builders.get(condition['type'])
+                    if builder is None:
+                        logging.warning(f"unknown condition type {condition['type']} for {parameter} {d['name']}")
+                        continue
+                    processes = frozenset(condition['processes']) if 'processes' in condition else None
+                    rules.append((processes, builder(condition), create_error_message(condition)))
+
+    def _rules_for(self, parameter, value, process):
+        declared = self._rules.get((parameter, value))
+        if not declared:
+            # only values the settings declare are remembered, so submissions can't grow the lookup without bound.
+            return []
+        key = (parameter, value, process)
+        rules = self._by_process.get(key)
+        if rules is None:
+            rules = [(validate, error) for (processes, validate, error) in declared
+                     if processes is None or process in processes]
+            self._by_process[key] = rules
+        return rules
+
+    def validate(self, process, args):
+        """
+        Check submission arguments against the conditions.
+
+        :param process: name of the process being submitted.
+        :param args: the submission arguments.
+        :return: a list of error messages, empty if everything is fine.
+        """
+        errors = []
+        for parameter in self.parameters:
+            if parameter not in args:
+                continue
+            try:
+                rules = self._rules_for(parameter, args[parameter], process)
+            except TypeError:
+                # unhashable values, e.g. lists, can't match any of the named values.
+                continue
+            for validate, error in rules:
+                for _ in range(validate(args)):
+                    errors.append(dict(error))
+        return errors
+
+
+_compiled = None
+_compiled_version = None
+
+
+def compiled_conditions():
+    """
+    Get the compiled conditions, recompiling them if the settings file has changed.
+    """
+    global _compiled, _compiled_version
+    version = form_settings_version()
+    if _compiled is None or version != _compiled_version:
+        _compiled = CompiledConditions(fetch_form_settings())
+        _compiled_version = version
+    return _compiled
+
+
+if __name__ == '__main__':
+    # time compiling the conditions and validating a submission with them.
+    import timeit
+
+    settings = fetch_form_settings()
+    submission = {
+        'user': 'basic',
+        'platform': 'landsat_7',
+        'res': '30',
+        'baseline_time_start': '2000-01-01',
+        'baseline_time_end': '2001-01-01',
+        'analysis_time_start': '2010-01-01',
+        'analysis_time_end': '2011-01-01',
+    }
+    compile_time = timeit.timeit(lambda: CompiledConditions(settings), number=100) / 100
+    conditions = CompiledConditions(settings)
+    validate_time = timeit.timeit(
+        lambda: conditions.validate('processes.aggregate_indices.AggregateIndices', submission), number=10000) / 10000
+    print(f"compile {compile_time * 1e6:.1f}us, validate {validate_time * 1e6:.1f}us per submission")
@@ -0,0 +1,274 @@
+"""
+The dask cluster task runs compute on, and the chunk sizes they load data with.
+
+Each worker host runs its own dask cluster rather than every task talking to a separately operated scheduler. The celery
+main process starts a `LocalCluster` when the worker starts, sized to the cpus and memory the container is allowed
+(from its cgroup limits, falling back to the whole machine) and the forked worker processes all connect to it, so every
+task on the host shares the same dask workers. Setting `[Dask] scheduler_address` uses an existing scheduler instead.
+
+Datasets are loaded with chunks sized for the run: big enough that dask isn't swamped with tiny tasks, small enough
+that each worker can hold several at once, and no bigger than the AOI itself.
+
+distributed is only imported when a cluster or client is needed, so the api server doesn't need it installed.
+"""
+import inspect
+import logging
+import math
+import os
+
+from celery.signals import worker_init, worker_process_init, worker_shutdown
+from datacube import Datacube
+from datacube.utils import geometry
+from datacube.utils.geometry import GeoBox
+
+from cubequery import get_config
+from cubequery.resources import ProcessResource
+
+# a container without a limit reports a huge number rather than nothing.
+_unlimited = 1 << 60
+# metres per degree of latitude, and of longitude at the equator.
+_metres_per_degree_lat = 110574
+_metres_per_degree_lon = 111320
+_chunk_align = 256
+_min_chunk_side = 256
+_max_time_chunk = 32
+
+_cluster = None
+_scheduler_address = None
+
+
+def _read_first_line(path):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def container_cpus(cgroup_root="/sys/fs/cgroup"):
+    """
+    The number of cpus this process may use, taking the container cpu quota into account.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    quota = None
+    v2 = _read_first_line(os.path.join(cgroup_root, "cpu.max"))
+    if v2:
+        limit, period = v2.split()
+        if limit != "max":
+            quota = int(limit) / int(period)
+    else:
+        limit = _read_first_line(os.path.join(cgroup_root, "cpu", "cpu.cfs_quota_us"))
+        period = _read_first_line(os.path.join(cgroup_root, "cpu", "cpu.cfs_period_us"))
+        if limit and period and int(limit) > 0:
+            quota = int(limit) / int(period)
+
+    if quota is not None:
+        cpus = min(cpus, max(1, int(math.ceil(quota))))
+    return cpus
+
+
+def container_memory(cgroup_root="/sys/fs/cgroup"):
+    """
+    The bytes of memory this process may use, taking the container memory limit into account.
+    """
+    memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    for path in [os.path.join(cgroup_root, "memory.max"),
+                 os.path.join(cgroup_root, "memory", "memory.limit_in_bytes")]:
+        limit = _read_first_line(path)
+        if limit and limit != "max" and int(limit) < _unlimited:
+            return min(memory, int(limit))
+    return memory
+
+
+def cluster_size():
+    """
+    Work out the shape of the local cluster from the config and the container limits.
+
+    :return: the number of workers, threads per worker and the memory limit of each worker in bytes.
+    """
+    cpus = container_cpus()
+    workers = int(get_config("Dask", "workers")) or cpus
+    threads = int(get_config("Dask", "threads_per_worker")) or max(1, cpus // workers)
+    memory = int(container_memory() * float(get_config("Dask", "memory_fraction")))
+    return workers, threads, memory // workers
+
+
+def start_cluster():
+    """
+    Start the local cluster, if there isn't already one, and remember where its scheduler is.
+    Processes forked after this inherit the address and connect to the same cluster.
+    """
+    global _cluster, _scheduler_address
+    if _cluster is not None:
+        return _scheduler_address
+    from distributed import LocalCluster
+
+    workers, threads, memory = cluster_size()
+    logging.info(f"starting dask cluster of {workers} workers with {threads} threads and {memory} bytes each")
+    _cluster = LocalCluster(n_workers=workers, threads_per_worker=threads, memory_limit=memory, processes=True,
+                            dashboard_address=get_config("Dask", "dashboard_address") or None)
+    _scheduler_address = _cluster.scheduler_address
+    return _scheduler_address
+
+
+def stop_cluster():
+    global _cluster, _scheduler_address
+    if _cluster is not None:
+        _cluster.close()
+    _cluster = None
+    _scheduler_address = None
+
+
+def _connect():
+    from distributed import Client
+
+    address = get_config("Dask", "scheduler_address") or _scheduler_address
+    if not address:
+        # not started by a celery worker, e.g. a solo pool or notebook validation, so this process runs the cluster.
+        address = start_cluster()
+    return Client(address, set_as_default=True)
+
+
+def _check_client(client):
+    if client.status != "running":
+        raise IOError(f"dask client is {client.status}")
+
+
+_client = ProcessResource(_connect, check=_check_client, check_interval=60, close=lambda c: c.close())
+
+
+def dask_client():
+    """
+    Get the dask client of this process, connected to the cluster of the host.
+    """
+    return _client.get()
+
+
+def chunk_sizes(bounds, resolution, worker_memory, target_bytes, pixel_bytes=4, chunks_per_worker=16):
+    """
+    Pick the dask chunks to load an area with.
+
+    :param bounds: the (min x, min y, max x, max y) of the AOI in degrees.
+    :param resolution: the size of a pixel in metres.
+    :param worker_memory: the memory limit of each dask worker in bytes.
+    :param target_bytes: the largest chunk wanted, in bytes.
+    :param pixel_bytes: the bytes per pixel of each band once loaded.
+    :param chunks_per_worker: how many chunks a worker should be able to hold in memory at once.
+    :return: a dictionary of the time, x (columns) and y (rows) chunk sizes.
+    """
+    min_x, min_y, max_x, max_y = bounds
+    resolution = abs(float(resolution))
+    latitude = math.radians((min_y + max_y) / 2)
+    width = max(1, int(math.ceil((max_x - min_x) * _metres_per_degree_lon * math.cos(latitude) / resolution)))
+    height = max(1, int(math.ceil((max_y - min_y) * _metres_per_degree_lat / resolution)))
+
+    chunk_bytes = max(_min_chunk_side * _min_chunk_side * pixel_bytes,
+                      min(target_bytes, worker_memory // chunks_per_worker))
+    side = int(math.sqrt(chunk_bytes / pixel_bytes)) // _chunk_align * _chunk_align
+    side = max(_min_chunk_side, side)
+    x = min(side, width)
+    y = min(side, height)
+    # an AOI smaller than a chunk gets several time steps per chunk instead.
+    time = max(1, min(_max_time_chunk, chunk_bytes // (x * y * pixel_bytes)))
+    return {'time': time, 'x': x, 'y': y}
+
+
+def run_chunk_sizes(bounds, resolution):
+    """
+    Chunk sizes for a run on this host, using the config and the size of the cluster workers.
+    """
+    _, _, worker_memory = cluster_size()
+    if resolution is None:
+        resolution = float(get_config("Dask", "default_resolution"))
+    return chunk_sizes(bounds, resolution, worker_memory,
+                       int(get_config("Dask", "chunk_bytes")), pixel_bytes=int(get_config("Dask", "pixel_bytes")))
+
+
+class ChunkedDatacube(object):
+    """
+    A Datacube whose loads use the given dask chunks unless the caller picks their own, passing `dask_chunks=None`
+    still loads without dask. Everything else is passed through to the wrapped Datacube.
+
+    datacube refuses chunks for dimensions the load won't have, so the x and y sizes are given to whichever spatial
+    dimensions the output crs has, y and x or latitude and longitude.
+
+    :param dc: the Datacube to wrap.
+    :param dask_chunks: the default chunk sizes, a dictionary of time, x (columns) and y (rows).
+    :param dask_client: the client for the cluster the run should compute on.
+    """
+
+    def __init__(self, dc, dask_chunks, dask_client=None):
+        self._dc = dc
+        self.dask_chunks = dask_chunks
+        self.dask_client = dask_client
+
+    def chunks_for(self, dimensions):
+        """
+        The chunks for a load whose spatial dimensions are `dimensions`, rows first as in `GeoBox.dimensions`.
+        """
+        rows, columns = dimensions
+        return {'time': self.dask_chunks['time'], rows: self.dask_chunks['y'], columns: self.dask_chunks['x']}
+
+    def output_dimensions(self, product=None, output_crs=None, like=None, datasets=None):
+        """
+        The spatial dimensions a load will have, worked out the same way datacube picks the output crs.
+
+        :return: the dimension names, or None if they can't be told before loading.
+        """
+        if like is not None:
+            return (like if isinstance(like, GeoBox) else like.geobox).dimensions
+        if output_crs is not None:
+            return geometry.CRS(output_crs).dimensions
+        if product is None and isinstance(datasets, (list, tuple)) and datasets:
+            product = datasets[0].product
+        elif isinstance(product, str):
+            product = self._dc.index.products.get_by_name(product)
+        if product is None:
+            return None
+        crs = product.load_hints().get('output_crs')
+        if crs is None and product.grid_spec is not None:
+            crs = product.grid_spec.crs
+        return geometry.CRS(crs).dimensions if crs is not None else None
+
+    def load(self, *args, **kwargs):
+        arguments = inspect.signature(Datacube.load).bind(self._dc, *args, **kwargs).arguments
+        if 'dask_chunks' not in arguments and self.dask_chunks is not None:
+            dimensions = self.output_dimensions(arguments.get('product'), arguments.get('output_crs'),
+                                                arguments.get('like'), arguments.get('datasets'))
+            if dimensions is not None:
+                kwargs['dask_chunks'] = self.chunks_for(dimensions)
+        return self._dc.load(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._dc, name)
+
+
+@worker_init.connect
+def _start_host_cluster(**kwargs):
+    if get_config("Dask", "scheduler_address"):
+        return
+    try:
+        start_cluster()
+    except Exception as e:
+        logging.warning(f"could not start the dask cluster, worker processes will start their own: {e}")
+
+
+@worker_shutdown.connect
+def _stop_host_cluster(**kwargs):
+    stop_cluster()
+
+
+@worker_process_init.connect
+def _init_worker_process(**kwargs):
+    global _cluster
+    # the cluster belongs to the main process, only its address is of any use here.
+    _cluster = None
+    _client.after_fork()
+    try:
+        dask_client()
+    except Exception as e:
+        logging.warning(f"could not connect to the dask cluster, will try again on first use: {e}")
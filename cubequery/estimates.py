@@ -0,0 +1,149 @@
+"""
+Predicting how long a run will take and how much memory it will need from the runs that came before it.
+
+Every finished run keeps its size, the AOI area, days covered, resolution and platform, against its run time and peak
+memory (see `CubeQueryTask.run_size` and `task_index.record_run_sample`). The memory is `peak_memory_bytes` from
+`task_metrics`, the task process and the dask workers together, as most of a run's data is held by the workers. Runs
+recorded before that was measured, or measured differently to now (see `task_metrics.memory_measure`), are left out
+and age out of the history as new runs are added. For each task type the log of the run time and of the memory are
+fitted by least squares against the logs of the sizes, so each estimate is a power law in each
+size: twice the area might take twice as long while halving the resolution takes four times. A little ridge
+regularisation keeps the fit sensible when the history is all much the same size. Where a platform has enough runs of
+its own it gets its own fit, as sensors differ a lot in how much data they have per pixel.
+
+Fits are kept for `[Estimates] refit_interval` seconds per process rather than refitted for every request.
+"""
+import math
+import statistics
+import threading
+import time
+
+import numpy
+
+from cubequery import get_config, task_index, task_metrics
+
+_targets = ('seconds', 'peak_memory_bytes')
+_ridge = 1e-3
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def _features(area, days, resolution):
+    return [1.0, math.log(max(area, 1e-6)), math.log(max(days, 1)), math.log(max(abs(float(resolution)), 1e-3))]
+
+
+class RunModel(object):
+    """
+    A fit of run time and peak memory against run size.
+
+    :param samples: list of run samples, each a dictionary with area, days, resolution, seconds and peak_memory_bytes.
+    """
+
+    def __init__(self, samples):
+        self.samples = len(samples)
+        x = numpy.array([_features(s['area'], s['days'], s['resolution']) for s in samples])
+        # the intercept isn't regularised, with no spread in the sizes the fit falls back to the mean.
+        penalty = _ridge * numpy.eye(x.shape[1])
+        penalty[0, 0] = 0
+        gram = x.T @ x + penalty
+        self.coefficients = {}
+        for target in _targets:
+            y = numpy.log([max(float(s[target]), 1e-3) for s in samples])
+            self.coefficients[target] = numpy.linalg.solve(gram, x.T @ y)
+
+    def predict(self, area, days, resolution):
+        """
+        :return: dictionary of the expected seconds and peak_memory_bytes of a run of this size.
+        """
+        x = numpy.array(_features(area, days, resolution))
+        return {target: float(numpy.exp(x @ c)) for target, c in self.coefficients.items()}
+
+
+def fit_models(samples, min_samples):
+    """
+    Fit the models for a task.
+
+    :return: dictionary of platform to model, None is the model of every run of the task. Empty if there are fewer
+        than `min_samples` runs.
+    """
+    models = {}
+    samples = [s for s in samples if all(s.get(target) is not None for target in _targets)
+               and s.get('memory_measure') == task_metrics.memory_measure]
+    if len(samples) < min_samples:
+        return models
+    models[None] = RunModel(samples)
+    by_platform = {}
+    for s in samples:
+        if s.get('platform'):
+            by_platform.setdefault(s['platform'], []).append(s)
+    for platform, platform_samples in by_platform.items():
+        if len(platform_samples) >= min_samples:
+            models[platform] = RunModel(platform_samples)
+    return models
+
+
+def task_models(name, client=None):
+    """
+    The fitted models of a task, refitted from the task index when they are older than the refit interval.
+    """
+    now = time.monotonic()
+    with _models_lock:
+        cached = _models.get(name)
+        if cached is not None and now - cached[0] < float(get_config("Estimates", "refit_interval")):
+            return cached[1]
+    models = fit_models(task_index.run_samples(name, client), int(get_config("Estimates", "min_samples")))
+    with _models_lock:
+        _models[name] = (now, models)
+    return models
+
+
+def estimate_run(task, args, client=None):
+    """
+    Estimate a single run of a task.
+
+    :return: dictionary of the expected seconds, peak_memory_bytes and the number of runs it is based on, or None if
+        the task hasn't been run enough times to say.
+    """
+    size = task.run_size(args)
+    models = task_models(task.name, client)
+    model = models.get(size['platform']) or models.get(None)
+    if model is None:
+        return None
+    result = model.predict(size['area'], size['days'], size['resolution'])
+    result['peak_memory_bytes'] = int(result['peak_memory_bytes'])
+    result['samples'] = model.samples
+    return result
+
+
+def estimate_submission(task, args, client=None):
+    """
+    Estimate a submission, which may be split into parts. The parts are assumed to run side by side so it takes as
+    long as its longest part and needs as much memory as its largest.
+
+    :return: dictionary of the expected seconds, peak_memory_bytes, number of parts and the number of runs the estimate
+        is based on, or None if there isn't enough history.
+    """
+    split = task.split_submission(args)
+    part_args = split[1] if split else [args]
+    runs = [estimate_run(task, a, client) for a in part_args]
+    if not runs or any(r is None for r in runs):
+        return None
+    return {
+        'seconds': round(max(r['seconds'] for r in runs), 1),
+        'peak_memory_bytes': max(r['peak_memory_bytes'] for r in runs),
+        'parts': len(runs),
+        'samples': runs[0]['samples'],
+    }
+
+
+def queue_wait(queue, client=None):
+    """
+    How long a run sent to a queue now can expect to wait before it starts, the median of the latest waits.
+
+    :return: seconds, or None if nothing has been recorded for the queue.
+    """
+    waits = task_index.queue_waits(queue, client)
+    if not waits:
+        return None
+    return round(statistics.median(waits), 1)
@@ -137,6 +137,7 @@ def _setup(path):
     img_url = ""
     info_url = ""
     parameters = []
+    options = {}
     for cell in notebook.cells:
         if not set_header and cell.cell_type == "markdown":
             # parse out the markdown and try and grab the name as the heading and the description as the rest
@@ -146,9 +147,11 @@ def _setup(path):
         if cell.cell_type == "code":
             # process the code blocks.
             function_code, parameters = _process_code(function_code, parameters, cell.source)
+            if _line_comment_type(cell.source) == "parameters":
+                options.update(_process_task_options(cell.source))
 
     function = _convert_to_function(function_code, parameters)
-    parameter_code = _convert_to_parameter_def(parameters)
+    parameter_code = _convert_to_parameter_def(parameters) + _convert_to_options_def(options)
     return name, description, img_url, info_url, function, parameter_code
 
 
@@ -229,8 +232,18 @@ def _process_code(function_code, parameters, code):
     return function_code, parameters
 
 
+_dask_client_line = re.compile(r"^(\s*)(\w+)\s*=\s*(?:[\w.]+\.)?Client\(.*\)\s*$")
+
+
+def _rewrite_dask_client(line):
+    # notebooks make a client for the shared scheduler they are developed against, tasks use the cluster of the worker
+    # they run on, which the datacube they are given has a client for.
+    return _dask_client_line.sub(r"\1\2 = dc.dask_client", line)
+
+
 def _append_all_code(function_code, code, indent=2):
     for line in code.splitlines():
+        line = _rewrite_dask_client(line)
         if line != "" and line.strip() != "" and line.strip()[0] != "%":
             # line must have trailing spaces removed because pycharm will automatically remove trailing spaces on text
             # files. This means that the expected test file can never match with out the rstrip call
@@ -285,6 +298,31 @@ def _process_parameters(parameters, code):
     return parameters
 
 
+def _process_task_options(code):
+    """
+    Find the `#task name=value` lines in a parameters block, these set attributes of the generated task class
+    e.g. `#task tileable=True`
+    """
+    options = {}
+    for line in code.splitlines():
+        stripped = line.strip()
+        if stripped[:1] != "#":
+            continue
+        comment = stripped[1:].strip()
+        if comment[:5] != "task " or "=" not in comment:
+            continue
+        key, value = comment[5:].split("=", 1)
+        options[key.strip()] = ast.literal_eval(value.strip())
+    return options
+
+
+def _convert_to_options_def(options):
+    result = ""
+    for key, value in sorted(options.items()):
+        result += f"{tab()}{key} = {value!r}\n"
+    return result
+
+
 def _process_parameter(parameters, line_a, line_b):
     p = _process_parameter_comment(line_a)
     p = _process_parameter_name(p, line_b)
@@ -405,7 +443,19 @@ def process_notebook(script_path, target_path):
     logging.info(f"done processing {script_path}")
 
 
+_repo_commit = None
+
+
+def repo_version():
+    """
+    The commit of the notebook repo that the current tasks were generated from.
+    :return: the commit hash or None if the repo has not been processed.
+    """
+    return _repo_commit
+
+
 def process_repo():
+    global _repo_commit
 
     git_path = get_config("Git", "url")
     repo_dir = get_config("Git", "repo_dir")
@@ -424,7 +474,8 @@ def process_repo():
         logging.debug(f"checking out {branch}")
         repo.git.checkout(branch)
 
-    logging.debug("done clone")
+    _repo_commit = repo.head.commit.hexsha
+    logging.debug(f"done clone at {_repo_commit}")
 
     # find the list of notebooks to process.
 
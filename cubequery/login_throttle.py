@@ -0,0 +1,57 @@
+import logging
+
+import redis
+
+from cubequery import task_index
+
+
+class FailedLoginThrottle(object):
+    """
+    Track failed log in attempts and block a key (a username or an address) once it has had too many failures
+    within a time window. Blocked keys are rejected before any password checking happens.
+
+    The counts are kept in redis so every api server process shares them and they expire on their own: each key counts
+    up from its first failure and is forgotten `window` seconds later. If redis can't be reached log ins are let
+    through rather than everyone being locked out.
+    """
+
+    def __init__(self, max_failures=5, window=300, client=None):
+        self.max_failures = max_failures
+        self.window = window
+        self._client = client
+
+    def _redis(self):
+        return self._client or task_index.get_client()
+
+    @staticmethod
+    def _key(key):
+        return f"login_failures:{key}"
+
+    def is_blocked(self, *keys):
+        """
+        :param keys: keys to check.
+        :return: True if any of the keys has had too many recent failures.
+        """
+        try:
+            counts = self._redis().mget([self._key(k) for k in keys])
+        except redis.RedisError as e:
+            logging.warning(f"could not check failed log ins: {e}")
+            return False
+        return any(c is not None and int(c) >= self.max_failures for c in counts)
+
+    def record_failure(self, *keys):
+        try:
+            pipe = self._redis().pipeline()
+            for k in keys:
+                # starts the window on the first failure, later ones only add to the count.
+                pipe.set(self._key(k), 0, ex=self.window, nx=True)
+                pipe.incr(self._key(k))
+            pipe.execute()
+        except redis.RedisError as e:
+            logging.warning(f"could not record failed log in: {e}")
+
+    def reset(self, *keys):
+        try:
+            self._redis().delete(*[self._key(k) for k in keys])
+        except redis.RedisError as e:
+            logging.warning(f"could not reset failed log ins: {e}")
@@ -18,13 +18,7 @@ def validate_notebooks():
         t = load_task_instance(p)
         f = t.generate_product
         try:
-            f(**create_args(f))
-        except OSError as e:
-            if str(e) == "Timed out trying to connect to tcp://dask-scheduler.dask.svc.cluster.local:8786 after 10 s":
-                pass
-            else:
-                result = result + 1
-                raise e
+            f(**create_args(f, t.connect_datacube({})))
         except ValueError as e:
             if str(e) == "No ODC environment, checked configurations for ['default', 'datacube']":
                 pass
@@ -36,10 +30,12 @@ def validate_notebooks():
         sys.exit(result)
 
 
-def create_args(func):
+def create_args(func, dc=None):
     result = {}
     for i, arg in enumerate(inspect.signature(func).parameters):
         result[arg] = None
+    if 'dc' in result:
+        result['dc'] = dc
 
     return result
 
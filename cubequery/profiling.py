@@ -0,0 +1,97 @@
+"""
+Profiling a task run on request.
+
+`TaskProfiler` runs a block under cProfile, for a pstats file, while a background thread samples the stack of the
+profiled thread to build a collapsed stack file that flamegraph.pl, speedscope and friends can read. When it isn't
+enabled it does nothing at all, so tasks that aren't being profiled pay nothing for it.
+"""
+import cProfile
+import collections
+import os
+import sys
+import threading
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler(object):
+    """
+    Counts the stacks of a thread, sampled every `interval` seconds from a background thread.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write_collapsed(self, file_path):
+        with open(file_path, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class TaskProfiler(object):
+    """
+    Context manager that profiles the block it wraps when enabled.
+
+    :param enabled: whether to profile at all.
+    :param interval: seconds between stack samples.
+    """
+
+    def __init__(self, enabled=True, interval=0.005):
+        self.enabled = enabled
+        self.interval = interval
+        self._profile = None
+        self._sampler = None
+
+    def __enter__(self):
+        if self.enabled:
+            self._sampler = StackSampler(threading.get_ident(), self.interval)
+            self._sampler.start()
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.enabled:
+            self._profile.disable()
+            self._sampler.stop()
+        return False
+
+    def save(self, directory, name):
+        """
+        Write out the profile.
+
+        :param directory: where to put the files.
+        :param name: the start of the file names.
+        :return: the paths of the pstats and collapsed stack files, empty if profiling wasn't enabled.
+        """
+        if not self.enabled:
+            return []
+        stats_path = os.path.join(directory, f"{name}_profile.pstats")
+        collapsed_path = os.path.join(directory, f"{name}_profile.collapsed")
+        self._profile.dump_stats(stats_path)
+        self._sampler.write_collapsed(collapsed_path)
+        return [stats_path, collapsed_path]
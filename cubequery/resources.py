@@ -0,0 +1,149 @@
+"""
+Connections that are expensive to set up, kept for the life of a process and shared by everything that runs in it.
+
+Making a boto3 client, or a Datacube with its database engine and product metadata, costs more than a lot of what is
+done with them, so rather than every task run and every download making its own they are created once per process and
+handed out from here. Each one remembers the process that made it so a connection is never used on both sides of a
+fork. Celery forks its worker processes, so `worker_process_init` drops anything copied from the parent and sets up
+fresh connections ready for the first task. The Datacube is checked with a small query, and the s3 clients with a
+`head_bucket` on the results bucket, every so often and replaced if the check fails.
+
+As one Datacube serves every task type its database connections are opened with the app name `cubequery`. Before
+they were shared each run opened its own, named after the task, so per task connection names are no longer seen in
+`pg_stat_activity`.
+"""
+import logging
+import os
+import threading
+import time
+
+import datacube
+from celery.signals import worker_process_init
+from libcatapult.storage.s3_tools import S3Utils
+
+from cubequery import get_config
+
+
+class ProcessResource(object):
+    """
+    Something created on first use and then shared until the process ends.
+
+    :param create: function that makes the thing.
+    :param check: optional function that raises if the thing is no longer usable, it is then replaced.
+    :param check_interval: seconds between checks.
+    :param close: optional function to clean up a thing that is being replaced.
+    """
+
+    def __init__(self, create, check=None, check_interval=60, close=None):
+        self._create = create
+        self._check = check
+        self._check_interval = check_interval
+        self._close = close
+        self._lock = threading.Lock()
+        self._value = None
+        self._pid = None
+        self._checked = 0
+
+    def get(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._value is not None and self._pid != pid:
+                # made before a fork, it belongs to the parent so leave it alone.
+                self._value = None
+            if self._value is not None and self._check and time.monotonic() - self._checked > self._check_interval:
+                try:
+                    self._check(self._value)
+                    self._checked = time.monotonic()
+                except Exception as e:
+                    logging.warning(f"shared connection failed its health check, replacing it: {e}")
+                    self._discard()
+            if self._value is None:
+                self._value = self._create()
+                self._pid = pid
+                self._checked = time.monotonic()
+            return self._value
+
+    def _discard(self):
+        value, self._value = self._value, None
+        if self._close and value is not None:
+            try:
+                self._close(value)
+            except Exception as e:
+                logging.warning(f"could not close shared connection: {e}")
+
+    def reset(self):
+        """
+        Throw away the current thing so the next `get` makes a new one.
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                self._discard()
+            self._value = None
+
+    def after_fork(self):
+        """
+        Forget anything inherited from the parent process, including a lock some other thread may have been holding.
+        """
+        self._lock = threading.Lock()
+        self._value = None
+        self._pid = None
+
+
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+
+
+def _create_s3_client(endpoint):
+    s3_tools = S3Utils(get_config("AWS", "access_key_id"), get_config("AWS", "secret_access_key"),
+                       get_config("AWS", "bucket"), endpoint, get_config("AWS", "region"))
+    return s3_tools.s3.meta.client
+
+
+def _check_s3_client(client):
+    client.head_bucket(Bucket=get_config("AWS", "bucket"))
+
+
+def s3_client(endpoint):
+    """
+    Get the shared boto3 s3 client for an endpoint.
+    Clients, unlike boto3 resources, are thread safe so one is shared by every thread in the process.
+    """
+    key = (endpoint, get_config("AWS", "region"), get_config("AWS", "access_key_id"))
+    with _s3_clients_lock:
+        resource = _s3_clients.get(key)
+        if resource is None:
+            resource = ProcessResource(lambda: _create_s3_client(endpoint), check=_check_s3_client,
+                                       check_interval=int(get_config("AWS", "check_interval")))
+            _s3_clients[key] = resource
+    return resource.get()
+
+
+def _check_datacube(dc):
+    dc.index.products.get_all()
+
+
+# shared by every task type, so it can't be named after one. See the module docstring.
+_datacube = ProcessResource(lambda: datacube.Datacube(app="cubequery"), check=_check_datacube,
+                            check_interval=int(get_config("App", "datacube_check_interval")),
+                            close=lambda dc: dc.close())
+
+
+def shared_datacube():
+    """
+    Get the Datacube shared by every task run in this process.
+    """
+    return _datacube.get()
+
+
+@worker_process_init.connect
+def _init_worker_process(**kwargs):
+    global _s3_clients_lock
+    _s3_clients_lock = threading.Lock()
+    _datacube.after_fork()
+    for resource in _s3_clients.values():
+        resource.after_fork()
+    try:
+        shared_datacube()
+        s3_client(get_config("AWS", "s3_endpoint"))
+    except Exception as e:
+        logging.warning(f"could not set up shared connections, they will be made on first use: {e}")
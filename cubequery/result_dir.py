@@ -0,0 +1,138 @@
+"""
+Looking after the worker's result directory.
+
+Each task works in `result_dir/<task id>`, which holds a `.running` marker while the task runs. Once the outputs are
+uploaded the directory is deleted. Repeat runs are answered from the result cache with the uploaded outputs, a new run
+always has a new task id, so there is nothing to gain from keeping them here. Directories of failed tasks can be kept
+to look into with `[Results] keep_failed`.
+
+Before a task starts the free space is checked. If it is below `min_free_bytes` kept directories, and any left by
+workers that died, are evicted oldest first to make room. Age is taken from the directory modification times so this
+works across every worker process sharing the directory. If that isn't enough the task is refused with
+`InsufficientDiskSpace`, which the task turns into a retry.
+"""
+import logging
+import os
+import shutil
+import time
+
+from cubequery import get_config
+
+_running_marker = ".running"
+
+
+class InsufficientDiskSpace(Exception):
+    pass
+
+
+def _tree_size(root):
+    total = 0
+    for dir_path, _, file_names in os.walk(root):
+        for name in file_names:
+            try:
+                total += os.lstat(os.path.join(dir_path, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class ResultDirectory(object):
+    """
+    :param root: the directory jobs work in.
+    :param min_free_bytes: free space needed before a job is allowed to start.
+    :param keep_failed: keep the directories of failed jobs until the space is needed.
+    :param stale_after: seconds after which a `.running` marker is assumed to be left by a worker that died, this
+        needs to be longer than the longest task.
+    """
+
+    def __init__(self, root, min_free_bytes=0, keep_failed=False, stale_after=2 * 24 * 60 * 60):
+        self.root = os.path.expanduser(root)
+        self.min_free_bytes = min_free_bytes
+        self.keep_failed = keep_failed
+        self.stale_after = stale_after
+
+    def job_path(self, task_id):
+        return os.path.join(self.root, task_id)
+
+    def start(self, task_id):
+        """
+        Make the working directory for a task, once there is enough free space for it.
+
+        :return: the path of the working directory.
+        :raises InsufficientDiskSpace: if enough space could not be found.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        self.ensure_free_space()
+        job_path = self.job_path(task_id)
+        os.makedirs(job_path, exist_ok=True)
+        with open(os.path.join(job_path, _running_marker), 'w'):
+            pass
+        return job_path
+
+    def finish(self, task_id, success=True):
+        """
+        Clean up after a task, keeping its directory if it failed and failures are kept.
+        """
+        job_path = self.job_path(task_id)
+        if not os.path.isdir(job_path):
+            return
+        if not success and self.keep_failed:
+            try:
+                os.remove(os.path.join(job_path, _running_marker))
+            except FileNotFoundError:
+                pass
+            os.utime(job_path)
+        else:
+            shutil.rmtree(job_path, ignore_errors=True)
+
+    def _finished_jobs(self):
+        """
+        The directories of jobs that are no longer running, oldest first, as (modified time, size, path) tuples.
+        """
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.root):
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            try:
+                if now - os.stat(os.path.join(entry.path, _running_marker)).st_mtime < self.stale_after:
+                    continue
+            except FileNotFoundError:
+                pass
+            entries.append((entry.stat().st_mtime, _tree_size(entry.path), entry.path))
+        entries.sort()
+        return entries
+
+    def free_bytes(self):
+        return shutil.disk_usage(self.root).free
+
+    def ensure_free_space(self):
+        """
+        Make sure there is at least `min_free_bytes` free, evicting finished job directories if needed.
+
+        :raises InsufficientDiskSpace: if there still isn't enough space.
+        """
+        free = self.free_bytes()
+        if free >= self.min_free_bytes:
+            return
+        for _, size, job_path in self._finished_jobs():
+            shutil.rmtree(job_path, ignore_errors=True)
+            logging.info(f"evicted {job_path} to free disk space")
+            free += size
+            if free >= self.min_free_bytes:
+                break
+        free = self.free_bytes()
+        if free < self.min_free_bytes:
+            raise InsufficientDiskSpace(f"only {free} bytes free in {self.root}, need {self.min_free_bytes}")
+
+
+def result_directory():
+    """
+    Get the result directory set up in the config file.
+    """
+    return ResultDirectory(
+        get_config("App", "result_dir"),
+        min_free_bytes=int(get_config("Results", "min_free_bytes")),
+        keep_failed=get_config("Results", "keep_failed").lower() in ['true', '1', 'yes'],
+        stale_after=int(get_config("Results", "stale_after")),
+    )
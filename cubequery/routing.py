@@ -0,0 +1,68 @@
+"""
+Sending submissions to queues by how much work they are.
+
+The cost of a submission is a rough count of the pixels it has to read: the area of its AOI divided by the area of a
+pixel, times the number of days it covers, times a coefficient for the task type. It is measured in millions of
+pixel days, so a square kilometre at 10m over a year costs about 3.6.
+
+Submissions are sent to the `small`, `medium` or `large` queue by comparing their cost against the limits in the
+`[Queues]` config, so quick requests are picked up by their own workers rather than waiting behind long runs. Each
+queue also has a priority for workers that take from more than one queue.
+"""
+import math
+from datetime import datetime
+
+from cubequery import get_config
+
+queues = ("small", "medium", "large")
+
+# kilometres per degree of latitude, and of longitude at the equator.
+_km_per_degree_lat = 110.574
+_km_per_degree_lon = 111.320
+_date_format = "%Y-%m-%d"
+
+
+def area_km2(geometry):
+    """
+    Approximate area of a lat/lon geometry in square kilometres, scaled for the latitude of its middle.
+    """
+    min_x, min_y, max_x, max_y = geometry.bounds
+    scale = _km_per_degree_lat * _km_per_degree_lon * math.cos(math.radians((min_y + max_y) / 2))
+    return geometry.area * scale
+
+
+def date_span(dates):
+    """
+    The number of days covered by some YYYY-MM-DD dates, first and last inclusive. 1 if there are fewer than two.
+    """
+    parsed = [datetime.strptime(d, _date_format).date() for d in dates if d]
+    if len(parsed) < 2:
+        return 1
+    return (max(parsed) - min(parsed)).days + 1
+
+
+def submission_cost(area, days, resolution, coefficient=1.0):
+    """
+    :param area: the AOI area in square kilometres.
+    :param days: the number of days covered.
+    :param resolution: the pixel size in metres.
+    :param coefficient: how expensive the task is per pixel day compared to others.
+    :return: the cost in millions of pixel days.
+    """
+    resolution = abs(float(resolution))
+    return area / (resolution * resolution) * days * coefficient
+
+
+def queue_for(cost):
+    """
+    Pick the queue for a cost.
+
+    :return: a dictionary of the queue name and priority, ready to pass to apply_async.
+    """
+    if cost <= float(get_config("Queues", "small_max_cost")):
+        queue = "small"
+    elif cost <= float(get_config("Queues", "medium_max_cost")):
+        queue = "medium"
+    else:
+        queue = "large"
+    return {'queue': queue, 'priority': int(get_config("Queues", f"{queue}_priority"))}
@@ -0,0 +1,111 @@
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_min_part_size = 5 * 1024 * 1024  # S3 won't accept smaller parts, apart from the last one.
+
+
+class S3MultipartWriter(io.RawIOBase):
+    """
+    A write only file object that uploads what is written to it straight to S3 as a multipart upload.
+
+    Data is buffered until there is a full part which is then uploaded on a background thread, so whatever is
+    producing the data, e.g. a zip file being built, carries on while earlier parts upload. At most
+    `max_concurrency` parts are in flight at once, which bounds the memory used to roughly that many parts.
+
+    Closing the writer uploads the final part and completes the upload. If anything goes wrong call abort(), using
+    the writer as a context manager does this automatically, so no half finished uploads are left behind.
+    """
+
+    def __init__(self, client, bucket, key, part_size=16 * 1024 * 1024, max_concurrency=4):
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, _min_part_size)
+        self._buffer = bytearray()
+        self._position = 0
+        self._parts = []
+        self._futures = []
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._upload_id = client.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+        self._finished = False
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        return self._position
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed file")
+        self._buffer.extend(data)
+        self._position += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._submit(part)
+        return len(data)
+
+    def _submit(self, data):
+        # stop early rather than carry on producing data for an upload that can't complete.
+        for f in self._futures:
+            if f.done() and f.exception() is not None:
+                raise f.exception()
+        # block here if enough parts are already uploading, this is what keeps memory use bounded.
+        self._slots.acquire()
+        part_number = len(self._futures) + 1
+        self._futures.append(self._pool.submit(self._upload_part, part_number, data))
+
+    def _upload_part(self, part_number, data):
+        try:
+            response = self.client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                               PartNumber=part_number, Body=data)
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        finally:
+            self._slots.release()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if not self._finished:
+                if self._buffer or not self._futures:
+                    self._submit(bytes(self._buffer))
+                    self._buffer = bytearray()
+                parts = [f.result() for f in self._futures]
+                self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                                      MultipartUpload={'Parts': parts})
+                self._finished = True
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._pool.shutdown(wait=True)
+            super().close()
+
+    def abort(self):
+        """
+        Throw away the upload and anything already uploaded for it.
+        """
+        if self._finished:
+            return
+        self._finished = True
+        self._pool.shutdown(wait=True)
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+        except Exception as e:
+            logging.warning(f"could not abort upload of {self.key}: {e}")
+        super().close()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
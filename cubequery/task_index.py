@@ -0,0 +1,471 @@
+"""
+A compact index of task state kept in redis.
+
+Asking the workers about tasks with `celery_app.control.inspect()` broadcasts to every worker and waits for them all to
+answer, hangs when there are no workers and knows nothing about tasks that are queued or finished. Instead the api
+records each task when it is submitted and a small event consumer (`python -m cubequery.task_index`) listens to the
+celery task events and keeps the record up to date. The merge of a split run never runs, so sends no events, when one of
+its parts fails; the worker running that part marks it failed instead.
+
+Each task is stored as a json blob under `cubequery:task:<id>` with sorted sets, scored by submission time, of all
+tasks, tasks by user and tasks by state so listing a page is a single range lookup.
+
+Workers record the timings and resource use of each run under `cubequery:metrics:<id>`, which is added to the task
+record when it is looked up, and add them to a running summary for each task type and notebook version. The size of
+each run against its run time and memory is kept in a capped list per task type, as is how long runs waited on each
+queue before starting, for the estimates.
+"""
+import ast
+import json
+import logging
+import time
+import uuid
+
+import redis
+from celery import Celery
+
+from cubequery import get_config
+
+_prefix = "cubequery"
+_ttl = 60 * 60 * 24 * 10  # ten days, matches the celery result expiry
+
+_event_states = {
+    'task-sent': 'PENDING',
+    'task-received': 'RECEIVED',
+    'task-started': 'STARTED',
+    'task-succeeded': 'SUCCESS',
+    'task-failed': 'FAILURE',
+    'task-rejected': 'REJECTED',
+    'task-revoked': 'REVOKED',
+    'task-retried': 'RETRY',
+}
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(get_config("Redis", "url"))
+    return _client
+
+
+def _task_key(task_id):
+    return f"{_prefix}:task:{task_id}"
+
+
+def _all_key():
+    return f"{_prefix}:tasks"
+
+
+def _user_key(user):
+    return f"{_prefix}:tasks:user:{user}"
+
+
+def _state_key(state):
+    return f"{_prefix}:tasks:state:{state}"
+
+
+def _metrics_key(task_id):
+    return f"{_prefix}:metrics:{task_id}"
+
+
+def _summary_key(name, version):
+    return f"{_prefix}:summary:{name}:{version}"
+
+
+def _summaries_key():
+    return f"{_prefix}:summaries"
+
+
+def _samples_key(name):
+    return f"{_prefix}:samples:{name}"
+
+
+def _waits_key(queue):
+    return f"{_prefix}:waits:{queue}"
+
+
+# redis can add to a hash field but not keep the largest value in one.
+_hash_max_script = """
+local current = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+if tonumber(ARGV[2]) > current then redis.call('HSET', KEYS[1], ARGV[1], ARGV[2]) end
+"""
+
+
+def _user_from_kwargs(kwargs):
+    """
+    Try and dig the submitting user out of the kwargs of a task event.
+    Celery sends these as the repr of the kwargs dict with our params as a json string inside.
+    """
+    try:
+        if isinstance(kwargs, str):
+            kwargs = ast.literal_eval(kwargs)
+        return json.loads(kwargs['params']).get('user')
+    except Exception:
+        return None
+
+
+def apply_event(record, event):
+    """
+    Update a task record with the contents of a celery task event.
+
+    :param record: the current task record, or None if we have not seen this task yet.
+    :param event: a celery task event dictionary.
+    :return: the updated task record.
+    """
+    if record is None:
+        record = {
+            "id": event['uuid'],
+            "name": None,
+            "time_start": None,
+            "time_submitted": event.get('timestamp'),
+            "args": None,
+            "ack": False,
+            "server": None,
+            "state": None,
+            "user": None,
+        }
+
+    if event.get('name'):
+        record['name'] = event['name']
+    if event.get('kwargs'):
+        record['args'] = event['kwargs']
+        if not record.get('user'):
+            record['user'] = _user_from_kwargs(event['kwargs'])
+    if event.get('hostname') and event['type'] != 'task-sent':
+        record['server'] = event['hostname']
+
+    if event['type'] == 'task-started':
+        record['time_start'] = event.get('timestamp')
+        record['ack'] = True
+    if event['type'] == 'task-succeeded':
+        record['runtime'] = event.get('runtime')
+    if event['type'] == 'task-failed':
+        record['exception'] = event.get('exception')
+
+    record['state'] = _event_states.get(event['type'], record['state'])
+    record['time_updated'] = event.get('timestamp')
+    return record
+
+
+def _save(client, record, previous_state=None):
+    pipe = client.pipeline()
+    _queue_save(pipe, record, previous_state)
+    pipe.execute()
+
+
+def _queue_save(pipe, record, previous_state=None):
+    score = record.get('time_submitted') or time.time()
+    pipe.set(_task_key(record['id']), json.dumps(record), ex=_ttl)
+    pipe.zadd(_all_key(), {record['id']: score})
+    if record.get('user'):
+        pipe.zadd(_user_key(record['user']), {record['id']: score})
+    if previous_state and previous_state != record['state']:
+        pipe.zrem(_state_key(previous_state), record['id'])
+    if record.get('state'):
+        pipe.zadd(_state_key(record['state']), {record['id']: score})
+
+
+def _update(client, task_id, change):
+    """
+    Change the record of a task without losing a change made by the api or event consumer at the same time.
+
+    :param change: function given the current record, or None, that returns the new one.
+    :return: the new record.
+    """
+    key = _task_key(task_id)
+    result = []
+
+    def update(pipe):
+        blob = pipe.get(key)
+        record = json.loads(blob) if blob is not None else None
+        previous_state = record['state'] if record else None
+        updated = change(record)
+        pipe.multi()
+        _queue_save(pipe, updated, previous_state)
+        result[:] = [updated]
+
+    client.transaction(update, key)
+    return result[0]
+
+
+def merge_submission(record, submission):
+    """
+    Add what the api knows about a submission to the record of a task. Workers can pick a task up before the api has
+    recorded it, so the record may already have moved on from PENDING. Its state is kept.
+
+    :param record: the current record, or None if there isn't one yet.
+    :param submission: the record the api would make for the task.
+    :return: the merged record.
+    """
+    if record is None:
+        return submission
+    merged = dict(record)
+    for field in ('name', 'args', 'user', 'queue', 'time_submitted'):
+        if submission.get(field) is not None:
+            merged[field] = submission[field]
+    return merged
+
+
+def record_submission(task_id, name, args, client=None, queue=None):
+    """
+    Add a newly submitted task to the index so it shows up before any worker has picked it up.
+
+    :param task_id: id of the submitted task.
+    :param name: name of the task.
+    :param args: the argument dictionary the task was submitted with, including the user.
+    :param queue: the queue it was sent to, when given the time it waits there is recorded.
+    """
+    client = client or get_client()
+    record = {
+        "id": task_id,
+        "name": name,
+        "time_start": None,
+        "time_submitted": time.time(),
+        "args": args,
+        "ack": False,
+        "server": None,
+        "state": "PENDING",
+        "user": args.get('user'),
+    }
+    if queue:
+        record['queue'] = queue
+    _update(client, task_id, lambda existing: merge_submission(existing, record))
+
+
+def record_event(event, client=None):
+    client = client or get_client()
+    if 'uuid' not in event:
+        return
+    record = _update(client, event['uuid'], lambda existing: apply_event(existing, event))
+    if event['type'] == 'task-started' and record.get('queue') and record.get('time_submitted') \
+            and record.get('time_start'):
+        wait = max(0.0, record['time_start'] - record['time_submitted'])
+        key = _waits_key(record['queue'])
+        pipe = client.pipeline()
+        pipe.lpush(key, wait)
+        pipe.ltrim(key, 0, int(get_config("Estimates", "wait_samples")) - 1)
+        pipe.execute()
+
+
+def record_failure(task_id, exception, client=None):
+    """
+    Mark a task as failed that no worker will ever send events for, the merge of a split run one of whose parts
+    failed.
+
+    :param task_id: id of the task.
+    :param exception: description of what went wrong.
+    """
+    client = client or get_client()
+    event = {'uuid': task_id, 'type': 'task-failed', 'exception': exception, 'timestamp': time.time()}
+    _update(client, task_id, lambda existing: apply_event(existing, event))
+
+
+def get_task(task_id, client=None):
+    """
+    Look up a single task.
+
+    :param task_id: id of the task to find.
+    :return: the task record or None if it is not in the index.
+    """
+    client = client or get_client()
+    blob, metrics = client.mget([_task_key(task_id), _metrics_key(task_id)])
+    if blob is None:
+        return None
+    record = json.loads(blob)
+    if metrics is not None:
+        record['metrics'] = json.loads(metrics)
+    return record
+
+
+def list_tasks(user=None, state=None, offset=0, limit=100, client=None):
+    """
+    List a page of tasks, newest first, optionally filtered by user and or state.
+
+    :param user: only return tasks submitted by this user.
+    :param state: only return tasks in this state.
+    :param offset: how many tasks to skip.
+    :param limit: maximum number of tasks to return.
+    :return: a list of task records.
+    """
+    if limit <= 0:
+        return []
+    client = client or get_client()
+    if state and user:
+        sources = [_state_key(state), _user_key(user)]
+        # page through the tasks in both, scores are the submission time in each so either will do.
+        index = f"{_prefix}:tmp:{uuid.uuid4().hex}"
+        pipe = client.pipeline()
+        pipe.zinterstore(index, sources, aggregate='MAX')
+        pipe.zrevrange(index, offset, offset + limit - 1)
+        pipe.delete(index)
+        ids = pipe.execute()[1]
+    else:
+        if state:
+            index = _state_key(state)
+        elif user:
+            index = _user_key(user)
+        else:
+            index = _all_key()
+        sources = [index]
+        ids = client.zrevrange(index, offset, offset + limit - 1)
+
+    ids = [i.decode("utf-8") for i in ids]
+    if not ids:
+        return []
+
+    result = []
+    expired = []
+    blobs = client.mget([_task_key(i) for i in ids] + [_metrics_key(i) for i in ids])
+    for task_id, blob, metrics in zip(ids, blobs[:len(ids)], blobs[len(ids):]):
+        if blob is None:
+            expired.append(task_id)
+            continue
+        record = json.loads(blob)
+        if user and record.get('user') != user:
+            continue
+        if metrics is not None:
+            record['metrics'] = json.loads(metrics)
+        result.append(record)
+
+    if expired:
+        # the task records expire on their own, tidy up the index entries as we find them.
+        pipe = client.pipeline()
+        for source in sources:
+            pipe.zrem(source, *expired)
+        pipe.execute()
+    return result
+
+
+def record_metrics(task_id, name, version, metrics, client=None):
+    """
+    Store the metrics of a task run and add them to the summary for its task type.
+
+    :param task_id: id of the task.
+    :param name: name of the task.
+    :param version: version of the notebooks the task was generated from.
+    :param metrics: the dictionary from `RunMetrics.as_dict`.
+    """
+    client = client or get_client()
+    key = _summary_key(name, version)
+    pipe = client.pipeline()
+    pipe.set(_metrics_key(task_id), json.dumps(metrics), ex=_ttl)
+    pipe.sadd(_summaries_key(), json.dumps([name, version]))
+    pipe.hincrby(key, 'runs', 1)
+    pipe.hset(key, 'last_run', time.time())
+    for field, value in metrics.items():
+        if isinstance(value, (int, float)):
+            pipe.hincrbyfloat(key, field, value)
+    for phase, values in metrics.get('phases', {}).items():
+        for field, value in values.items():
+            pipe.hincrbyfloat(key, f"phases.{phase}.{field}", value)
+    keep_max = client.register_script(_hash_max_script)
+    for field in ('peak_rss_bytes', 'peak_memory_bytes'):
+        keep_max(keys=[key], args=[f"max_{field}", metrics.get(field, 0)], client=pipe)
+    pipe.execute()
+
+
+def _summarise(name, version, fields):
+    fields = {k.decode("utf-8"): float(v) for k, v in fields.items()}
+    runs = int(fields.pop('runs', 0))
+    summary = {
+        'name': name,
+        'version': version,
+        'runs': runs,
+        'last_run': fields.pop('last_run', None),
+        'max_peak_rss_bytes': int(fields.pop('max_peak_rss_bytes', 0)),
+        'max_peak_memory_bytes': int(fields.pop('max_peak_memory_bytes', 0)),
+        'mean': {},
+        'phases': {},
+    }
+    for field, total in fields.items():
+        mean = round(total / runs, 3) if runs else 0
+        if field.startswith('phases.'):
+            _, phase, value = field.split('.', 2)
+            summary['phases'].setdefault(phase, {})[value] = mean
+        else:
+            summary['mean'][field] = mean
+    return summary
+
+
+def task_summaries(name=None, client=None):
+    """
+    Summarise the recorded metrics of each task type and notebook version.
+
+    :param name: only summarise this task type.
+    :return: a list of summaries with the number of runs, the mean of each metric overall and per phase and the
+        largest peak memory seen, of the task process and of the run as a whole including the dask workers.
+    """
+    client = client or get_client()
+    keys = sorted(json.loads(m) for m in client.smembers(_summaries_key()))
+    if name:
+        keys = [k for k in keys if k[0] == name]
+    pipe = client.pipeline()
+    for task_name, version in keys:
+        pipe.hgetall(_summary_key(task_name, version))
+    return [_summarise(task_name, version, fields) for (task_name, version), fields in zip(keys, pipe.execute())]
+
+
+def record_run_sample(name, sample, max_samples, client=None):
+    """
+    Keep the size, run time and memory of a finished run for estimating future runs of the task.
+
+    :param name: name of the task.
+    :param sample: dictionary of the run size from `run_size` with its `seconds` and `peak_memory_bytes`.
+    :param max_samples: how many of the latest runs to keep.
+    """
+    client = client or get_client()
+    key = _samples_key(name)
+    pipe = client.pipeline()
+    pipe.lpush(key, json.dumps(sample))
+    pipe.ltrim(key, 0, max_samples - 1)
+    pipe.execute()
+
+
+def run_samples(name, client=None):
+    """
+    :return: the kept samples of a task, newest first.
+    """
+    client = client or get_client()
+    return [json.loads(s) for s in client.lrange(_samples_key(name), 0, -1)]
+
+
+def queue_waits(queue, client=None):
+    """
+    :return: how long, in seconds, the latest runs from a queue waited before they started, newest first.
+    """
+    client = client or get_client()
+    return [float(w) for w in client.lrange(_waits_key(queue), 0, -1)]
+
+
+def run_event_consumer():
+    """
+    Listen to the celery task events forever, keeping the index up to date.
+    The workers need to be started with `-E` so that they send events.
+    """
+    redis_url = get_config("Redis", "url")
+    app = Celery('tasks', broker=redis_url)
+    client = get_client()
+
+    def on_event(event):
+        try:
+            record_event(event, client)
+        except Exception as e:
+            logging.warning(f"could not index task event {event.get('type')} for {event.get('uuid')}: {e}")
+
+    while True:
+        try:
+            with app.connection() as connection:
+                receiver = app.events.Receiver(connection, handlers={'*': on_event})
+                logging.info(f"listening for task events on {redis_url}")
+                receiver.capture(limit=None, timeout=None, wakeup=True)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception as e:
+            logging.error(f"lost connection to the event stream {e}, reconnecting")
+            time.sleep(5)
+
+
+if __name__ == '__main__':
+    run_event_consumer()
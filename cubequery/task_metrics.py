@@ -0,0 +1,233 @@
+"""
+Timing and resource accounting for task runs.
+
+A task run is split into phases, each run inside `RunMetrics.phase(name)`. For every phase the wall clock time, cpu
+time, peak resident memory and bytes written to disk are recorded.
+
+What is measured:
+
+* `cpu_seconds`, `peak_rss_bytes` and `bytes_written` are for the celery worker process running the task. cpu time
+  includes any subprocesses it waited for. Peak memory is per phase where the kernel lets us reset the high water mark
+  (linux 4.0 onwards), otherwise it is the peak of the process so far.
+* The pixel work of `generate_product` mostly happens in the dask workers of the host cluster. A phase given the
+  cluster's client also records `dask_cpu_seconds` and `dask_bytes_written`, summed over the workers, and
+  `dask_peak_rss_bytes`, the sum of each worker's peak memory during the phase. The workers are shared by every task
+  on the host, so these include anything else running on the cluster at the same time. With one task running per host
+  they are the run's own.
+* The high water mark of a dask worker is never reset, another run on the cluster may be measuring it. A worker whose
+  high water mark went up during the phase peaked then. Otherwise its peak is the most it was seen using, sampled
+  every `memory_sample_interval` seconds through the phase, so a short spike between samples can be missed.
+* `peak_memory_bytes` is the process peak plus the dask workers' peak, what the run needed overall.
+"""
+import contextlib
+import logging
+import resource
+import threading
+import time
+
+_rss_unit = 1024  # ru_maxrss is in kilobytes on linux
+
+# kept with each run sample and bumped when the way peak_memory_bytes is measured changes, so the estimates leave out
+# samples measured the old way. 1 reset the shared dask workers' peaks, so runs side by side spoilt each other's.
+memory_measure = 2
+
+
+def _cpu_seconds():
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def _bytes_written():
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_oublock * 512
+
+
+def _reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _status_bytes(field):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _peak_rss():
+    peak = _status_bytes("VmHWM:")
+    return peak if peak is not None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _rss_unit
+
+
+def current_rss():
+    """
+    The memory the current process is using now, run on each dask worker while a phase is sampled.
+    """
+    rss = _status_bytes("VmRSS:")
+    return rss if rss is not None else _peak_rss()
+
+
+def process_usage():
+    """
+    The counters of the current process, run on each dask worker to see what the cluster did. Nothing is reset, the
+    workers are shared with other runs.
+    """
+    return {'cpu_seconds': _cpu_seconds(), 'peak_rss_bytes': _peak_rss(), 'rss_bytes': current_rss(),
+            'bytes_written': _bytes_written()}
+
+
+def _cluster_usage(cluster, function):
+    try:
+        usage = cluster.run(function)
+    except Exception as e:
+        logging.warning(f"could not get the resource use of the dask workers: {e}")
+        return None
+    return usage if isinstance(usage, dict) else None
+
+
+class ClusterMemorySampler(object):
+    """
+    Keeps the most memory each dask worker of a cluster is seen using, sampled every `interval` seconds from a
+    background thread.
+    """
+
+    def __init__(self, cluster, interval=1.0):
+        self.cluster = cluster
+        self.interval = interval
+        self.peaks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cluster-memory-sampler", daemon=True)
+
+    def add(self, usage):
+        for worker, rss in usage.items():
+            self.peaks[worker] = max(self.peaks.get(worker, 0), rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            usage = _cluster_usage(self.cluster, current_rss)
+            if usage is not None:
+                self.add(usage)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def _cluster_difference(start, end, sampled):
+    """
+    :param sampled: the most each worker was seen using during the phase.
+    """
+    workers = set(start) & set(end)
+    peaks = {}
+    for w in workers:
+        if end[w]['peak_rss_bytes'] > start[w]['peak_rss_bytes']:
+            # a new high for the worker, it was reached during the phase.
+            peaks[w] = end[w]['peak_rss_bytes']
+        else:
+            peaks[w] = max(start[w]['rss_bytes'], end[w]['rss_bytes'], sampled.get(w, 0))
+    return {
+        'dask_cpu_seconds': sum(end[w]['cpu_seconds'] - start[w]['cpu_seconds'] for w in workers),
+        'dask_peak_rss_bytes': sum(peaks.values()),
+        'dask_bytes_written': sum(end[w]['bytes_written'] - start[w]['bytes_written'] for w in workers),
+    }
+
+
+class RunMetrics(object):
+    """
+    :param memory_sample_interval: seconds between samples of the memory of the dask workers of a phase.
+    """
+
+    def __init__(self, memory_sample_interval=1.0):
+        self.memory_sample_interval = memory_sample_interval
+        self.phases = {}
+        self.values = {}
+        self._start = time.perf_counter()
+        self._start_cpu = _cpu_seconds()
+        self._start_written = _bytes_written()
+        self._peak_rss = 0
+
+    @contextlib.contextmanager
+    def phase(self, name, cluster=None):
+        """
+        Measure a phase of the run. Phases with the same name are added together.
+
+        :param cluster: optional dask client, the workers of its cluster are measured as well.
+        """
+        # the task has this process to itself, unlike the dask workers.
+        _reset_peak_rss()
+        cluster_start = _cluster_usage(cluster, process_usage) if cluster is not None else None
+        sampler = None
+        if cluster_start is not None:
+            sampler = ClusterMemorySampler(cluster, self.memory_sample_interval)
+            sampler.start()
+        start = time.perf_counter()
+        start_cpu = _cpu_seconds()
+        start_written = _bytes_written()
+        try:
+            yield
+        finally:
+            peak = _peak_rss()
+            self._peak_rss = max(self._peak_rss, peak)
+            phase = self.phases.setdefault(name, {'seconds': 0.0, 'cpu_seconds': 0.0, 'peak_rss_bytes': 0,
+                                                  'bytes_written': 0, 'dask_cpu_seconds': 0.0,
+                                                  'dask_peak_rss_bytes': 0, 'dask_bytes_written': 0,
+                                                  'peak_memory_bytes': 0})
+            phase['seconds'] += time.perf_counter() - start
+            phase['cpu_seconds'] += _cpu_seconds() - start_cpu
+            phase['peak_rss_bytes'] = max(phase['peak_rss_bytes'], peak)
+            phase['bytes_written'] += _bytes_written() - start_written
+
+            dask_peak = 0
+            if sampler is not None:
+                sampler.stop()
+            cluster_end = _cluster_usage(cluster, process_usage) if cluster_start is not None else None
+            if cluster_end is not None:
+                used = _cluster_difference(cluster_start, cluster_end, sampler.peaks)
+                dask_peak = used['dask_peak_rss_bytes']
+                phase['dask_cpu_seconds'] += used['dask_cpu_seconds']
+                phase['dask_peak_rss_bytes'] = max(phase['dask_peak_rss_bytes'], dask_peak)
+                phase['dask_bytes_written'] += used['dask_bytes_written']
+            phase['peak_memory_bytes'] = max(phase['peak_memory_bytes'], peak + dask_peak)
+
+    def as_dict(self):
+        """
+        :return: the totals for the run, any extra values set on it and the figures for each phase.
+        """
+        peak_rss = max(self._peak_rss, _peak_rss())
+        phases = self.phases.values()
+        result = {
+            'seconds': round(time.perf_counter() - self._start, 3),
+            'cpu_seconds': round(_cpu_seconds() - self._start_cpu, 3),
+            'peak_rss_bytes': peak_rss,
+            'bytes_written': _bytes_written() - self._start_written,
+            'dask_cpu_seconds': round(sum(p['dask_cpu_seconds'] for p in phases), 3),
+            'dask_peak_rss_bytes': max([p['dask_peak_rss_bytes'] for p in phases], default=0),
+            'dask_bytes_written': sum(p['dask_bytes_written'] for p in phases),
+            'peak_memory_bytes': max([peak_rss] + [p['peak_memory_bytes'] for p in phases]),
+        }
+        result.update(self.values)
+        result['phases'] = {
+            name: {k: round(v, 3) if isinstance(v, float) else v for k, v in phase.items()}
+            for name, phase in self.phases.items()
+        }
+        return result
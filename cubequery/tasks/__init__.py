@@ -1,23 +1,41 @@
 import json
 import ast
+import hashlib
 import logging
 import os
-import zipfile
 from datetime import datetime
 from enum import EnumMeta
 from os import path
 from urllib.error import HTTPError
 from urllib.request import Request, urlopen
+import threading
+import time
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 
-import datacube
+import numpy
+from celery import Task, chord, uuid
 from jobtastic import JobtasticTask
 from shapely import wkt
 from shapely.geometry import shape, GeometryCollection
-
-from cubequery import get_config, fetch_form_settings
-from libcatapult.storage.s3_tools import S3Utils
+from shapely.ops import unary_union
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+
+from cubequery import estimates, get_config, task_index
+from cubequery.aoi import AOI
+from cubequery.archive import archive_policy
+from cubequery.conditions import compiled_conditions, create_error_message
+from cubequery.dask_cluster import ChunkedDatacube, dask_client, run_chunk_sizes
+from cubequery.profiling import TaskProfiler
+from cubequery.resources import s3_client, shared_datacube
+from cubequery.result_dir import InsufficientDiskSpace, result_directory
+from cubequery.routing import area_km2, date_span, queue_for, submission_cost
+from cubequery.streaming_upload import S3MultipartWriter
+from cubequery.task_metrics import RunMetrics, memory_measure
+from cubequery.temporal import reduce_time_outputs, time_windows
+from cubequery.tiling import merge_tile_outputs, tile_geometry
 
 _http_headers = {"Content-Type": "application/json", "User-Agent": "cubequery-result"}
 
@@ -106,13 +124,188 @@ class Parameter(object):
         return super().__ne__(o)
 
 
+# the largest AOI, in square degrees, a single run is allowed to take on.
+max_aoi_area = 0.25
+
+
+def _geometry_of(value):
+    return value.geometry if isinstance(value, AOI) else wkt.loads(value)
+
+
+class ValidatedRequest(object):
+    """
+    The arguments of a submission that has passed validation.
+
+    WKT arguments are held as parsed AOI values. When the request is serialised into the celery params their WKB is
+    sent along side the text under `_geometry` so the worker can rebuild them without parsing WKT again.
+    """
+
+    def __init__(self, task, args):
+        self.task = task
+        self.args = args
+
+    @property
+    def geometries(self):
+        return {k: v for k, v in self.args.items() if isinstance(v, AOI)}
+
+    def to_params(self):
+        params = dict(self.args)
+        geometries = self.geometries
+        if geometries:
+            params['_geometry'] = {k: v.wkb_hex for k, v in geometries.items()}
+        return json.dumps(params)
+
+    @staticmethod
+    def decode_params(params):
+        """
+        Turn a params block back into an argument dictionary, rebuilding any AOI values.
+        """
+        args = json.loads(params)
+        for k, wkb_hex in args.pop('_geometry', {}).items():
+            if k in args:
+                args[k] = AOI.from_wkb(args[k], wkb_hex)
+        return args
+
+
 class CubeQueryTask(JobtasticTask):
 
+    # tasks whose outputs can be made a tile at a time and mosaiced together can take AOIs too large for one run.
+    tileable = False
+
+    # tasks can have long date ranges split into windows that are run in parallel and reduced together, see temporal.
+    time_parameters = None
+    time_window_days = None
+    time_reduce = "median"
+
+    # the parameter giving the pixel size in metres, used to size the dask chunks data is loaded with.
+    resolution_parameter = "res"
+
+    # how expensive the task is per pixel day relative to others, scales the cost used to pick its queue.
+    cost_coefficient = 1.0
+
+    # super is always given this class by name. celery re-creates task classes for each app that is set up, which
+    # points the class a bare super() looks at to the copy, so it fails for tasks subclassing this one.
+    def __init_subclass__(cls, **kwargs):
+        super(CubeQueryTask, cls).__init_subclass__(**kwargs)
+        cls.compile_parameters()
+
+    @classmethod
+    def compile_parameters(cls):
+        """
+        Build the lookups used to validate and decode arguments: the parameters by name and a validator and coercer
+        function per parameter. Called when a task class is created so it only happens once per class.
+        """
+        parameters = getattr(cls, 'parameters', [])
+        cls._parameter_index = {p.name: p for p in parameters}
+        cls._arg_validators = {p.name: compile_validator(p) for p in parameters}
+        cls._arg_coercers = {p.name: compile_coercer(p) for p in parameters}
+
     @classmethod
     def cal_significant_kwargs(cls, parameters):
         cls.significant_kwargs = [("params", str)]
         return cls.significant_kwargs
 
+    @classmethod
+    def canonical_params(cls, args):
+        """
+        Put a task's arguments in a canonical form so equivalent requests compare equal.
+        Numbers are converted to numbers, WKT is re-written in a standard format and the submitting user is dropped.
+
+        :param args: the argument dictionary of a submission.
+        :return: a canonical copy of the arguments.
+        """
+        result = {}
+        for k, v in args.items():
+            if k == 'user':
+                continue
+            param = cls._parameter_index.get(k)
+            d_type = param.d_type if param else None
+            try:
+                if d_type == DType.INT:
+                    v = int(v)
+                elif d_type in (DType.FLOAT, DType.LAT, DType.LON):
+                    v = float(v)
+                elif d_type == DType.WKT:
+                    geometry = v.geometry if isinstance(v, AOI) else wkt.loads(v)
+                    v = wkt.dumps(geometry, rounding_precision=8)
+            except Exception:
+                # leave anything that doesn't convert as it is, it has already been through validation.
+                pass
+            result[k] = v
+        return result
+
+    @classmethod
+    def result_cache_key(cls, args, version):
+        """
+        Content address for the result of running this task with these arguments.
+
+        :param args: the argument dictionary of a submission.
+        :param version: the version of the task code, the notebook repo commit.
+        :return: a cache key string.
+        """
+        content = json.dumps({'task': cls.name, 'params': cls.canonical_params(args), 'version': version},
+                             sort_keys=True, default=str)
+        return f"cubequery-result:{cls.name}:{hashlib.sha256(content.encode('utf-8')).hexdigest()}"
+
+    @classmethod
+    def _get_cache_key(cls, **kwargs):
+        # the api works out the key when the task is submitted so the worker stores the result under the same one.
+        if kwargs.get('result_key'):
+            return kwargs['result_key']
+        return super(CubeQueryTask, cls)._get_cache_key(**kwargs)
+
+    @classmethod
+    def find_cached_result(cls, result_key):
+        """
+        Look for a task that has already produced, or is producing, the result for this key.
+
+        :param result_key: a key from result_cache_key
+        :return: the id of the existing task or None.
+        """
+        return cls.cache.get(result_key) or cls.cache.get(f"herd:{result_key}") or \
+            cls.cache.get(f"running:{result_key}")
+
+    @classmethod
+    def mark_running(cls, result_key, task_id, args):
+        """
+        Note that a task is producing the result for this key, so find_cached_result finds it for as long as it runs.
+        jobtastic's own herd key only lasts `herd_avoidance_timeout` seconds, far shorter than most runs.
+
+        The marker expires after twice the expected run time, or `[App] running_timeout` if that is longer or there
+        is no estimate, so a worker that dies without clearing it doesn't block the result for long.
+        """
+        timeout = int(get_config("App", "running_timeout"))
+        try:
+            expected = estimates.estimate_submission(cls, args)
+        except Exception as e:
+            logging.warning(f"could not estimate the run time of {task_id}: {e}")
+            expected = None
+        if expected:
+            timeout = max(timeout, int(expected['seconds'] * 2))
+        cls.cache.set(f"running:{result_key}", task_id, timeout=timeout)
+
+    def _break_thundering_herd_cache(self):
+        # jobtastic calls this once the result is cached, or when the run fails.
+        super(CubeQueryTask, self)._break_thundering_herd_cache()
+        self.cache.delete(f"running:{self.cache_key}")
+
+    def delay_uncached(self, *args, **kwargs):
+        """
+        Like delay_or_fail but skips looking for a cached or in progress result. The result is still cached when
+        the task completes.
+        """
+        return self.async_uncached(args=args, kwargs=kwargs)
+
+    def async_uncached(self, args=None, kwargs=None, **options):
+        """
+        Like async_or_fail but skips looking for a cached or in progress result.
+        """
+        try:
+            # on the class, as apply_async below does. celery calls a task instance it is given, running it here.
+            return Task.apply_async(type(self), args, kwargs, **options)
+        except self._get_possible_broker_errors_tuple() as e:
+            return self.simulate_async_error(e)
+
     @classmethod
     def map_d_type_to_jobtastic(cls, d_type):
         # TODO: add more data types here.
@@ -126,98 +319,400 @@ class CubeQueryTask(JobtasticTask):
     def map_kwargs(self, **kwargs):
         result = {}
         logging.info("decoding args")
-        for k, v in json.loads(kwargs['params']).items():
-            logging.info(f"decoding {k} with value {v}")
-            args = [p for p in self.parameters if p.name == k]
-            if len(args) > 0:
-                arg = args[0]
-                logging.info(f"found arg for {k} with type {arg.d_type}")
-                if arg.d_type == DType.INT:
-                    result[k] = int(v)
-                elif arg.d_type in (DType.FLOAT, DType.LAT, DType.LON):
-                    result[k] = float(v)
-                elif arg.d_type == DType.MULTI:
-                    result[k] = v
-                else:
-                    result[k] = v
+        coercers = self._arg_coercers
+        for k, v in ValidatedRequest.decode_params(kwargs['params']).items():
+            coerce = coercers.get(k)
+            if coerce is not None:
+                result[k] = coerce(v)
             else:
                 logging.warning(f"Not found a parameter entry for {k}")
                 result[k] = v
         return result
 
+    def parse_arg(self, name, value):
+        """
+        Parse a submitted value ready for validation. WKT values become AOI objects so they are only parsed once,
+        anything that doesn't parse is left alone for validation to reject.
+        """
+        param = self._parameter_index.get(name)
+        if param is not None and param.d_type == DType.WKT and isinstance(value, str) and not isinstance(value, AOI):
+            try:
+                return AOI(value)
+            except Exception:
+                return value
+        return value
+
     def validate_arg(self, name, value):
-        search = [p for p in self.parameters if p.name == name]
-        if len(search) == 0:
+        validate = self._arg_validators.get(name)
+        if validate is None:
             return False, f"parameter {name} not found"
+        return validate(value)
+
+    def calculate_result(self, publish, profile=False, part=None, parts=None, **kwargs):
+        """
+        This is the entry point for a task run. Will be called by celery.
 
-        param = search[0]
-        if not validate_d_type(param, value):
-            return False, f"parameter {name} value did not validate"
+        :param publish: send the results on to the publishing server.
+        :param profile: profile generate_product and upload the profile next to the results.
+        :param part: set when this run is one part of a split run, a dictionary of the id of the whole run (`of`) and
+            the index of this part (`index`).
+        :param parts: set when this run is the merge step of a split run, a dictionary of the number of parts
+            (`count`) and how they are merged (`merge`, either tiles or time).
+        :param kwargs: arguments to the tasks.
+        :return:
+        """
 
-        if len(param.valid) > 0 and param.d_type == DType.STRING:
-            if isinstance(param.valid[0], dict):
-                if not [v for v in param.valid if value in v.values()]:
-                    return False, f"value {value} not found in valid values"
+        metrics = RunMetrics(memory_sample_interval=float(get_config("App", "memory_sample_interval")))
+        results = result_directory()
+        try:
+            with metrics.phase("prepare"):
+                path_prefix = results.start(self.request.id)
+        except InsufficientDiskSpace as e:
+            logging.warning(f"deferring {self.request.id}: {e}")
+            raise self.retry(exc=e, countdown=int(get_config("Results", "defer_delay")),
+                             max_retries=int(get_config("Results", "defer_max_retries")))
+
+        success = False
+        profiler = TaskProfiler(enabled=profile, interval=float(get_config("App", "profile_sample_interval")))
+        try:
+            with metrics.phase("decode_args"):
+                args = self.map_kwargs(**kwargs)
+            if part is None and kwargs.get('result_key'):
+                self.mark_running(kwargs['result_key'], self.request.id, args)
+
+            if parts:
+                # the outputs come from the part runs rather than the datacube.
+                with metrics.phase("merge_parts"):
+                    outputs, part_keys = self.merge_parts(path_prefix, parts, args)
+            else:
+                # connect to the datacube and pass that in to the users function.
+                # Everything should be talking to the datacube here so makes sense to pull it out and make things
+                # easier for the users. The connection is shared by every task run in this worker process.
+                with metrics.phase("connect_datacube"):
+                    dc = self.connect_datacube(args)
+                # most of the work happens on the dask workers, so they are measured as well.
+                with metrics.phase("generate_product", cluster=getattr(dc, "dask_client", None)):
+                    with profiler:
+                        outputs = self.generate_product(dc, path_prefix, **args)
+            logging.info(f"got result of {outputs}")
+
+            if part is not None:
+                # the merge step packages up the outputs of all the parts.
+                with metrics.phase("upload_results"):
+                    result = {'part': part['index'], 'outputs': self.upload_part(part, outputs)}
             else:
-                if not [v for v in param.valid if value in v]:
-                    return False, f"value {value} not found in valid values"
+                with metrics.phase("log_query"):
+                    self.log_query(path_prefix)
+
+                # the archive is built while it uploads so zipping and uploading are one phase.
+                with metrics.phase("upload_results"):
+                    output_url, archive = self.upload_results(path_prefix, outputs)
+                    profile_urls = self.upload_profile(profiler.save(path_prefix, self.request.id))
+                if parts:
+                    self.delete_part_outputs(part_keys)
+                if publish:
+                    with metrics.phase("ping_results"):
+                        self.ping_results(output_url, args)
+
+                metrics.values['output_bytes'] = archive['output_bytes']
+                result = {'output': output_url, 'archive': archive}
+                if profile_urls:
+                    result['profile'] = profile_urls
+            success = True
+        finally:
+            results.finish(self.request.id, success)
+
+        result['metrics'] = metrics.as_dict()
+        # merges don't load anything so they say nothing about how long a run of a given size takes.
+        self.record_metrics(result['metrics'], None if parts else args)
+        return result
 
-        return True, ""
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        part = kwargs.get('part')
+        if part is not None:
+            # the chord never runs the merge once a part has failed, so nothing else would finish the whole run. It
+            # is failed here, and the marker cleared, so the next identical submission starts again.
+            logging.warning(f"part {part['index']} of {part['of']} failed, failing the run: {exc!r}")
+            if kwargs.get('result_key'):
+                self.cache.delete(f"running:{kwargs['result_key'].rsplit(':part:', 1)[0]}")
+            try:
+                task_index.record_failure(part['of'], f"part {part['index']} failed: {exc!r}")
+            except Exception as e:
+                logging.warning(f"could not record the failure of {part['of']}: {e}")
+        super(CubeQueryTask, self).on_failure(exc, task_id, args, kwargs, einfo)
 
-    def calculate_result(self, publish, **kwargs):
+    @classmethod
+    def apply_async(cls, args=None, kwargs=None, **options):
+        # the parts of a split run are counted by their chord, they must really run rather than being swapped for an
+        # equivalent cached or in progress task.
+        if kwargs and (kwargs.get('part') is not None or kwargs.get('parts')):
+            return Task.apply_async(cls, args, kwargs, **options)
+        return super(CubeQueryTask, cls).apply_async(args, kwargs, **options)
+
+    def connect_datacube(self, args):
         """
-        This is the entry point for a task run. Will be called by celery.
+        The datacube a run is given, set up to load with chunks sized for the AOI and resolution of the run and to
+        compute on the dask cluster of this host.
+        """
+        dc = shared_datacube()
+        name = self.wkt_parameter()
+        if name is None or not args.get(name):
+            return ChunkedDatacube(dc, None, dask_client())
+        chunks = run_chunk_sizes(_geometry_of(args[name]).bounds, args.get(self.resolution_parameter))
+        logging.info(f"loading with dask chunks {chunks}")
+        return ChunkedDatacube(dc, chunks, dask_client())
 
-        :param kwargs: arguments to the tasks.
-        :return:
+    @classmethod
+    def wkt_parameter(cls):
+        """
+        The name of the first WKT parameter of the task, the one tiled runs are split on, or None.
+        """
+        for p in getattr(cls, 'parameters', []):
+            if p.d_type == DType.WKT:
+                return p.name
+        return None
+
+    @classmethod
+    def needs_tiling(cls, args):
+        """
+        Check if a submission has to be split into tiles, because its AOI is too big for a single run.
         """
+        name = cls.wkt_parameter()
+        if not cls.tileable or name is None or name not in args:
+            return False
+        return _geometry_of(args[name]).area > max_aoi_area
+
+    @classmethod
+    def time_windows(cls, args):
+        """
+        The date windows a submission is split into, empty if the task doesn't split on time or the submission
+        doesn't have both dates.
+        """
+        if not cls.time_parameters or not cls.time_window_days:
+            return []
+        start, end = cls.time_parameters
+        if not args.get(start) or not args.get(end):
+            return []
+        return time_windows(args[start], args[end], int(cls.time_window_days))
+
+    @classmethod
+    def split_submission(cls, args):
+        """
+        Work out if a submission has to be run in parts, either because its AOI is too large or its date range too
+        long for a single run.
+
+        :param args: the validated arguments of the submission.
+        :return: None if it can be run in one go, otherwise a tuple of how the parts are merged, tiles or time, and
+            the arguments of each part.
+        """
+        if cls.needs_tiling(args):
+            name = cls.wkt_parameter()
+            tiles = tile_geometry(_geometry_of(args[name]), float(get_config("Tiling", "tile_size")))
+            return "tiles", [dict(args, **{name: AOI(g.wkt, g)}) for g in tiles]
+
+        windows = cls.time_windows(args)
+        if len(windows) > 1:
+            start, end = cls.time_parameters
+            return "time", [dict(args, **{start: first, end: last}) for first, last in windows]
+        return None
+
+    @classmethod
+    def run_size(cls, args):
+        """
+        The size of a run, what its cost and estimates are worked out from. Tasks without an AOI count as a square
+        kilometre.
 
-        # connect to the datacube and pass that in to the users function.
-        # Everything should be talking to the datacube here so makes sense to pull it out and make things
-        # easier for the users.
-        result_dir = get_config("App", "result_dir")
-        path_prefix = path.join(result_dir, self.request.id)
+        :return: a dictionary of the AOI area in square kilometres, the number of days covered, the resolution and
+            the platform, if the task has one.
+        """
+        name = cls.wkt_parameter()
+        area = area_km2(_geometry_of(args[name])) if name is not None and args.get(name) else 1.0
+        dates = [v for k, v in args.items()
+                 if k in cls._parameter_index and cls._parameter_index[k].d_type == DType.DATE]
+        resolution = args.get(cls.resolution_parameter)
+        if resolution is None:
+            resolution = float(get_config("Dask", "default_resolution"))
+        return {'area': area, 'days': date_span(dates), 'resolution': abs(float(resolution)),
+                'platform': args.get('platform')}
 
-        os.makedirs(path_prefix, exist_ok=True)
+    @classmethod
+    def estimate_cost(cls, args):
+        """
+        The cost of a submission, see routing.
+        """
+        size = cls.run_size(args)
+        return submission_cost(size['area'], size['days'], size['resolution'], float(cls.cost_coefficient))
 
-        args = self.map_kwargs(**kwargs)
+    @classmethod
+    def route(cls, args):
+        """
+        The queue and priority a submission should be sent with.
+        """
+        return queue_for(cls.estimate_cost(args))
 
-        dc = datacube.Datacube(app=self.name)
-        outputs = self.generate_product(dc, path_prefix, **args)
-        logging.info(f"got result of {outputs}")
-        self.log_query(path_prefix)
-        self.zip_outputs(path_prefix, outputs)
+    def delay_parts(self, publish, validated, result_key, merge, part_args):
+        """
+        Submit a run as separate parts, followed by a merge once they have all finished.
+
+        :param publish: send the merged results on to the publishing server.
+        :param validated: the ValidatedRequest of the whole submission.
+        :param result_key: the result cache key of the whole submission.
+        :param merge: how the parts are merged, tiles or time.
+        :param part_args: the argument dictionary of each part, from split_submission.
+        :return: the AsyncResult of the merge, whose id is the id of the whole run.
+        """
+        task_id = uuid()
+        header = []
+        for index, args in enumerate(part_args):
+            # each part is routed on its own cost, the merge on the cost of the whole run.
+            header.append(self.signature(args=(False,), kwargs={
+                "part": {'of': task_id, 'index': index},
+                "params": ValidatedRequest(self, args).to_params(),
+                "result_key": f"{result_key}:part:{index}",
+            }, **self.route(args)))
+        body = self.signature(args=(publish,), kwargs={
+            "parts": {'count': len(part_args), 'merge': merge},
+            "params": validated.to_params(),
+            "result_key": result_key,
+        }, immutable=True, **self.route(validated.args)).set(task_id=task_id)
+
+        logging.info(f"submitting {self.name} as {len(part_args)} {merge} parts merged by {task_id}")
+        # the merge doesn't start until the parts are done, the submission is running as soon as they are sent.
+        self.mark_running(result_key, task_id, validated.args)
+        return chord(header, app=self.app)(body)
+
+    @staticmethod
+    def part_prefix(task_id):
+        return os.path.join(get_config("AWS", "path_prefix"), f"{task_id}_parts") + "/"
+
+    def upload_part(self, part, outputs):
+        """
+        Upload the outputs of one part of a split run for the merge step to pick up.
 
-        output_url = self.upload_results(path_prefix)
-        if publish:
-            self.ping_results(output_url, args)
+        :return: the keys of the uploaded files.
+        """
+        bucket = get_config("AWS", "bucket")
+        s3 = s3_client(get_config("AWS", "s3_endpoint"))
+        keys = []
+        for f in outputs:
+            key = f"{self.part_prefix(part['of'])}{part['index']}/{path.basename(f)}"
+            s3.upload_file(f, bucket, key)
+            keys.append(key)
+        return keys
+
+    def merge_parts(self, path_prefix, parts, args):
+        """
+        Fetch the outputs of the parts of this run and merge them together.
+
+        :param path_prefix: the working directory of the task.
+        :param parts: the dictionary of the number of parts and how to merge them.
+        :param args: the arguments of the whole run.
+        :return: the merged output files and the keys of the part outputs.
+        """
+        bucket = get_config("AWS", "bucket")
+        s3 = s3_client(get_config("AWS", "s3_endpoint"))
+        prefix = self.part_prefix(self.request.id)
+
+        keys = []
+        for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+            keys.extend(o['Key'] for o in page.get('Contents', []))
+
+        part_files = {}
+        for key in keys:
+            index, name = key[len(prefix):].split('/', 1)
+            local_path = path.join(path_prefix, "parts", index, name)
+            os.makedirs(path.dirname(local_path), exist_ok=True)
+            s3.download_file(bucket, key, local_path)
+            part_files.setdefault(int(index), []).append(local_path)
+
+        logging.info(f"merging outputs from {len(part_files)} of {parts['count']} {parts['merge']} parts")
+        if parts['merge'] == "time":
+            window_days = {i: date_span(window) for i, window in enumerate(self.time_windows(args))}
+            return reduce_time_outputs(part_files, path_prefix, self.time_reduce, window_days), keys
+        return merge_tile_outputs(part_files, path_prefix), keys
+
+    def delete_part_outputs(self, keys):
+        bucket = get_config("AWS", "bucket")
+        s3 = s3_client(get_config("AWS", "s3_endpoint"))
+        for i in range(0, len(keys), 1000):
+            s3.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': k} for k in keys[i:i + 1000]]})
+
+    def record_metrics(self, run_metrics, args=None):
+        """
+        Put the metrics of this run in the task index, so they show up in the task status and the summaries.
+        Losing them isn't worth failing a finished task over.
+
+        :param args: the arguments of the run, when given its size, run time and memory are kept to estimate future
+            runs from.
+        """
+        # imported here as git_packages needs this module to be loaded first.
+        from cubequery import git_packages
+        logging.info(f"task {self.request.id} metrics {run_metrics}")
+        try:
+            task_index.record_metrics(self.request.id, self.name, git_packages.repo_version() or "unknown",
+                                      run_metrics)
+            if args is not None:
+                sample = dict(self.run_size(args), seconds=run_metrics['seconds'],
+                              peak_memory_bytes=run_metrics['peak_memory_bytes'], memory_measure=memory_measure)
+                task_index.record_run_sample(self.name, sample, int(get_config("Estimates", "max_samples")))
+        except Exception as e:
+            logging.warning(f"could not record metrics for {self.request.id}: {e}")
 
     def log_query(self, path_prefix):
         output = path.join(path_prefix, "query.json")
         with open(output, 'w') as f:
             json.dump(self.request.__dict__, f, skipkeys=True)
 
-    def zip_outputs(self, path_prefix, results):
-        output = os.path.join(path_prefix, self.request.id + "_output.zip")
-        with zipfile.ZipFile(output, 'w') as zf:
-            zf.write(path.join(path_prefix, "query.json"), arcname="query.json")
-            for f in results:
-                zf.write(f, arcname=path.basename(f))
+    def zip_outputs(self, path_prefix, results, output=None):
+        """
+        Write the query log and outputs into a zip archive, each file compressed as the archive policy decides.
+
+        :param path_prefix: the working directory of the task.
+        :param results: list of output file paths.
+        :param output: file object to write the archive to, defaults to a file in the working directory.
+        :return: statistics about building the archive, see `ArchivePolicy.write`.
+        """
+        if output is None:
+            output = os.path.join(path_prefix, self.request.id + "_output.zip")
+        files = [(path.join(path_prefix, "query.json"), "query.json")]
+        files.extend((f, path.basename(f)) for f in results)
+        stats = archive_policy().write(output, files)
+        logging.info(f"built archive for {self.request.id} in {stats['seconds']}s, {stats['input_bytes']} bytes "
+                     f"to {stats['output_bytes']}, {stats['stored']} stored {stats['deflated']} deflated")
+        return stats
+
+    def upload_results(self, path_prefix, results):
+        """
+        Zip the outputs straight into a multipart upload to S3, so the archive is never written to local disk and
+        the upload happens while the archive is being built.
 
-    def upload_results(self, path_prefix):
-        source_file_path = os.path.join(path_prefix, self.request.id + "_output.zip")
+        :return: the key of the uploaded archive and the statistics about building it.
+        """
         dest_file_path = os.path.join(get_config("AWS", "path_prefix"), self.request.id + "_output.zip")
 
-        access_key = get_config("AWS", "access_key_id")
-        secret_key = get_config("AWS", "secret_access_key")
         bucket = get_config("AWS", "bucket")
 
-        s3_tools = S3Utils(access_key, secret_key, bucket, get_config("AWS", "s3_endpoint"),
-                           get_config("AWS", "region"))
+        with S3MultipartWriter(s3_client(get_config("AWS", "s3_endpoint")), bucket, dest_file_path,
+                               part_size=int(get_config("AWS", "upload_part_size")),
+                               max_concurrency=int(get_config("AWS", "upload_concurrency"))) as writer:
+            stats = self.zip_outputs(path_prefix, results, writer)
 
-        s3_tools.put_file(source_file_path, dest_file_path)
+        return dest_file_path, stats
 
-        return dest_file_path
+    def upload_profile(self, profile_files):
+        """
+        Upload profile files next to the output archive.
+
+        :return: the keys of the uploaded files.
+        """
+        bucket = get_config("AWS", "bucket")
+        s3 = s3_client(get_config("AWS", "s3_endpoint"))
+        keys = []
+        for f in profile_files:
+            key = os.path.join(get_config("AWS", "path_prefix"), path.basename(f))
+            s3.upload_file(f, bucket, key)
+            keys.append(key)
+        return keys
 
     def ping_results(self, output_url, results):
         result_url = get_config("App", "result_url")
@@ -250,7 +745,7 @@ class CubeQueryTask(JobtasticTask):
                 # intentionally swallowing error as the data has still been generated at this point.
 
     herd_avoidance_timeout = 60
-    cache_duration = 60 * 60 * 24  # One day of seconds
+    cache_duration = int(get_config("App", "result_cache_duration"))
 
     def standard_validation(self, args):
         """
@@ -260,68 +755,102 @@ class CubeQueryTask(JobtasticTask):
         
         """
 
-        _settings_json = fetch_form_settings()
-
-        if not _settings_json:
-            with open('input_conditions.json') as res_json:
-                _settings_json = json.load(res_json)
-
-        keys = [k for k in _settings_json if k in args]
-
         errors = []
 
         # Validates AOI
         wkt_fields = [p.name for p in self.parameters if p.d_type == DType.WKT]
-        countries = ast.literal_eval(get_config("Boundaries", "projects")).keys()
+        countries = project_boundaries().names
 
+        # tileable tasks split larger AOIs into pieces a single run can take on.
+        max_area = float(get_config("Tiling", "max_area")) if self.tileable else max_aoi_area
         for s in wkt_fields:
-            errors = validate_standard_spatial_query(args[s], countries)
+            errors = validate_standard_spatial_query(args[s], countries, max_area)
+
+        # the run is sized and routed by its area in pixels, which needs a pixel size.
+        resolution = args.get(self.resolution_parameter)
+        if resolution is not None and not _is_positive(resolution):
+            errors.append(create_error_message({'id': self.resolution_parameter,
+                                                'error_message': 'Resolution must be greater than zero',
+                                                '_comment': 'Resolution must be greater than zero'}))
 
         # Validates information against input_conditions.json
-        # Parameters to be validated e.g. platform
-        for key in keys:
-            # The value of the parameter
-            for d in _settings_json[key]:
-                # If the param is included in arguments
-                if d['name'] == args[key]:
-                    for condition in d['conditions']:
-                        # Check for process specific condition
-                        if "processes" in condition and self.name not in condition['processes']:
-                            continue
-
-                        # Integer Range Validation
-                        if condition['type'] == 'int_range':
-                            for c in condition['id']:
-                                if c in args:
-                                    if len(condition['value']) == 2:
-                                        if not (int(args[c]) >= condition['value'][0]) or not (
-                                                int(args[c]) <= condition['value'][1]):
-                                            errors.append(create_error_message(condition))
-                                    else:
-                                        if not (int(args[c]) >= condition['value'][0]):
-                                            errors.append(create_error_message(condition))
-
-                        # Date Range Validation
-                        if condition['type'] == 'date_range':
-                            for c in condition['id']:
-                                if c in args:
-                                    if len(condition['value']) == 2:
-                                        if not (args[c] >= condition['value'][0]) or not (
-                                                args[c] <= condition['value'][1]):
-                                            errors.append(create_error_message(condition))
-                                    else:
-                                        if not (args[c] >= condition['value'][0]):
-                                            errors.append(create_error_message(condition))
+        errors += compiled_conditions().validate(self.name, args)
 
         return errors
 
 
-def validate_standard_spatial_query(aoi, countries):
+class ProjectBoundaries(object):
+    """
+    The project boundaries from the config, parsed once and prepared for repeated containment checks.
+
+    Each project has either a `bounds` WKT string or a `bounds_file` of GeoJSON features. The boundaries are held in
+    an STRtree so only the projects whose envelope overlaps an AOI are tested, and each test uses a prepared
+    geometry so detailed borders only have their edges indexed once.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        projects = ast.literal_eval(source)
+        self.names = list(projects.keys())
+        self._geometries = [self._load_bounds(projects[n]) for n in self.names]
+        self._prepared = [prep(g) for g in self._geometries]
+        self._index_by_id = {id(g): i for i, g in enumerate(self._geometries)}
+        self._tree = STRtree(self._geometries) if self._geometries else None
+
+    @staticmethod
+    def _load_bounds(project):
+        if project.get('bounds_file'):
+            with open(project['bounds_file']) as f:
+                features = json.load(f)["features"]
+            return unary_union([shape(feature["geometry"]).buffer(0) for feature in features])
+        return wkt.loads(project['bounds'])
+
+    def _candidates(self, geom):
+        if self._tree is None:
+            return []
+        # shapely 2 returns indices from query, earlier versions return the geometries themselves.
+        return [hit if isinstance(hit, (int, numpy.integer)) else self._index_by_id[id(hit)]
+                for hit in self._tree.query(geom)]
+
+    def contains(self, geom, projects):
+        """
+        :param geom: the geometry to check
+        :param projects: names of the projects that are allowed.
+        :return: True if the geometry is within the boundary of any of the allowed projects.
+        """
+        for i in self._candidates(geom):
+            if self.names[i] in projects and self._prepared[i].contains(geom):
+                return True
+        return False
+
+
+_project_boundaries = None
+
+
+def project_boundaries():
+    """
+    Get the parsed project boundaries, re-parsing them only if the config has changed.
+    """
+    global _project_boundaries
+    source = get_config("Boundaries", "projects")
+    if _project_boundaries is None or _project_boundaries.source != source:
+        _project_boundaries = ProjectBoundaries(source)
+    return _project_boundaries
+
+
+def _is_positive(value):
+    try:
+        return float(value) > 0
+    except (TypeError, ValueError):
+        return False
+
+
+def validate_standard_spatial_query(aoi, countries, max_area=max_aoi_area):
     
     errors = []
 
     try:
-        parsed_polygon = wkt.loads(aoi)
+        parsed_polygon = aoi.geometry if isinstance(aoi, AOI) else wkt.loads(aoi)
     except:
         return [create_error_message({'id': 'aoi', 'error_message': 'Polygon could not be loaded',
                                         '_comment': 'Polygon could not be loaded'})]
@@ -346,7 +875,7 @@ def validate_standard_spatial_query(aoi, countries):
     '''
     Validates size of polygon
     '''
-    if area > 0.25:
+    if area > max_area:
         errors.append(create_error_message(
             {'id': 'aoi', 'error_message': 'AOI area is too large', '_comment': 'Size of polygon is too large'}))
 
@@ -362,14 +891,8 @@ def validate_standard_spatial_query(aoi, countries):
         features = json.load(f)["features"]
         fiji_polygon = GeometryCollection([shape(feature["geometry"]).buffer(0) for feature in features])
     '''
-    projects=get_config("Boundaries", "projects")
-    available_countries = {k: v for k, v in ast.literal_eval(projects).items() if k in countries}
+    valid_geom = project_boundaries().contains(parsed_polygon, countries)
 
-    valid_geom = False       
-    for country in available_countries.keys():
-        if parsed_polygon.within(wkt.loads(available_countries[country]['bounds'])):
-            valid_geom = True
-    
     if not valid_geom:
         errors.append(create_error_message({'id': 'aoi', 'error_message': 'AOI is not within your available countries',
                                             '_comment': 'AOI is not within the available country'}))
@@ -377,7 +900,63 @@ def validate_standard_spatial_query(aoi, countries):
     return errors
 
 
-def check_database_spatial(aoi, platform, start_date, end_date):
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+_product_ids = {}
+_product_ids_loaded = 0
+
+
+def _get_db_pool():
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is None:
+            _db_pool = psycopg2.pool.ThreadedConnectionPool(
+                int(get_config('Database', 'pool_min')),
+                int(get_config('Database', 'pool_max')),
+                host=get_config('datacube', 'db_hostname'),
+                database=get_config('datacube', 'db_database'),
+                user=get_config('datacube', 'db_username'),
+                password=get_config('datacube', 'db_password'))
+        return _db_pool
+
+
+class DatabaseBusyError(Exception):
+    """
+    Raised when every connection in the database pool stays in use for longer than `[Database] pool_wait` seconds.
+    """
+    pass
+
+
+def _get_connection(pool):
+    # the pool raises straight away when it is exhausted, so wait a little for a connection to be handed back.
+    deadline = time.monotonic() + float(get_config('Database', 'pool_wait'))
+    while True:
+        try:
+            return pool.getconn()
+        except psycopg2.pool.PoolError as e:
+            if time.monotonic() >= deadline:
+                raise DatabaseBusyError(f"no database connection free: {e}")
+            time.sleep(0.05)
+
+
+def _product_id(cursor, platform):
+    """
+    Look up the dataset_type id of a product, from a cached map of all products.
+    The map is reloaded when it gets old or a product is asked for that isn't in it.
+    """
+    global _product_ids, _product_ids_loaded
+    max_age = int(get_config('Database', 'product_cache_duration'))
+    if platform not in _product_ids or time.time() - _product_ids_loaded > max_age:
+        cursor.execute("SELECT id, name FROM agdc.dataset_type")
+        _product_ids = {r['name']: r['id'] for r in cursor.fetchall()}
+        _product_ids_loaded = time.time()
+    if platform not in _product_ids:
+        raise ValueError(f"Unknown platform {platform}")
+    return _product_ids[platform]
+
+
+def check_database_spatial(aoi, platform, start_date, end_date, exists_only=False):
     # Check that the params are safe and valid
     if not aoi.startswith("POLYGON"):
         raise ValueError("AOI must be a polygon")
@@ -389,37 +968,35 @@ def check_database_spatial(aoi, platform, start_date, end_date):
     if datetime.strptime(end_date, "%Y-%m-%d") is None:
         raise ValueError("End date must be a valid date")
 
-    # Establish connection
-    connection = psycopg2.connect(host=get_config('datacube', 'db_hostname'),
-                            database=get_config('datacube', 'db_database'),
-                            user=get_config('datacube', 'db_username'),
-                            password=get_config('datacube', 'db_password'))
-
-    # Establish cursor
-    cursor = connection.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
-
-    # Query to fetch dataset_type_ref
-    q = """
-    SELECT id FROM agdc.dataset_type WHERE name = %s
-    """
-    cursor.execute(q, (platform,))
-    dataset_type_ref = cursor.fetchone()['id']
-
-    # Spatial query if data exists
-    q = """
-    SELECT id FROM cubedash.dataset_spatial WHERE dataset_type_ref = %s AND center_time BETWEEN %s AND %s AND ST_Intersects(footprint, ST_GeomFromText(%s, 4326))
-    """
-    cursor.execute(q, (dataset_type_ref, start_date, end_date, aoi))
-    rows = cursor.fetchall()
-
-    # End connection
-    cursor.close()
-    connection.close()
+    pool = _get_db_pool()
+    connection = _get_connection(pool)
+    broken = False
+    try:
+        with connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            dataset_type_ref = _product_id(cursor, platform)
+
+            # Spatial query if data exists, only ever returning a single row.
+            q = """
+            FROM cubedash.dataset_spatial WHERE dataset_type_ref = %s AND center_time BETWEEN %s AND %s AND ST_Intersects(footprint, ST_GeomFromText(%s, 4326))
+            """
+            if exists_only:
+                q = f"SELECT EXISTS (SELECT 1 {q}) AS found"
+            else:
+                q = f"SELECT count(*) AS found {q}"
+            cursor.execute(q, (dataset_type_ref, start_date, end_date, aoi))
+            found = cursor.fetchone()['found']
+        connection.rollback()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        # hand the connection back to the pool, dropping it if it has gone bad.
+        pool.putconn(connection, close=broken)
 
     return {
         'dataset_type_ref': dataset_type_ref,
-        'dataset_count': len(rows),
-        'valid_datasets' : bool(len(rows) > 0)
+        'dataset_count': None if exists_only else found,
+        'valid_datasets': bool(found)
     }
 
 
@@ -438,39 +1015,107 @@ def login_to_publisher():
         raise e
 
 
-def validate_d_type(param, value):
+def _check_wkt(value):
+    if isinstance(value, AOI):
+        return True
+    # try and parse it and see what happens
+    try:
+        wkt.loads(value)
+        return True
+    except Exception:
+        return False
+
+
+def _check_date(value):
+    # try and parse it and see what happens
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def _check_bounded_float(lower, upper):
+    def check(value):
+        try:
+            return lower <= float(value) <= upper
+        except (TypeError, ValueError):
+            return False
+    return check
+
+
+def _compile_type_check(param):
+    """
+    :return: a function checking a value is acceptable for the parameter's data type.
+    """
     if param.d_type == DType.INT:
-        return check_int(value)
+        return check_int
     if param.d_type == DType.FLOAT:
-        return check_float(param, value)
+        return lambda value: check_float(param, value)
     if param.d_type == DType.MULTI:
-        return True
+        return lambda value: True
     if param.d_type == DType.LAT:
-        if check_float(value):
-            v = float(value)
-            return -90.0 <= v <= 90.0
-        return False
+        return _check_bounded_float(-90.0, 90.0)
     if param.d_type == DType.LON:
-        if check_float(value):
-            v = float(value)
-            return -180.0 <= v <= 180.0
-        return False
+        return _check_bounded_float(-180.0, 180.0)
     if param.d_type == DType.WKT:
-        # try and parse it and see what happens
-        try:
-            wkt.loads(value)
-            return True
-        except Exception:
-            return False
+        return _check_wkt
     if param.d_type == DType.DATE:
-        # try and parse it and see what happens
-        try:
-            datetime.strptime(value, "%Y-%m-%d")
-            return True
-        except ValueError:
-            return False
+        return _check_date
     # if it is not one of the above types we can just check it is a string for now.
-    return isinstance(value, str)
+    return lambda value: isinstance(value, str)
+
+
+def _valid_value_set(param):
+    """
+    The set of acceptable values of a string parameter. Entries of the valid list can be values, dictionaries of
+    values or lists of values.
+    """
+    result = set()
+    for v in param.valid:
+        if isinstance(v, dict):
+            result.update(v.values())
+        elif isinstance(v, (list, tuple, set)):
+            result.update(v)
+        else:
+            result.add(v)
+    return result
+
+
+def compile_validator(param):
+    """
+    Build a function validating values of a parameter.
+
+    :param param: the parameter to validate.
+    :return: a function taking a value and returning a tuple of (valid, message)
+    """
+    check_type = _compile_type_check(param)
+    allowed = None
+    if param.valid and param.d_type == DType.STRING:
+        allowed = _valid_value_set(param)
+
+    def validate(value):
+        if not check_type(value):
+            return False, f"parameter {param.name} value did not validate"
+        if allowed is not None and value not in allowed:
+            return False, f"value {value} not found in valid values"
+        return True, ""
+    return validate
+
+
+def compile_coercer(param):
+    """
+    :return: a function converting a submitted value of the parameter into the type the task expects.
+    """
+    if param.d_type == DType.INT:
+        return int
+    if param.d_type in (DType.FLOAT, DType.LAT, DType.LON):
+        return float
+    return lambda value: value
+
+
+def validate_d_type(param, value):
+    return _compile_type_check(param)(value)
 
 
 def check_multi(s):
@@ -519,6 +1164,3 @@ def check_float_range(param, s):
     except ValueError:
         return False
 
-
-def create_error_message(condition):
-    return {'Key': condition['id'], 'Error': condition['error_message'], 'Comment': condition['_comment']}
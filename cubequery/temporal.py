@@ -0,0 +1,153 @@
+"""
+Splitting long date ranges into windows that are processed in parallel and reduced back together.
+
+A task declares the pair of date parameters to split on and how long each window should be:
+
+    time_parameters = ("start_date", "end_date")
+    time_window_days = 365
+    time_reduce = "median"
+
+A submission covering more than one window is run as a part per window, exactly as if each window had been submitted
+on its own, and the outputs of the parts are combined once they have all finished. Rasters with the same name are
+reduced pixel by pixel, with `time_reduce` naming the reduction for all of them or, as a dictionary, for each output
+name. CSV files are concatenated in date order to make one time series. Anything else is kept once per window.
+
+The reductions work on what each window produced, not the observations behind it, so:
+
+* `mean` is the mean of the window means weighted by the days in each window, which is the mean over the whole range
+  when observations are spread evenly through it. Windows with no data for a pixel don't count towards it.
+* `median` is the median of the window medians. It is close to the median over the whole range when the windows are
+  alike but it is not the same, use `mean`, `min`, `max` or `stack` where that matters.
+* `min`, `max` and `sum` are exact.
+
+Rasters are reduced a block at a time so only a block of each window is in memory at once, whatever the size of the
+AOI. min, max, sum and stack keep the data type of the windows, median and mean give float32.
+"""
+import os
+from datetime import datetime, timedelta
+
+import numpy
+import rasterio
+
+_date_format = "%Y-%m-%d"
+_raster_extensions = frozenset(['.tif', '.tiff'])
+_default_reduce = "median"
+
+# these keep the data type of the windows.
+_reducers = {
+    'min': numpy.ma.min,
+    'max': numpy.ma.max,
+    'sum': numpy.ma.sum,
+}
+# these can make values the original data type can't hold.
+_float_reducers = frozenset(['median', 'mean'])
+
+
+def time_windows(start, end, days):
+    """
+    Split a date range into windows.
+
+    :param start: the first date, as a YYYY-MM-DD string.
+    :param end: the last date, as a YYYY-MM-DD string.
+    :param days: the length of each window, the last one may be shorter.
+    :return: a list of (start, end) string pairs, both ends inclusive.
+    """
+    first = datetime.strptime(start, _date_format).date()
+    last = datetime.strptime(end, _date_format).date()
+    windows = []
+    while first <= last:
+        window_end = min(first + timedelta(days=days - 1), last)
+        windows.append((first.strftime(_date_format), window_end.strftime(_date_format)))
+        first = window_end + timedelta(days=1)
+    return windows
+
+
+def _reduce_block(blocks, how, weights, nodata):
+    # pixels with no data in a window are masked, ones with no data in any window stay as no data.
+    stacked = numpy.ma.stack(blocks)
+    if how == 'mean':
+        return numpy.ma.average(stacked.astype('float32'), axis=0, weights=weights).filled(numpy.nan)
+    if how == 'median':
+        return numpy.ma.median(stacked.astype('float32'), axis=0).filled(numpy.nan)
+    return _reducers[how](stacked, axis=0).filled(0 if nodata is None else nodata)
+
+
+def reduce_rasters(sources, destination, how, weights=None):
+    """
+    Combine rasters covering the same area pixel by pixel, a block at a time.
+
+    :param how: one of median, mean, min, max, sum or stack, which keeps every band of every source in order.
+    :param weights: how much each source counts towards a mean, e.g. the days in its window. Equal if not given.
+    """
+    if how != 'stack' and how not in _reducers and how not in _float_reducers:
+        raise ValueError(f"unknown reduction {how}")
+    datasets = [rasterio.open(s) for s in sources]
+    try:
+        profile = datasets[0].profile.copy()
+        if how == 'stack':
+            profile.update(count=sum(d.count for d in datasets))
+        elif how in _float_reducers:
+            profile.update(dtype='float32', nodata=numpy.nan)
+        with rasterio.open(destination, 'w', **profile) as dst:
+            for _, window in datasets[0].block_windows(1):
+                if how == 'stack':
+                    band = 1
+                    for d in datasets:
+                        dst.write(d.read(window=window), indexes=list(range(band, band + d.count)), window=window)
+                        band += d.count
+                else:
+                    blocks = [d.read(window=window, masked=True) for d in datasets]
+                    dst.write(_reduce_block(blocks, how, weights, profile.get('nodata')), window=window)
+    finally:
+        for d in datasets:
+            d.close()
+
+
+def concatenate_csv(sources, destination):
+    """
+    Join csv files together, keeping only the header line of the first.
+    """
+    with open(destination, 'w') as out:
+        for i, source in enumerate(sources):
+            with open(source) as f:
+                header = f.readline()
+                if i == 0:
+                    out.write(header)
+                for line in f:
+                    out.write(line)
+
+
+def reduce_time_outputs(part_files, output_dir, reduce=_default_reduce, window_days=None):
+    """
+    Combine the outputs of the time windows of a run.
+
+    :param part_files: dictionary of window index to the list of output files of that window.
+    :param output_dir: where to put the combined outputs.
+    :param reduce: the reduction for rasters, or a dictionary of output name to reduction.
+    :param window_days: dictionary of window index to the number of days in the window, to weight means by. Windows
+        count equally if not given.
+    :return: list of the combined output files.
+    """
+    by_name = {}
+    for index, files in sorted(part_files.items()):
+        for f in files:
+            by_name.setdefault(os.path.basename(f), []).append((index, f))
+
+    outputs = []
+    for name, files in sorted(by_name.items()):
+        extension = os.path.splitext(name)[1].lower()
+        destination = os.path.join(output_dir, name)
+        if extension in _raster_extensions:
+            how = reduce.get(name, _default_reduce) if isinstance(reduce, dict) else reduce
+            weights = [window_days[index] for index, _ in files] if window_days else None
+            reduce_rasters([f for _, f in files], destination, how, weights)
+            outputs.append(destination)
+        elif extension == '.csv':
+            concatenate_csv([f for _, f in files], destination)
+            outputs.append(destination)
+        else:
+            for index, f in files:
+                destination = os.path.join(output_dir, f"window_{index}_{name}")
+                os.replace(f, destination)
+                outputs.append(destination)
+    return outputs
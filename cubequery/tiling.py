@@ -0,0 +1,132 @@
+"""
+Splitting large AOIs into tiles that are processed in parallel and merged back together.
+
+A task that sets `tileable = True` can be given an AOI larger than a single run can cope with. The api cuts it into a
+grid of `[Tiling] tile_size` degree tiles, each clipped to the AOI, and submits one run per tile as a celery chord so
+the tiles are spread over every worker. Each tile run uploads its outputs to `<path_prefix>/<task id>_parts/<tile>/`.
+Once they have all finished the chord runs the merge, which mosaics the rasters with the same name from every tile
+into one and packages the result like any other run. Outputs that aren't rasters are kept per tile. The mosaic is
+written a block of a tile at a time, so it never has to fit in memory.
+
+The grid is aligned to multiples of the tile size so the same area is always cut into the same tiles.
+"""
+import math
+import os
+
+import numpy
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from shapely.geometry import box, MultiPolygon, Polygon
+from shapely.prepared import prep
+
+_raster_extensions = frozenset(['.tif', '.tiff'])
+
+
+def _polygonal(geometry):
+    """
+    Just the polygons of a geometry, clipping can leave lines and points along the tile edges.
+    """
+    if isinstance(geometry, (Polygon, MultiPolygon)):
+        return geometry
+    polygons = []
+    for part in getattr(geometry, 'geoms', []):
+        if isinstance(part, Polygon):
+            polygons.append(part)
+        elif isinstance(part, MultiPolygon):
+            polygons.extend(part.geoms)
+    return MultiPolygon(polygons) if polygons else None
+
+
+def tile_geometry(geometry, tile_size):
+    """
+    Cut a geometry into grid tiles.
+
+    :param geometry: the shapely geometry of the AOI.
+    :param tile_size: width and height of the tiles, in degrees.
+    :return: a list of the non empty pieces of the geometry in each grid cell.
+    """
+    min_x, min_y, max_x, max_y = geometry.bounds
+    prepared = prep(geometry)
+    tiles = []
+    for i in range(int(math.floor(min_x / tile_size)), int(math.ceil(max_x / tile_size))):
+        for j in range(int(math.floor(min_y / tile_size)), int(math.ceil(max_y / tile_size))):
+            cell = box(i * tile_size, j * tile_size, (i + 1) * tile_size, (j + 1) * tile_size)
+            if not prepared.intersects(cell):
+                continue
+            if prepared.contains(cell):
+                tiles.append(cell)
+                continue
+            piece = _polygonal(geometry.intersection(cell))
+            if piece is not None and piece.area > 0:
+                tiles.append(piece)
+    return tiles
+
+
+def _offset(dataset, transform):
+    """
+    The row and column of the top left pixel of a dataset in a larger grid with the same pixel size.
+    """
+    return (int(round((dataset.bounds.top - transform.f) / transform.e)),
+            int(round((dataset.bounds.left - transform.c) / transform.a)))
+
+
+def mosaic(sources, destination):
+    """
+    Merge rasters into one covering all of them, where they overlap the first one wins.
+
+    The sources have to be on the same pixel grid, as the tiles of a run are. They are copied in a block at a time,
+    last first, so each block only overwrites the pixels it has data for and the first source's data ends up on top.
+    """
+    datasets = [rasterio.open(s) for s in sources]
+    try:
+        x_res, y_res = datasets[0].res
+        if any(not numpy.allclose(d.res, (x_res, y_res)) for d in datasets):
+            raise ValueError("can only mosaic rasters with the same resolution")
+        left = min(d.bounds.left for d in datasets)
+        bottom = min(d.bounds.bottom for d in datasets)
+        right = max(d.bounds.right for d in datasets)
+        top = max(d.bounds.top for d in datasets)
+
+        profile = datasets[0].profile.copy()
+        profile.update(width=int(round((right - left) / x_res)), height=int(round((top - bottom) / y_res)),
+                       transform=from_origin(left, top, x_res, y_res))
+        with rasterio.open(destination, 'w+', **profile) as dst:
+            for d in reversed(datasets):
+                row, column = _offset(d, dst.transform)
+                for _, window in d.block_windows(1):
+                    target = Window(window.col_off + column, window.row_off + row, window.width, window.height)
+                    data = d.read(window=window, masked=True)
+                    if numpy.ma.is_masked(data):
+                        data = numpy.where(numpy.ma.getmaskarray(data), dst.read(window=target), data.data)
+                    dst.write(numpy.asarray(data), window=target)
+    finally:
+        for d in datasets:
+            d.close()
+
+
+def merge_tile_outputs(tile_files, output_dir):
+    """
+    Combine the outputs of the tiles of a run.
+
+    :param tile_files: dictionary of tile index to the list of output files of that tile.
+    :param output_dir: where to put the merged outputs.
+    :return: list of the merged output files.
+    """
+    by_name = {}
+    for index, files in sorted(tile_files.items()):
+        for f in files:
+            by_name.setdefault(os.path.basename(f), []).append((index, f))
+
+    outputs = []
+    for name, files in sorted(by_name.items()):
+        if os.path.splitext(name)[1].lower() in _raster_extensions:
+            destination = os.path.join(output_dir, name)
+            mosaic([f for _, f in files], destination)
+            outputs.append(destination)
+        else:
+            for index, f in files:
+                destination = os.path.join(output_dir, f"tile_{index}_{name}")
+                os.replace(f, destination)
+                outputs.append(destination)
+    return outputs
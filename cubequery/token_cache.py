@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenCache(object):
+    """
+    A bounded least recently used cache of tokens that have already had their signature verified.
+
+    Entries are only valid until the expiry time of the token itself so a cached token can never outlive the
+    token. Clients polling the api send the same token many times, this lets us skip verifying it each time.
+    """
+
+    def __init__(self, max_size=10000, clock=time.time):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        """
+        Look up a token.
+
+        :param token: the raw token string.
+        :return: the user id the token was issued to or None if the token is not cached or has expired.
+        """
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                user_id, expires = entry
+                if expires > self._clock():
+                    self._entries.move_to_end(token)
+                    self.hits += 1
+                    return user_id
+                del self._entries[token]
+            self.misses += 1
+            return None
+
+    def put(self, token, user_id, expires):
+        """
+        Add a verified token to the cache.
+
+        :param token: the raw token string.
+        :param user_id: the user the token was issued to.
+        :param expires: unix time the token expires at.
+        """
+        with self._lock:
+            self._entries[token] = (user_id, expires)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def evict_user(self, user_id):
+        """
+        Remove all the tokens for a user, used when the user is removed.
+        """
+        with self._lock:
+            for token in [t for t, (u, _) in self._entries.items() if u == user_id]:
+                del self._entries[token]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,159 @@
+"""
+Places to keep the user list.
+
+Each store maps a username to a tuple of (bcrypt password hash, compiled address matcher). Stores notice when their
+backing data changes through `refresh()`, which only ever swaps in fully built data so lookups running at the same
+time never wait on or see a half loaded user list.
+
+`FileUserStore` reads the original `users.cfg` format, one `name,hash,address;address` line per user.
+`SqliteUserStore` keeps users in an indexed sqlite table so only the users that are actually used get loaded.
+"""
+import logging
+import os
+import sqlite3
+import threading
+
+from cubequery import ipaddress_matching
+
+
+def parse_user_line(line):
+    """
+    Parse a line of a users.cfg file.
+    :return: a tuple of (username, password hash, address patterns) or None for comments and blank lines.
+    """
+    stripped = line.strip()
+    if not stripped or stripped.startswith('#'):  # skip comments
+        return None
+    parts = stripped.split(',', 3)
+    address_list = []
+    if len(parts) > 2:
+        address_list = parts[2].split(';')
+    return parts[0], parts[1], address_list
+
+
+class FileUserStore(object):
+    def __init__(self, path):
+        self.path = path
+        self._users = {}
+        self._mtime = None
+
+    def lookup(self, username):
+        return self._users.get(username)
+
+    def refresh(self):
+        """
+        Reload the file if it has changed since it was last read.
+        :return: the list of usernames that have been removed.
+        """
+        mtime = os.stat(self.path).st_mtime
+        if mtime == self._mtime:
+            return []
+
+        users = {}
+        with open(self.path, 'r') as f:
+            for line in f:
+                parsed = parse_user_line(line)
+                if parsed:
+                    name, password_hash, address_list = parsed
+                    users[name] = (bytes(password_hash, "utf-8"), ipaddress_matching.compile_patterns(address_list))
+
+        removed = [u for u in self._users if u not in users]
+        self._users = users
+        self._mtime = mtime
+        logging.info(f"loaded {len(users)} users from {self.path}")
+        return removed
+
+
+class SqliteUserStore(object):
+    """
+    Users kept in a sqlite database.
+
+    Users are loaded on demand by primary key and kept in memory. When the database changes only the users already
+    in memory are re-read, so the cost of a reload depends on how many users are active not how many exist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._users = {}
+        self._version = None
+        self._create()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            self._local.connection = connection
+        return connection
+
+    def _create(self):
+        with self._connection() as c:
+            c.execute("CREATE TABLE IF NOT EXISTS users ("
+                      "username TEXT PRIMARY KEY, "
+                      "password_hash TEXT NOT NULL, "
+                      "addresses TEXT NOT NULL DEFAULT '')")
+            c.execute("CREATE TABLE IF NOT EXISTS user_version (id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER)")
+            c.execute("INSERT OR IGNORE INTO user_version (id, version) VALUES (0, 0)")
+            # bump the version on any change so every process watching the database notices.
+            for action in ("INSERT", "UPDATE", "DELETE"):
+                c.execute(f"CREATE TRIGGER IF NOT EXISTS users_version_{action.lower()} AFTER {action} ON users "
+                          f"BEGIN UPDATE user_version SET version = version + 1 WHERE id = 0; END")
+
+    def _read(self, username):
+        row = self._connection().execute(
+            "SELECT password_hash, addresses FROM users WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            return None
+        address_list = row[1].split(';') if row[1] else []
+        return bytes(row[0], "utf-8"), ipaddress_matching.compile_patterns(address_list)
+
+    def lookup(self, username):
+        user = self._users.get(username)
+        if user is None:
+            user = self._read(username)
+            if user is not None:
+                self._users[username] = user
+        return user
+
+    def refresh(self):
+        """
+        Re-read the users we have in memory if the database has changed.
+        :return: the list of usernames that have been removed.
+        """
+        version = self._connection().execute("SELECT version FROM user_version WHERE id = 0").fetchone()[0]
+        if version == self._version:
+            return []
+
+        users = {}
+        removed = []
+        for username in list(self._users):
+            user = self._read(username)
+            if user is None:
+                removed.append(username)
+            else:
+                users[username] = user
+        self._users = users
+        self._version = version
+        return removed
+
+    def add_user(self, username, password_hash, address_list):
+        with self._connection() as c:
+            c.execute("INSERT OR REPLACE INTO users (username, password_hash, addresses) VALUES (?, ?, ?)",
+                      (username, password_hash, ';'.join(address_list)))
+
+    def remove_user(self, username):
+        with self._connection() as c:
+            c.execute("DELETE FROM users WHERE username = ?", (username,))
+
+    def import_file(self, path):
+        """
+        Copy all the users from a users.cfg style file into the database.
+        """
+        count = 0
+        with open(path, 'r') as f:
+            for line in f:
+                parsed = parse_user_line(line)
+                if parsed:
+                    self.add_user(*parsed)
+                    count += 1
+        return count
@@ -1,27 +1,113 @@
 import bcrypt
 import logging
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-from cubequery import ipaddress_matching
+from cubequery import get_config
+from cubequery.user_store import FileUserStore, SqliteUserStore
 
-_users = {}
+_store = None
+_store_lock = threading.Lock()
+_removal_listeners = []
+
+_password_pool = None
+_password_slots = None
+_pool_lock = threading.Lock()
+
+
+class LoginBusyError(Exception):
+    """
+    Raised when there are already too many password checks waiting for the password pool.
+    """
+    pass
+
+
+def add_removal_listener(listener):
+    """
+    Register a function to be called with the username whenever a user is removed.
+    Used to drop anything cached about the user, e.g. verified tokens.
+    """
+    _removal_listeners.append(listener)
+
+
+def _notify_removed(username):
+    for listener in _removal_listeners:
+        listener(username)
+
+
+def _create_store():
+    backend = get_config("Users", "backend").lower()
+    path = get_config("Users", "path")
+    if backend == "sqlite":
+        return SqliteUserStore(path)
+    if backend == "file":
+        return FileUserStore(path)
+    raise ValueError(f"unknown user store backend {backend}")
+
+
+def _refresh_store():
+    try:
+        for username in _store.refresh():
+            logging.info(f"user {username} has been removed")
+            _notify_removed(username)
+    except Exception as e:
+        logging.warning(f'could not reload users, keeping the existing list :: {e}')
+
+
+def _watch_store(interval):
+    while True:
+        time.sleep(interval)
+        _refresh_store()
 
 
 def load_users():
-    # TODO: create a real user db that is easier for people to update. This will do for mvp but should be better later.
-    # already loaded users don't try again.
-    if len(_users) > 0:
-        return
+    """
+    Create the user store on first use and start a background thread that reloads it when it changes.
+    """
+    global _store
+    if _store is not None:
+        return _store
+
+    with _store_lock:
+        if _store is None:
+            store = _create_store()
+            store.refresh()
+            _store = store
+            watcher = threading.Thread(target=_watch_store, args=(int(get_config("Users", "reload_interval")),),
+                                       name="user-store-watcher", daemon=True)
+            watcher.start()
+    return _store
+
+
+def _check_password(password, hashed):
+    return bcrypt.checkpw(bytes(password, "utf-8"), hashed)
+
 
-    with open("users.cfg", 'r') as f:
-        for line in f:
-            stripped = line.strip()
-            if not stripped.startswith('#'):  # skip comments
-                parts = stripped.split(',', 3)
-                address_list = []
-                if len(parts) > 2:
-                    address_list = parts[2].split(';')
+def _get_password_pool():
+    global _password_pool, _password_slots
+    with _pool_lock:
+        if _password_pool is None:
+            workers = int(get_config("App", "login_workers"))
+            _password_slots = threading.BoundedSemaphore(workers + int(get_config("App", "login_queue_depth")))
+            _password_pool = ProcessPoolExecutor(max_workers=workers)
+        return _password_pool, _password_slots
 
-                _users[parts[0]] = (bytes(parts[1], "utf-8"), address_list)
+
+def _check_password_pooled(password, hashed):
+    """
+    Run the bcrypt check in the password pool so a burst of log ins can only ever use a fixed number of cores.
+
+    :raises LoginBusyError: if the pool already has as many checks running or queued as it is allowed.
+    """
+    pool, slots = _get_password_pool()
+    if not slots.acquire(blocking=False):
+        raise LoginBusyError("too many log in attempts in progress")
+    try:
+        return pool.submit(_check_password, password, hashed).result()
+    finally:
+        slots.release()
 
 
 def check_user(username, password, ip_address):
@@ -32,23 +118,36 @@ def check_user(username, password, ip_address):
     :param password: password to check
     :param ip_address: of the incoming connection to check
     :return: true if and only if the user in the password list and the provided password matches.
+    :raises LoginBusyError: if the password checking pool is saturated.
     """
 
-    load_users()
+    store = load_users()
     try:
-        if _users[username]:
-            if ipaddress_matching.match_list(_users[username][1], ip_address):
-                return bcrypt.checkpw(bytes(password, "utf-8"), _users[username][0])
+        user = store.lookup(username)
+        if user:
+            if user[1].match(ip_address):
+                return _check_password_pooled(password, user[0])
+    except LoginBusyError:
+        raise
     except Exception as e:
         logging.warning(f'User validation error :: {e}')
     return False
 
 
 def is_username_valid(username):
-    load_users()
+    store = load_users()
     try:
-        if _users[username]:
+        if store.lookup(username):
             return True
     except Exception as e:
         logging.warning(f'User validation error :: {e}')
     return False
+
+
+if __name__ == '__main__':
+    # copy the users from a users.cfg file into a sqlite user database
+    if len(sys.argv) != 3:
+        print("usage: python -m cubequery.users <users.cfg> <users.db>")
+        sys.exit(1)
+
+    print(f"imported {SqliteUserStore(sys.argv[2]).import_file(sys.argv[1])} users")
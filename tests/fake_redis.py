@@ -0,0 +1,127 @@
+"""
+Just enough of redis for the tests, shared by everything that keeps its state there.
+
+Values are stored as bytes, as redis returns them, and keys given an expiry are dropped once the clock passes it.
+Commands on a pipeline are queued and only run when it is executed, apart from reads made before `multi` on a
+transaction's pipeline, which run straight away as they do on a watching redis pipeline.
+"""
+import time
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _encode(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode('utf-8')
+
+
+class FakeRedis(object):
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.values = {}
+        self.expires = {}
+        self.sets = {}
+        self.lists = {}
+
+    def _expire(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= self.clock():
+            self.values.pop(key, None)
+            del self.expires[key]
+
+    def get(self, key):
+        self._expire(key)
+        return self.values.get(key)
+
+    def mget(self, keys):
+        return [self.get(k) for k in keys]
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and self.get(key) is not None:
+            return None
+        self.values[key] = _encode(value)
+        if ex:
+            self.expires[key] = self.clock() + ex
+        else:
+            self.expires.pop(key, None)
+        return True
+
+    def incr(self, key):
+        value = int(self.get(key) or 0) + 1
+        self.values[key] = _encode(value)
+        return value
+
+    def delete(self, *keys):
+        for k in keys:
+            self.values.pop(k, None)
+            self.expires.pop(k, None)
+            self.sets.pop(k, None)
+            self.lists.pop(k, None)
+
+    def zadd(self, key, mapping):
+        self.sets.setdefault(key, {}).update(mapping)
+
+    def zrem(self, key, *members):
+        for m in members:
+            self.sets.get(key, {}).pop(m, None)
+
+    def zrevrange(self, key, start, end):
+        members = sorted(self.sets.get(key, {}).items(), key=lambda i: -i[1])
+        end = len(members) if end == -1 else end + 1
+        return [_encode(m) for m, _ in members[start:end]]
+
+    def zinterstore(self, dest, keys, aggregate=None):
+        first = self.sets.get(keys[0], {})
+        self.sets[dest] = {m: max(self.sets[k][m] for k in keys) for m in first
+                           if all(m in self.sets.get(k, {}) for k in keys)}
+
+    def lpush(self, key, *values):
+        self.lists.setdefault(key, [])[0:0] = [_encode(v) for v in reversed(values)]
+
+    def ltrim(self, key, start, end):
+        values = self.lists.get(key, [])
+        self.lists[key] = values[start:len(values) if end == -1 else end + 1]
+
+    def lrange(self, key, start, end):
+        values = self.lists.get(key, [])
+        return values[start:len(values) if end == -1 else end + 1]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def transaction(self, func, *watches):
+        pipe = FakePipeline(self, watching=True)
+        func(pipe)
+        return pipe.execute()
+
+
+class FakePipeline(object):
+    def __init__(self, client, watching=False):
+        self._client = client
+        self._watching = watching
+        self._commands = []
+
+    def multi(self):
+        self._watching = False
+
+    def get(self, key):
+        if self._watching:
+            return self._client.get(key)
+        self._commands.append(('get', (key,), {}))
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        return [getattr(self._client, name)(*args, **kwargs) for name, args, kwargs in commands]
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self._commands.append((name, args, kwargs))
+            return self
+        return command
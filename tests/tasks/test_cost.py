@@ -0,0 +1,49 @@
+import unittest
+
+from cubequery.aoi import AOI
+from cubequery.tasks import CubeQueryTask, DType, Parameter
+
+# about 11km across, 117 square kilometres.
+_aoi = "POLYGON ((178.4 -18.1, 178.5 -18.1, 178.5 -18.2, 178.4 -18.2, 178.4 -18.1))"
+
+
+class CostedTask(CubeQueryTask):
+    parameters = [
+        Parameter("aoi", "Area", DType.WKT, "area of interest"),
+        Parameter("start_date", "Start", DType.DATE, "start"),
+        Parameter("end_date", "End", DType.DATE, "end"),
+        Parameter("res", "Resolution", DType.INT, "pixel size"),
+    ]
+
+
+class ExpensiveTask(CostedTask):
+    cost_coefficient = 100
+
+
+class TestCost(unittest.TestCase):
+    def test_cost(self):
+        args = {'user': 'u', 'aoi': AOI(_aoi), 'start_date': '2019-01-01', 'end_date': '2019-01-10', 'res': 30}
+        self.assertAlmostEqual(CostedTask.estimate_cost(args), 1.30, places=2)
+        self.assertAlmostEqual(ExpensiveTask.estimate_cost(args), 130, places=0)
+        args['res'] = 10
+        self.assertAlmostEqual(CostedTask.estimate_cost(args), 11.7, places=1)
+
+    def test_route(self):
+        args = {'user': 'u', 'aoi': AOI(_aoi), 'start_date': '2019-01-01', 'end_date': '2019-01-10', 'res': 30}
+        self.assertEqual(CostedTask.route(args)['queue'], "small")
+        self.assertEqual(ExpensiveTask.route(args)['queue'], "medium")
+        args['end_date'] = '2022-01-01'
+        self.assertEqual(ExpensiveTask.route(args)['queue'], "large")
+
+    def test_no_aoi_or_dates(self):
+        self.assertEqual(CostedTask.route({'user': 'u'})['queue'], "small")
+
+    def test_resolution_must_be_positive(self):
+        args = {'user': 'u', 'aoi': AOI(_aoi), 'start_date': '2019-01-01', 'end_date': '2019-01-10'}
+        for res in (0, "0", "0.0", -30):
+            errors = CostedTask().standard_validation(dict(args, res=res))
+            self.assertEqual([e['Key'] for e in errors], ['res'], res)
+        self.assertEqual(CostedTask().standard_validation(dict(args, res=30)), [])
+        # only a missing resolution falls back to the default.
+        self.assertEqual(CostedTask.run_size(dict(args, res=None))['resolution'],
+                         CostedTask.run_size(args)['resolution'])
@@ -13,6 +13,10 @@ class TestParameterHandling(unittest.TestCase):
             Parameter("a", "param a", DType.STRING, "string a"),
             Parameter("b", "param b", DType.INT, "int b"),
             Parameter("c", "param c", DType.DATE, "date c"),
+            Parameter("d", "param d", DType.STRING, "string d", valid=["SENTINEL_2", "LANDSAT_8"]),
+            Parameter("e", "param e", DType.STRING, "string e", valid=[{"name": "Fiji", "value": "fiji"}]),
+            Parameter("f", "param f", DType.LAT, "lat f"),
+            Parameter("g", "param g", DType.FLOAT, "float g"),
         ]
 
         CubeQueryTask.cal_significant_kwargs(parameters)
@@ -63,3 +67,26 @@ class TestParameterHandling(unittest.TestCase):
     def test_unknown_param(self):
         test = TestParameterHandling.MockTask()
         self.assertFalse(test.validate_arg("missing", "doesn't matter")[0])
+
+    def test_valid_values(self):
+        test = TestParameterHandling.MockTask()
+        self.assertTrue(test.validate_arg("d", "SENTINEL_2")[0])
+        self.assertFalse(test.validate_arg("d", "SENTINEL")[0])
+        self.assertFalse(test.validate_arg("d", "LANDSAT_7")[0])
+
+        self.assertTrue(test.validate_arg("e", "fiji")[0])
+        self.assertTrue(test.validate_arg("e", "Fiji")[0])
+        self.assertFalse(test.validate_arg("e", "vanuatu")[0])
+
+    def test_lat_validation(self):
+        test = TestParameterHandling.MockTask()
+        self.assertTrue(test.validate_arg("f", "-17.5")[0])
+        self.assertTrue(test.validate_arg("f", 90)[0])
+        self.assertFalse(test.validate_arg("f", 90.5)[0])
+        self.assertFalse(test.validate_arg("f", "north")[0])
+
+    def test_map_kwargs(self):
+        test = TestParameterHandling.MockTask()
+        result = test.map_kwargs(params='{"a": "x", "b": "5", "f": "-17.5", "g": 3, "user": "basic"}')
+        self.assertEqual(result, {"a": "x", "b": 5, "f": -17.5, "g": 3.0, "user": "basic"})
+        self.assertIsInstance(result["g"], float)
@@ -0,0 +1,142 @@
+import unittest
+from unittest import mock
+
+from celery import Celery
+
+from cubequery.tasks import CubeQueryTask, Parameter, DType
+
+
+class TestResultCacheKey(unittest.TestCase):
+
+    class MockTask(CubeQueryTask):
+        name = "mock.MockTask"
+        display_name = "A Test Task"
+        description = "A test task that shouldn't do anything."
+
+        parameters = [
+            Parameter("aoi", "aoi", DType.WKT, "area"),
+            Parameter("res", "res", DType.INT, "resolution"),
+            Parameter("platform", "platform", DType.STRING, "satellite"),
+        ]
+
+        CubeQueryTask.cal_significant_kwargs(parameters)
+
+        def calculate_result(self, *args, **kwargs):
+            pass
+
+    def test_equivalent_requests_share_a_key(self):
+        a = {
+            'user': 'basic',
+            'aoi': 'POLYGON ((178 -18, 178.1 -18, 178.1 -18.1, 178 -18))',
+            'res': '30',
+            'platform': 'SENTINEL_2',
+        }
+        b = {
+            'platform': 'SENTINEL_2',
+            'res': 30,
+            'aoi': 'POLYGON((178.0 -18.0,178.1 -18.0,178.1 -18.1,178.0 -18.0))',
+            'user': 'test_user',
+        }
+        task = TestResultCacheKey.MockTask
+        self.assertEqual(task.result_cache_key(a, "abc"), task.result_cache_key(b, "abc"))
+
+    def test_different_requests_have_different_keys(self):
+        task = TestResultCacheKey.MockTask
+        a = {'res': 30, 'platform': 'SENTINEL_2'}
+        self.assertNotEqual(task.result_cache_key(a, "abc"), task.result_cache_key(a, "def"))
+        self.assertNotEqual(task.result_cache_key(a, "abc"),
+                            task.result_cache_key({'res': 20, 'platform': 'SENTINEL_2'}, "abc"))
+
+    def test_submitted_key_is_used(self):
+        task = TestResultCacheKey.MockTask
+        self.assertEqual(task._get_cache_key(params="{}", result_key="cubequery-result:x"), "cubequery-result:x")
+
+
+class FakeCache(object):
+    def __init__(self):
+        self.values = {}
+        self.timeouts = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.values[key] = value
+        self.timeouts[key] = timeout
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+class TestRunningMarker(unittest.TestCase):
+    def setUp(self):
+        self.cache = FakeCache()
+        TestResultCacheKey.MockTask._cache = self.cache
+
+    def tearDown(self):
+        TestResultCacheKey.MockTask._cache = None
+
+    def test_found_while_running(self):
+        task = TestResultCacheKey.MockTask
+        with mock.patch('cubequery.estimates.estimate_submission', return_value=None):
+            task.mark_running("cubequery-result:x", "abc", {})
+        # long after jobtastic's herd key has gone.
+        self.assertIsNone(self.cache.get("herd:cubequery-result:x"))
+        self.assertEqual(task.find_cached_result("cubequery-result:x"), "abc")
+
+        run = task()
+        run.cache_key = "cubequery-result:x"
+        run._break_thundering_herd_cache()
+        self.assertIsNone(task.find_cached_result("cubequery-result:x"))
+
+    def test_timeout_follows_estimate(self):
+        task = TestResultCacheKey.MockTask
+        with mock.patch('cubequery.estimates.estimate_submission', return_value={'seconds': 3 * 3600}):
+            task.mark_running("cubequery-result:x", "abc", {})
+        self.assertEqual(self.cache.timeouts["running:cubequery-result:x"], 6 * 3600)
+        with mock.patch('cubequery.estimates.estimate_submission', side_effect=IOError("no redis")):
+            task.mark_running("cubequery-result:y", "abc", {})
+        self.assertEqual(self.cache.timeouts["running:cubequery-result:y"], 3600)
+
+
+class TestUncachedSubmission(unittest.TestCase):
+    def setUp(self):
+        # the real celery send path, only the broker is swapped for an in memory one.
+        self.app = Celery('test', broker='memory://')
+
+        class SentTask(TestResultCacheKey.MockTask):
+            name = "mock.SentTask"
+
+            def calculate_result(self, *args, **kwargs):
+                raise AssertionError("should be sent to a worker, not run here")
+
+        SentTask.bind(self.app)
+        self.task = SentTask()
+
+    def test_sent_to_the_queue(self):
+        kwargs = {'params': '{}', 'result_key': 'cubequery-result:x', 'profile': True}
+        future = self.task.async_uncached(args=(False,), kwargs=kwargs, queue='small')
+        with self.app.connection() as connection:
+            queue = connection.SimpleQueue('small')
+            message = queue.get(timeout=1)
+            message.ack()
+            queue.close()
+        self.assertEqual(message.headers['task'], "mock.SentTask")
+        self.assertEqual(message.headers['id'], future.task_id)
+        self.assertEqual(message.payload[1], kwargs)
+
+
+class TestTaskClassesPerApp(unittest.TestCase):
+    def test_subclass_after_app_is_set_up(self):
+        # celery re-creates the task classes it knows of for each app, task packages are loaded after that.
+        Celery('test', broker='memory://').finalize(auto=True)
+
+        class LaterTask(TestResultCacheKey.MockTask):
+            name = "mock.LaterTask"
+
+        self.assertIn("res", LaterTask._parameter_index)
+        self.assertEqual(LaterTask._get_cache_key(params="{}", result_key="cubequery-result:x"), "cubequery-result:x")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import unittest
+from unittest import mock
+
+import psycopg2.pool
+from shapely import wkt
+
+from cubequery.aoi import AOI
+from cubequery.tasks import CubeQueryTask, DType, Parameter, ProjectBoundaries, validate_standard_spatial_query, \
+    check_database_spatial, DatabaseBusyError
+
+_suva = "POLYGON ((178.4 -18.1, 178.5 -18.1, 178.5 -18.2, 178.4 -18.2, 178.4 -18.1))"
+_viti_levu = "POLYGON ((177.95 -17.75, 178.05 -17.75, 178.05 -17.85, 177.95 -17.85, 177.95 -17.75))"
+_ocean = "POLYGON ((0 0, 0.1 0, 0.1 0.1, 0 0.1, 0 0))"
+_viti_levu_west = "POLYGON ((177.3 -17.5, 178.1 -17.5, 178.1 -18.2, 177.3 -18.2, 177.3 -17.5))"
+
+
+class TiledTask(CubeQueryTask):
+    tileable = True
+    parameters = [Parameter("aoi", "Area", DType.WKT, "area of interest")]
+
+
+class UntiledTask(CubeQueryTask):
+    parameters = [Parameter("aoi", "Area", DType.WKT, "area of interest")]
+
+
+class TestSpatialValidation(unittest.TestCase):
+    def test_aoi_within_project(self):
+        self.assertEqual(validate_standard_spatial_query(_suva, ['fiji']), [])
+
+    def test_aoi_outside_allowed_projects(self):
+        errors = validate_standard_spatial_query(_suva, ['vanuatu', 'solomon'])
+        self.assertEqual([e['Error'] for e in errors], ['AOI is not within your available countries'])
+
+        errors = validate_standard_spatial_query(_ocean, ['fiji', 'vanuatu', 'solomon'])
+        self.assertEqual([e['Error'] for e in errors], ['AOI is not within your available countries'])
+
+    def test_bad_polygon(self):
+        errors = validate_standard_spatial_query("POLYGON ((fish", ['fiji'])
+        self.assertEqual([e['Error'] for e in errors], ['Polygon could not be loaded'])
+
+    def test_max_area(self):
+        errors = validate_standard_spatial_query(_viti_levu_west, ['fiji'])
+        self.assertEqual([e['Error'] for e in errors], ['AOI area is too large'])
+        self.assertEqual(validate_standard_spatial_query(_viti_levu_west, ['fiji'], max_area=25), [])
+
+    def test_needs_tiling(self):
+        self.assertTrue(TiledTask.needs_tiling({'aoi': AOI(_viti_levu_west)}))
+        self.assertTrue(TiledTask.needs_tiling({'aoi': _viti_levu_west}))
+        self.assertFalse(TiledTask.needs_tiling({'aoi': AOI(_suva)}))
+        self.assertFalse(UntiledTask.needs_tiling({'aoi': AOI(_viti_levu_west)}))
+
+    def test_bounds_file(self):
+        boundaries = ProjectBoundaries(repr({
+            'fiji': {'bounds_file': 'TM_FIJI_BORDERS.geojson'},
+            'box': {'bounds': "POLYGON ((0 0, 1 0, 1 1, 0 1, 0 0))"},
+        }))
+        self.assertTrue(boundaries.contains(wkt.loads(_viti_levu), ['fiji']))
+        self.assertFalse(boundaries.contains(wkt.loads(_viti_levu), ['box']))
+        # the suva box reaches out to sea so isn't within the detailed border.
+        self.assertFalse(boundaries.contains(wkt.loads(_suva), ['fiji']))
+        self.assertTrue(boundaries.contains(wkt.loads(_ocean), ['box']))
+
+
+class TestDatabasePool(unittest.TestCase):
+    def test_exhausted_pool(self):
+        pool = mock.Mock()
+        pool.getconn.side_effect = psycopg2.pool.PoolError("connection pool exhausted")
+        with mock.patch('cubequery.tasks._get_db_pool', return_value=pool), \
+                mock.patch.dict(os.environ, {'DATABASE_POOL_WAIT': '0.1'}):
+            with self.assertRaises(DatabaseBusyError):
+                check_database_spatial("POLYGON ((0 0, 1 0, 1 1, 0 0))", "ls8", "2020-01-01", "2020-02-01")
+        # it waited for a connection to come back rather than giving up at once.
+        self.assertGreater(pool.getconn.call_count, 1)
+        pool.putconn.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
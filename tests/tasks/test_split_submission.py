@@ -0,0 +1,107 @@
+import unittest
+from unittest import mock
+
+from celery import Celery
+
+from cubequery.aoi import AOI
+from cubequery.tasks import CubeQueryTask, DType, Parameter, ValidatedRequest
+from tests.tasks.test_result_cache import FakeCache
+
+_small = "POLYGON ((178.4 -18.1, 178.5 -18.1, 178.5 -18.2, 178.4 -18.2, 178.4 -18.1))"
+_large = "POLYGON ((177.3 -17.5, 178.1 -17.5, 178.1 -18.2, 177.3 -18.2, 177.3 -17.5))"
+
+
+class SplitTask(CubeQueryTask):
+    tileable = True
+    time_parameters = ("start_date", "end_date")
+    time_window_days = 365
+    parameters = [
+        Parameter("aoi", "Area", DType.WKT, "area of interest"),
+        Parameter("start_date", "Start", DType.DATE, "start"),
+        Parameter("end_date", "End", DType.DATE, "end"),
+    ]
+
+
+class PlainTask(CubeQueryTask):
+    parameters = SplitTask.parameters
+
+
+class TestSplitSubmission(unittest.TestCase):
+    def test_not_split(self):
+        args = {'user': 'u', 'aoi': AOI(_small), 'start_date': '2019-01-01', 'end_date': '2019-06-01'}
+        self.assertIsNone(SplitTask.split_submission(args))
+        args['end_date'] = '2022-01-01'
+        self.assertIsNone(PlainTask.split_submission(args))
+
+    def test_tiles(self):
+        args = {'user': 'u', 'aoi': AOI(_large), 'start_date': '2019-01-01', 'end_date': '2019-06-01'}
+        merge, parts = SplitTask.split_submission(args)
+        self.assertEqual(merge, "tiles")
+        self.assertEqual(len(parts), 6)
+        for p in parts:
+            self.assertIsInstance(p['aoi'], AOI)
+            self.assertLessEqual(p['aoi'].area, 0.25)
+            self.assertEqual(p['start_date'], '2019-01-01')
+            self.assertEqual(p['user'], 'u')
+
+    def test_time(self):
+        args = {'user': 'u', 'aoi': AOI(_small), 'start_date': '2019-01-01', 'end_date': '2020-06-01'}
+        merge, parts = SplitTask.split_submission(args)
+        self.assertEqual(merge, "time")
+        self.assertEqual([(p['start_date'], p['end_date']) for p in parts],
+                         [('2019-01-01', '2019-12-31'), ('2020-01-01', '2020-06-01')])
+        self.assertIs(parts[0]['aoi'], args['aoi'])
+
+
+class FailingTask(SplitTask):
+    name = "mock.FailingTask"
+
+    def calculate_result(self, *args, **kwargs):
+        raise RuntimeError("no data")
+
+
+class TestFailedPart(unittest.TestCase):
+    def setUp(self):
+        self.app = Celery('test', broker='memory://', backend='cache+memory://')
+        self.task = self.app.register_task(FailingTask)
+        self.cache = FakeCache()
+        FailingTask._cache = self.cache
+        self.queues = set()
+
+    def tearDown(self):
+        FailingTask._cache = None
+        # the in memory broker is shared by the whole process, the parts that weren't run are dropped.
+        with self.app.connection() as connection:
+            for name in self.queues:
+                connection.SimpleQueue(name).clear()
+
+    def _submit_and_run_a_part(self, args):
+        merge, parts = self.task.split_submission(args)
+        with mock.patch('cubequery.estimates.estimate_submission', return_value=None):
+            future = self.task.delay_parts(False, ValidatedRequest(self.task, args), "cubequery-result:x", merge, parts)
+        self.assertEqual(self.task.find_cached_result("cubequery-result:x"), future.task_id)
+        self.queues.update(self.task.route(p)['queue'] for p in parts)
+
+        with self.app.connection() as connection:
+            queue = connection.SimpleQueue(self.task.route(parts[0])['queue'])
+            message = queue.get(timeout=1)
+            message.ack()
+            queue.close()
+        with mock.patch('cubequery.task_index.record_failure') as record_failure:
+            result = self.task.apply(args=message.payload[0], kwargs=message.payload[1], task_id=message.headers['id'])
+        self.assertEqual(result.state, "FAILURE")
+        return future, record_failure
+
+    def test_tile_fails(self):
+        args = {'user': 'u', 'aoi': AOI(_large), 'start_date': '2019-01-01', 'end_date': '2019-06-01'}
+        future, record_failure = self._submit_and_run_a_part(args)
+        # the merge won't run, the whole run is failed and the next submission starts again.
+        record_failure.assert_called_once_with(future.task_id, "part 0 failed: RuntimeError('no data')")
+        self.assertIsNone(self.task.find_cached_result("cubequery-result:x"))
+
+    def test_time_window_fails(self):
+        args = {'user': 'u', 'aoi': AOI(_small), 'start_date': '2019-01-01', 'end_date': '2020-06-01'}
+        self.assertEqual(self.task.split_submission(args)[0], "time")
+        future, record_failure = self._submit_and_run_a_part(args)
+        record_failure.assert_called_once_with(future.task_id, "part 0 failed: RuntimeError('no data')")
+        self.assertIsNone(self.task.find_cached_result("cubequery-result:x"))
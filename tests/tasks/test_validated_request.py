@@ -0,0 +1,56 @@
+import json
+import unittest
+
+from cubequery.aoi import AOI
+from cubequery.tasks import CubeQueryTask, Parameter, DType, ValidatedRequest
+
+_aoi = "POLYGON ((178.4 -18.1, 178.5 -18.1, 178.5 -18.2, 178.4 -18.2, 178.4 -18.1))"
+
+
+class TestValidatedRequest(unittest.TestCase):
+
+    class MockTask(CubeQueryTask):
+        display_name = "A Test Task"
+        description = "A test task that shouldn't do anything."
+
+        parameters = [
+            Parameter("aoi", "aoi", DType.WKT, "area"),
+            Parameter("res", "res", DType.INT, "resolution"),
+        ]
+
+        CubeQueryTask.cal_significant_kwargs(parameters)
+
+        def calculate_result(self, *args, **kwargs):
+            pass
+
+    def test_parse_arg(self):
+        test = TestValidatedRequest.MockTask()
+        parsed = test.parse_arg("aoi", _aoi)
+        self.assertIsInstance(parsed, AOI)
+        self.assertEqual(parsed, _aoi)
+        self.assertAlmostEqual(parsed.area, 0.01)
+        self.assertEqual(parsed.bounds, (178.4, -18.2, 178.5, -18.1))
+        self.assertTrue(test.validate_arg("aoi", parsed)[0])
+
+        self.assertEqual(test.parse_arg("aoi", "POLYGON ((fish"), "POLYGON ((fish")
+        self.assertFalse(test.validate_arg("aoi", test.parse_arg("aoi", "POLYGON ((fish"))[0])
+        self.assertEqual(test.parse_arg("res", "30"), "30")
+
+    def test_round_trip(self):
+        test = TestValidatedRequest.MockTask()
+        request = ValidatedRequest(test, {'user': 'basic', 'aoi': test.parse_arg("aoi", _aoi), 'res': "30"})
+        params = request.to_params()
+
+        # the text is still there for anything that reads the params directly
+        self.assertEqual(json.loads(params)['aoi'], _aoi)
+
+        args = test.map_kwargs(params=params)
+        self.assertEqual(set(args.keys()), {'user', 'aoi', 'res'})
+        self.assertIsInstance(args['aoi'], AOI)
+        self.assertEqual(args['aoi'], _aoi)
+        self.assertTrue(args['aoi'].geometry.equals(request.args['aoi'].geometry))
+        self.assertEqual(args['res'], 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import unittest
+from unittest import mock
+
+from celery import Celery
+
+from cubequery.tasks import CubeQueryTask, Parameter, DType
+
+with mock.patch('cubequery.git_packages.process_repo'):
+    from cubequery import api_server
+
+
+class SubmittedTask(CubeQueryTask):
+    name = "mock.SubmittedTask"
+    display_name = "A Test Task"
+    description = "A test task that is only ever sent to the queue."
+
+    parameters = [
+        Parameter("res", "res", DType.INT, "resolution"),
+        Parameter("platform", "platform", DType.STRING, "satellite"),
+    ]
+
+    CubeQueryTask.cal_significant_kwargs(parameters)
+
+    def calculate_result(self, *args, **kwargs):
+        raise AssertionError("should be sent to a worker, not run in the api")
+
+
+class TestCreateTask(unittest.TestCase):
+    def setUp(self):
+        # everything up to the broker is real, the broker is an in memory one.
+        self.celery = Celery('test', broker='memory://')
+        patches = [
+            mock.patch.object(api_server, 'celery_app', self.celery),
+            mock.patch.object(api_server, 'is_valid_task', return_value=True),
+            mock.patch.object(api_server, 'load_task_instance', side_effect=lambda name: SubmittedTask()),
+            mock.patch.object(api_server, '_is_admin', return_value=True),
+            mock.patch('cubequery.task_index.record_submission'),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.client = api_server.app.test_client()
+
+    def _sent(self, queue_name):
+        with self.celery.connection() as connection:
+            queue = connection.SimpleQueue(queue_name)
+            message = queue.get(timeout=1)
+            message.ack()
+            queue.close()
+        return message
+
+    def test_profile(self):
+        response = self.client.post('/task', json={
+            'task': SubmittedTask.name,
+            'args': {'res': '30', 'platform': 'SENTINEL_2'},
+            'profile': True,
+        })
+        self.assertEqual(response.status_code, 200, response.data)
+        body = response.get_json()
+        message = self._sent(body['queue'])
+        self.assertEqual(message.headers['task'], SubmittedTask.name)
+        self.assertEqual(message.headers['id'], body['task_id'])
+        self.assertTrue(message.payload[1]['profile'])
+
+    def test_uncached(self):
+        response = self.client.post('/task', json={
+            'task': SubmittedTask.name,
+            'args': {'res': '30', 'platform': 'SENTINEL_2'},
+            'use_cache': False,
+        })
+        self.assertEqual(response.status_code, 200, response.data)
+        body = response.get_json()
+        message = self._sent(body['queue'])
+        self.assertEqual(message.headers['id'], body['task_id'])
+        self.assertNotIn('profile', message.payload[1])
+
+
+    def test_zero_resolution(self):
+        for res in ("0", "0.0"):
+            response = self.client.post('/task', json={
+                'task': SubmittedTask.name,
+                'args': {'res': res, 'platform': 'SENTINEL_2'},
+            })
+            self.assertEqual(response.status_code, 400, res)
+
+
+class TestDescribe(unittest.TestCase):
+    def test_rebuilt_document_replaces_the_old_one(self):
+        self.addCleanup(setattr, api_server, '_describe_cache', None)
+        with mock.patch.object(api_server, 'list_processes', return_value=[]), \
+                mock.patch.object(api_server, 'fetch_form_settings', side_effect=[{'a': 1}, {'a': 2}]), \
+                mock.patch.object(api_server, 'form_settings_version', side_effect=[1, 1, 2]):
+            old = api_server._describe_document()
+            self.assertIs(api_server._describe_document(), old)
+            new = api_server._describe_document()
+        # a request still holding the old document sees all of it.
+        self.assertIsNot(new, old)
+        self.assertEqual(json.loads(old['body'])['settings'], {'a': 1})
+        self.assertEqual(old['etag'], hashlib.sha256(old['body']).hexdigest())
+        self.assertEqual(json.loads(new['body'])['settings'], {'a': 2})
+
+
+class TestListTasks(unittest.TestCase):
+    def setUp(self):
+        patch = mock.patch('cubequery.task_index.list_tasks', return_value=[])
+        self.list_tasks = patch.start()
+        self.addCleanup(patch.stop)
+        self.client = api_server.app.test_client()
+
+    def test_bad_paging(self):
+        for query in ("offset=abc", "offset=-1", "limit=1.5", "limit=0", "limit=-5"):
+            self.assertEqual(self.client.get(f"/task/?{query}").status_code, 400, query)
+        self.list_tasks.assert_not_called()
+
+    def test_limit_capped(self):
+        with mock.patch.dict('os.environ', {'APP_MAX_TASK_PAGE': '50'}):
+            self.assertEqual(self.client.get("/task/?offset=10&limit=100000").status_code, 200)
+        self.list_tasks.assert_called_once_with(user=None, state=None, offset=10, limit=50)
+
+
+class FakeBody(object):
+    def __init__(self, data):
+        self.data = data
+
+    def iter_chunks(self, size):
+        for i in range(0, len(self.data), size):
+            yield self.data[i:i + size]
+
+    def close(self):
+        pass
+
+
+class FakeS3(object):
+    def __init__(self, data):
+        self.data = data
+
+    def head_object(self, Bucket, Key):
+        return {'ETag': '"abc"', 'ContentLength': len(self.data)}
+
+    def get_object(self, Bucket, Key, Range=None):
+        if Range is None:
+            return {'Body': FakeBody(self.data)}
+        start, end = Range[len("bytes="):].split("-")
+        return {'Body': FakeBody(self.data[int(start):int(end) + 1])}
+
+
+class TestGetResult(unittest.TestCase):
+    def setUp(self):
+        patch = mock.patch.object(api_server, 's3_client', return_value=FakeS3(b"0123456789"))
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.client = api_server.app.test_client()
+
+    def test_single_range(self):
+        response = self.client.get("/result/abc", headers={'Range': "bytes=2-4"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, b"234")
+
+    def test_several_ranges(self):
+        response = self.client.get("/result/abc", headers={'Range': "bytes=0-1,5-6"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b"0123456789")
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get("/result/abc", headers={'Range': "bytes=20-30"})
+        self.assertEqual(response.status_code, 416)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from cubequery.archive import ArchivePolicy, ParallelDeflater
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _file(self, name, data):
+        file_path = os.path.join(self.dir, name)
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        return file_path
+
+    def test_choose(self):
+        policy = ArchivePolicy()
+        text = self._file("values.csv", b"1,2,3,4\n" * 100000)
+        noise = self._file("noise.nc", os.urandom(500000))
+        picture = self._file("picture.png", b"\0" * 1000)
+        self.assertEqual(policy.choose(text), zipfile.ZIP_DEFLATED)
+        self.assertEqual(policy.choose(noise), zipfile.ZIP_STORED)
+        self.assertEqual(policy.choose(picture), zipfile.ZIP_STORED)
+
+    def test_parallel_deflater(self):
+        data = b"".join(b"line %d of the output\n" % i for i in range(200000))
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            deflater = ParallelDeflater(pool, block_size=64 * 1024, max_pending=3)
+            compressed = b"".join(deflater.compress(data[i:i + 10000]) for i in range(0, len(data), 10000))
+            compressed += deflater.flush()
+        self.assertEqual(zlib.decompress(compressed, -zlib.MAX_WBITS), data)
+        self.assertLess(len(compressed), len(data) / 4)
+
+    def test_write(self):
+        text = b"".join(b"%d,%d\n" % (i, i * i) for i in range(300000))
+        noise = os.urandom(100000)
+        files = [
+            (self._file("big.csv", text), "big.csv"),
+            (self._file("small.csv", b"a,b\n1,2\n"), "small.csv"),
+            (self._file("noise.tif", noise), "noise.tif"),
+        ]
+        output = io.BytesIO()
+        output.write(b"not part of the archive")
+        stats = ArchivePolicy(parallel_threshold=1024 * 1024, block_size=128 * 1024, threads=2).write(output, files)
+
+        self.assertEqual(stats['files'], 3)
+        self.assertEqual(stats['stored'], 2)  # too small to gain anything from deflating
+        self.assertEqual(stats['deflated'], 1)
+        self.assertEqual(stats['parallel'], 1)
+        self.assertEqual(stats['input_bytes'], len(text) + 8 + len(noise))
+        self.assertEqual(stats['output_bytes'], len(output.getvalue()) - len(b"not part of the archive"))
+
+        with zipfile.ZipFile(io.BytesIO(output.getvalue()[len(b"not part of the archive"):])) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.read("big.csv"), text)
+            self.assertEqual(zf.read("noise.tif"), noise)
+            self.assertEqual(zf.getinfo("noise.tif").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(zf.getinfo("big.csv").compress_type, zipfile.ZIP_DEFLATED)
+
+    def test_write_to_path(self):
+        text = b"".join(b"%d\n" % i for i in range(100000))
+        output = os.path.join(self.dir, "out.zip")
+        stats = ArchivePolicy().write(output, [(self._file("values.csv", text), "résultats/values.csv")])
+        self.assertEqual(stats['output_bytes'], os.path.getsize(output))
+        with zipfile.ZipFile(output) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.namelist(), ["résultats/values.csv"])
+            self.assertEqual(zf.read("résultats/values.csv"), text)
@@ -0,0 +1,81 @@
+import unittest
+
+from cubequery.conditions import CompiledConditions
+
+_settings = {
+    "platform": [
+        {
+            "name": "landsat_7",
+            "conditions": [
+                {"id": ["res"], "value": [30, 500], "type": "int_range", "_comment": "res",
+                 "error_message": "bad resolution"},
+                {"id": ["res"], "value": [100, 330], "type": "int_range", "processes": ["special.Task"],
+                 "_comment": "special res", "error_message": "bad special resolution"},
+                {"id": ["time_start", "time_end"], "value": ["1999-01-01", "2013-01-01"], "type": "date_range",
+                 "_comment": "dates", "error_message": "bad dates"},
+                {"id": ["res"], "value": [], "type": "not_a_real_type", "_comment": "", "error_message": ""},
+            ]
+        },
+        {
+            "name": "sentinel_2",
+            "conditions": [
+                {"id": ["time_start"], "value": ["2015-01-01"], "type": "date_range", "_comment": "dates",
+                 "error_message": "bad dates"},
+            ]
+        }
+    ]
+}
+
+
+class TestCompiledConditions(unittest.TestCase):
+    def setUp(self):
+        self.conditions = CompiledConditions(_settings)
+
+    def errors(self, process, args):
+        return [e['Error'] for e in self.conditions.validate(process, args)]
+
+    def test_valid(self):
+        args = {'platform': 'landsat_7', 'res': '30', 'time_start': '2000-01-01', 'time_end': '2001-1-1'}
+        self.assertEqual(self.errors('any.Task', args), [])
+
+    def test_int_range(self):
+        self.assertEqual(self.errors('any.Task', {'platform': 'landsat_7', 'res': 10}), ['bad resolution'])
+        self.assertEqual(self.errors('any.Task', {'platform': 'landsat_7', 'res': 501}), ['bad resolution'])
+
+    def test_process_specific(self):
+        self.assertEqual(self.errors('any.Task', {'platform': 'landsat_7', 'res': 30}), [])
+        self.assertEqual(self.errors('special.Task', {'platform': 'landsat_7', 'res': 30}), ['bad special resolution'])
+
+    def test_date_range(self):
+        args = {'platform': 'landsat_7', 'time_start': '1998-01-01', 'time_end': '2014-01-01'}
+        self.assertEqual(self.errors('any.Task', args), ['bad dates', 'bad dates'])
+        self.assertEqual(self.errors('any.Task', {'platform': 'sentinel_2', 'time_start': '2030-01-01'}), [])
+        self.assertEqual(self.errors('any.Task', {'platform': 'sentinel_2', 'time_start': '2014-12-31'}),
+                         ['bad dates'])
+
+    def test_unknown_values(self):
+        self.assertEqual(self.errors('any.Task', {'platform': 'landsat_9', 'res': 1}), [])
+        self.assertEqual(self.errors('any.Task', {'platform': ['landsat_7'], 'res': 1}), [])
+        self.assertEqual(self.errors('any.Task', {'res': 1}), [])
+
+    def test_only_declared_values_remembered(self):
+        for i in range(100):
+            self.conditions.validate('any.Task', {'platform': f"made_up_{i}", 'res': 1})
+        self.conditions.validate('any.Task', {'platform': 'landsat_7', 'res': 1})
+        self.assertEqual(list(self.conditions._by_process), [('platform', 'landsat_7', 'any.Task')])
+
+    def test_errors_in_declaration_order(self):
+        names = ["zeta", "alpha", "mu", "beta", "omega"]
+        settings = {}
+        for name in names:
+            condition = {"id": ["res"], "value": [1, 2], "type": "int_range", "_comment": "",
+                         "error_message": f"bad {name}"}
+            settings[name] = [{"name": "x", "conditions": [condition]}]
+        conditions = CompiledConditions(settings)
+        args = dict({name: "x" for name in settings}, res="5")
+        errors = [e['Error'] for e in conditions.validate('any.Task', args)]
+        self.assertEqual(errors, [f"bad {name}" for name in names])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy
+import xarray
+from affine import Affine
+from datacube.api.core import _calculate_chunk_sizes
+from datacube.model import GridSpec
+from datacube.utils.geometry import CRS, GeoBox
+
+from cubequery.dask_cluster import ChunkedDatacube, chunk_sizes, container_cpus, container_memory
+
+
+class TestContainerLimits(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write(self, path, value):
+        path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(value + "\n")
+
+    def test_cgroup_v2(self):
+        self._write("cpu.max", "150000 100000")
+        self._write("memory.max", str(4 * 1024 ** 3))
+        with mock.patch('os.sched_getaffinity', return_value=set(range(8))):
+            self.assertEqual(container_cpus(self.root), 2)
+        self.assertEqual(container_memory(self.root), min(4 * 1024 ** 3, container_memory("/nowhere")))
+
+    def test_cgroup_v1(self):
+        self._write("cpu/cpu.cfs_quota_us", "300000")
+        self._write("cpu/cpu.cfs_period_us", "100000")
+        self._write("memory/memory.limit_in_bytes", str(1024 ** 3))
+        with mock.patch('os.sched_getaffinity', return_value=set(range(8))):
+            self.assertEqual(container_cpus(self.root), 3)
+        self.assertEqual(container_memory(self.root), 1024 ** 3)
+
+    def test_unlimited(self):
+        self._write("cpu.max", "max 100000")
+        self._write("memory.max", "max")
+        with mock.patch('os.sched_getaffinity', return_value=set(range(4))):
+            self.assertEqual(container_cpus(self.root), 4)
+        self.assertEqual(container_memory(self.root), container_memory("/nowhere"))
+
+
+class TestChunkSizes(unittest.TestCase):
+    def test_large_area(self):
+        # a degree square at 10m is about 11000 pixels each way, far more than a chunk.
+        chunks = chunk_sizes((178, -18, 179, -17), 10, worker_memory=4 * 1024 ** 3, target_bytes=128 * 1024 ** 2)
+        self.assertEqual(chunks['x'], 5632)
+        self.assertEqual(chunks['y'], 5632)
+        self.assertEqual(chunks['time'], 1)
+
+    def test_small_workers_get_smaller_chunks(self):
+        big = chunk_sizes((178, -18, 179, -17), 10, worker_memory=4 * 1024 ** 3, target_bytes=128 * 1024 ** 2)
+        small = chunk_sizes((178, -18, 179, -17), 10, worker_memory=256 * 1024 ** 2, target_bytes=128 * 1024 ** 2)
+        self.assertLess(small['x'], big['x'])
+        self.assertEqual(small['x'] % 256, 0)
+
+    def test_small_area(self):
+        # about 370 by 370 pixels, the whole area fits in a chunk with room for several time steps.
+        chunks = chunk_sizes((178, -17.1, 178.1, -17), 30, worker_memory=4 * 1024 ** 3, target_bytes=128 * 1024 ** 2)
+        self.assertEqual((chunks['x'], chunks['y']), (355, 369))
+        self.assertEqual(chunks['time'], 32)
+
+
+def _datacube_chunks(geobox, chunks):
+    # what datacube makes of the chunks for a load onto this geobox, it raises for dimensions the load won't have.
+    sources = xarray.DataArray(numpy.empty((3,), dtype=object), dims=('time',))
+    return _calculate_chunk_sizes(sources, geobox, chunks)
+
+
+class Product(object):
+    def __init__(self, crs=None, grid_crs=None):
+        self._hints = {'output_crs': CRS(crs)} if crs else {}
+        self.grid_spec = GridSpec(CRS(grid_crs), tile_size=(100000, 100000), resolution=(-30, 30)) if grid_crs \
+            else None
+
+    def load_hints(self):
+        return self._hints
+
+
+class TestChunkedDatacube(unittest.TestCase):
+    chunks = {'time': 2, 'x': 512, 'y': 256}
+    projected = GeoBox(2000, 1000, Affine(30, 0, 500000, 0, -30, 8000000), CRS('EPSG:32760'))
+    geographic = GeoBox(2000, 1000, Affine(0.0001, 0, 178, 0, -0.0001, -17), CRS('EPSG:4326'))
+
+    def _loaded_chunks(self, product=None, **kwargs):
+        dc = mock.Mock()
+        dc.index.products.get_by_name.return_value = product
+        ChunkedDatacube(dc, self.chunks).load(product="ls8", **kwargs)
+        return dc.load.call_args[1].get('dask_chunks')
+
+    def test_projected_output(self):
+        chunks = self._loaded_chunks(output_crs="EPSG:32760", resolution=(-30, 30))
+        self.assertEqual(chunks, {'time': 2, 'y': 256, 'x': 512})
+        self.assertEqual(_datacube_chunks(self.projected, chunks), ((2,), (256, 512)))
+
+    def test_geographic_output(self):
+        chunks = self._loaded_chunks(output_crs="EPSG:4326", resolution=(-0.0001, 0.0001))
+        self.assertEqual(chunks, {'time': 2, 'latitude': 256, 'longitude': 512})
+        self.assertEqual(_datacube_chunks(self.geographic, chunks), ((2,), (256, 512)))
+
+    def test_like(self):
+        chunks = self._loaded_chunks(like=self.geographic)
+        _datacube_chunks(self.geographic, chunks)
+
+    def test_product_crs(self):
+        chunks = self._loaded_chunks(Product(crs='EPSG:4326'))
+        _datacube_chunks(self.geographic, chunks)
+        chunks = self._loaded_chunks(Product(grid_crs='EPSG:32760'))
+        _datacube_chunks(self.projected, chunks)
+
+    def test_unknown_crs_not_chunked(self):
+        self.assertIsNone(self._loaded_chunks(Product()))
+
+    def test_own_chunks_kept(self):
+        self.assertEqual(self._loaded_chunks(dask_chunks={'time': 10}), {'time': 10})
+        dc = mock.Mock()
+        ChunkedDatacube(dc, self.chunks).load(product="ls8", output_crs="EPSG:4326", dask_chunks=None)
+        self.assertIsNone(dc.load.call_args[1]['dask_chunks'])
+
+    def test_passes_through(self):
+        dc = mock.Mock()
+        self.assertIs(ChunkedDatacube(dc, None).index, dc.index)
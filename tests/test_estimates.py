@@ -0,0 +1,94 @@
+import unittest
+from unittest import mock
+
+from cubequery import estimates, task_metrics
+from cubequery.aoi import AOI
+from cubequery.estimates import RunModel, fit_models
+from cubequery.tasks import CubeQueryTask, DType, Parameter
+
+_aoi = "POLYGON ((178.4 -18.1, 178.5 -18.1, 178.5 -18.2, 178.4 -18.2, 178.4 -18.1))"
+
+
+class EstimatedTask(CubeQueryTask):
+    name = "estimated"
+    parameters = [
+        Parameter("aoi", "Area", DType.WKT, "area of interest"),
+        Parameter("start_date", "Start", DType.DATE, "start"),
+        Parameter("end_date", "End", DType.DATE, "end"),
+        Parameter("res", "Resolution", DType.INT, "pixel size"),
+        Parameter("platform", "Platform", DType.STRING, "satellite"),
+    ]
+
+
+def _sample(area, days, resolution, platform="LANDSAT_8", scale=1.0):
+    # run time goes up with the number of pixels read, memory with the area of a single day.
+    pixels = area / (resolution * resolution)
+    return {'area': area, 'days': days, 'resolution': resolution, 'platform': platform,
+            'seconds': scale * 10 * pixels * days, 'peak_memory_bytes': scale * 1e8 * pixels,
+            'memory_measure': task_metrics.memory_measure}
+
+
+_samples = [_sample(a, d, r) for a in (10, 100, 1000) for d in (30, 365) for r in (10, 30)]
+
+
+class TestRunModel(unittest.TestCase):
+    def test_power_law(self):
+        model = RunModel(_samples)
+        predicted = model.predict(500, 100, 20)
+        expected = _sample(500, 100, 20)
+        self.assertAlmostEqual(predicted['seconds'] / expected['seconds'], 1, places=2)
+        self.assertAlmostEqual(predicted['peak_memory_bytes'] / expected['peak_memory_bytes'], 1, places=2)
+
+    def test_all_the_same_size(self):
+        model = RunModel([_sample(10, 30, 10)] * 3)
+        self.assertAlmostEqual(model.predict(10, 30, 10)['seconds'], _sample(10, 30, 10)['seconds'], places=3)
+
+    def test_platforms(self):
+        samples = _samples + [_sample(a, 30, 10, platform="SENTINEL_2", scale=3) for a in (10, 100, 1000)]
+        models = fit_models(samples, min_samples=3)
+        self.assertEqual(set(models), {None, "LANDSAT_8", "SENTINEL_2"})
+        self.assertGreater(models["SENTINEL_2"].predict(100, 30, 10)['seconds'],
+                           models["LANDSAT_8"].predict(100, 30, 10)['seconds'] * 2)
+        self.assertEqual(fit_models(samples[:2], min_samples=3), {})
+
+    def test_samples_without_memory_left_out(self):
+        # runs recorded before the dask workers were measured only have the task process memory.
+        old = [{'area': 10, 'days': 30, 'resolution': 10, 'seconds': 1, 'peak_rss_bytes': 1e6}] * 10
+        self.assertEqual(fit_models(old, min_samples=3), {})
+        self.assertEqual(fit_models(old + _samples, min_samples=3)[None].samples, len(_samples))
+
+    def test_samples_measured_differently_left_out(self):
+        # runs that reset the shared dask workers' peaks.
+        old = [dict(_sample(10, 30, 10), memory_measure=None) for _ in range(10)]
+        self.assertEqual(fit_models(old, min_samples=3), {})
+        self.assertEqual(fit_models(old + _samples, min_samples=3)[None].samples, len(_samples))
+
+
+class TestEstimates(unittest.TestCase):
+    def setUp(self):
+        estimates._models.clear()
+
+    def test_estimate_submission(self):
+        args = {'user': 'u', 'aoi': AOI(_aoi), 'start_date': '2019-01-01', 'end_date': '2019-12-31', 'res': 30,
+                'platform': 'LANDSAT_8'}
+        size = EstimatedTask.run_size(args)
+        with mock.patch('cubequery.task_index.run_samples', return_value=_samples) as samples:
+            result = estimates.estimate_submission(EstimatedTask, args)
+            estimates.estimate_submission(EstimatedTask, args)
+        # the fit is reused rather than refitted for each estimate.
+        samples.assert_called_once()
+        expected = _sample(size['area'], 365, 30)
+        self.assertAlmostEqual(result['seconds'] / expected['seconds'], 1, places=2)
+        self.assertEqual(result['parts'], 1)
+        self.assertEqual(result['samples'], len(_samples))
+
+    def test_no_history(self):
+        args = {'user': 'u', 'aoi': AOI(_aoi), 'res': 30}
+        with mock.patch('cubequery.task_index.run_samples', return_value=[]):
+            self.assertIsNone(estimates.estimate_submission(EstimatedTask, args))
+
+    def test_queue_wait(self):
+        with mock.patch('cubequery.task_index.queue_waits', return_value=[5.0, 60.0, 10.0]):
+            self.assertEqual(estimates.queue_wait("small"), 10.0)
+        with mock.patch('cubequery.task_index.queue_waits', return_value=[]):
+            self.assertIsNone(estimates.queue_wait("small"))
@@ -33,6 +33,26 @@ class GitPackagesTestCases(unittest.TestCase):
         for t in tests:
             self.assertEqual(git_packages._line_comment_type(t[0]), t[1], f"{t[0]} didn't return {t[1]}")
 
+    def test_process_task_options(self):
+        code = "# parameters\n" \
+               "#task tileable=True\n" \
+               "#parameter display_name=\"resolution\" description=\"size of pixes\" datatype=\"int\"\n" \
+               "res = (30)\n" \
+               "#task   memory_limit = 1024\n"
+        options = git_packages._process_task_options(code)
+        self.assertEqual(options, {'tileable': True, 'memory_limit': 1024})
+        self.assertEqual(git_packages._convert_to_options_def(options), "    memory_limit = 1024\n    tileable = True\n")
+
+    def test_rewrite_dask_client(self):
+        tests = [
+            ("client = Client('dask-scheduler.dask.svc.cluster.local:8786')", "client = dc.dask_client"),
+            ("    c = distributed.Client(address='tcp://10.0.0.1:8786') ", "    c = dc.dask_client"),
+            ("from dask.distributed import Client", "from dask.distributed import Client"),
+            ("print(client)", "print(client)"),
+        ]
+        for t in tests:
+            self.assertEqual(git_packages._rewrite_dask_client(t[0]), t[1])
+
     def test_line_parameter(self):
         tests = [
             ("", False),
@@ -1,6 +1,6 @@
 import unittest
 
-from cubequery.ipaddress_matching import match
+from cubequery.ipaddress_matching import match, compile_patterns
 
 
 class TestIPAddressMatching(unittest.TestCase):
@@ -10,3 +10,35 @@ class TestIPAddressMatching(unittest.TestCase):
         self.assertTrue(match('192.168.0.*', '192.168.0.1'))
         self.assertTrue(match('192.168.0.*', '192.168.0.34'))
         self.assertTrue(match('192.168.0.*', '192.168.0.255'))  # this is not a valid address I know.
+
+    def test_cidr_matches(self):
+        self.assertTrue(match('10.0.0.0/8', '10.1.2.3'))
+        self.assertFalse(match('10.0.0.0/8', '11.1.2.3'))
+        self.assertTrue(match('2001:db8::/32', '2001:db8::1'))
+        self.assertFalse(match('2001:db8::/32', '192.168.0.1'))
+
+
+class TestCompiledAddressMatching(unittest.TestCase):
+    def test_matches_like_match_list(self):
+        matcher = compile_patterns(['127.0.0.1', '172.*', '192.168.0.*', '10.0.0.0/8', '2001:db8::/32', '193.1*'])
+        self.assertTrue(matcher.match('127.0.0.1'))
+        self.assertFalse(matcher.match('127.0.0.2'))
+        self.assertTrue(matcher.match('172.18.0.5'))
+        self.assertTrue(matcher.match('192.168.0.254'))
+        self.assertFalse(matcher.match('192.168.1.1'))
+        self.assertTrue(matcher.match('10.200.3.4'))
+        self.assertTrue(matcher.match('2001:db8:1::5'))
+        self.assertFalse(matcher.match('2001:db9::5'))
+        self.assertTrue(matcher.match('193.12.0.1'))
+        self.assertFalse(matcher.match('193.20.0.1'))
+
+    def test_blank_matches_anything(self):
+        self.assertTrue(compile_patterns(['']).match('anything'))
+        self.assertFalse(compile_patterns([]).match('127.0.0.1'))
+
+    def test_star_matches_anything(self):
+        matcher = compile_patterns(['*'])
+        self.assertTrue(matcher.match('192.168.0.1'))
+        self.assertTrue(matcher.match('2001:db8::1'))
+        self.assertTrue(match('*', '2001:db8::1'))
+        self.assertTrue(compile_patterns(['10.0.0.0/8', '*']).match('::1'))
@@ -0,0 +1,74 @@
+import unittest
+
+import redis
+
+from cubequery.login_throttle import FailedLoginThrottle
+from tests.fake_redis import FakeClock, FakeRedis
+
+
+class DownRedis(object):
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise redis.ConnectionError("down")
+        return fail
+
+
+class TestFailedLoginThrottle(unittest.TestCase):
+    def test_blocks_after_max_failures(self):
+        throttle = FailedLoginThrottle(max_failures=3, window=60, client=FakeRedis(FakeClock()))
+        for _ in range(2):
+            throttle.record_failure("user:basic", "ip:127.0.0.1")
+        self.assertFalse(throttle.is_blocked("user:basic"))
+        throttle.record_failure("user:basic", "ip:127.0.0.1")
+        self.assertTrue(throttle.is_blocked("user:basic"))
+        self.assertTrue(throttle.is_blocked("user:other", "ip:127.0.0.1"))
+        self.assertFalse(throttle.is_blocked("user:other", "ip:10.0.0.1"))
+
+    def test_failures_expire(self):
+        clock = FakeClock()
+        client = FakeRedis(clock)
+        throttle = FailedLoginThrottle(max_failures=2, window=60, client=client)
+        throttle.record_failure("user:basic")
+        clock.now += 30
+        throttle.record_failure("user:basic")
+        self.assertTrue(throttle.is_blocked("user:basic"))
+        # the window runs from the first failure.
+        clock.now += 31
+        self.assertFalse(throttle.is_blocked("user:basic"))
+        # nothing is kept once it has expired.
+        self.assertEqual(client.values, {})
+
+    def test_shared_between_processes(self):
+        client = FakeRedis(FakeClock())
+        FailedLoginThrottle(max_failures=1, window=60, client=client).record_failure("user:basic")
+        self.assertTrue(FailedLoginThrottle(max_failures=1, window=60, client=client).is_blocked("user:basic"))
+
+    def test_reset(self):
+        throttle = FailedLoginThrottle(max_failures=1, window=60, client=FakeRedis(FakeClock()))
+        throttle.record_failure("user:basic")
+        self.assertTrue(throttle.is_blocked("user:basic"))
+        throttle.reset("user:basic")
+        self.assertFalse(throttle.is_blocked("user:basic"))
+
+    def test_lost_pipeline_records_nothing(self):
+        class LostPipeline(FakeRedis):
+            def pipeline(self):
+                pipe = super().pipeline()
+                pipe.execute = DownRedis().execute
+                return pipe
+
+        client = LostPipeline(FakeClock())
+        throttle = FailedLoginThrottle(max_failures=1, window=60, client=client)
+        throttle.record_failure("user:basic")
+        self.assertFalse(throttle.is_blocked("user:basic"))
+        self.assertEqual(client.values, {})
+
+    def test_redis_down(self):
+        throttle = FailedLoginThrottle(max_failures=1, window=60, client=DownRedis())
+        throttle.record_failure("user:basic")
+        self.assertFalse(throttle.is_blocked("user:basic"))
+        throttle.reset("user:basic")
+
+
+if __name__ == '__main__':
+    unittest.main()
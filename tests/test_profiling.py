@@ -0,0 +1,41 @@
+import os
+import pstats
+import tempfile
+import time
+import unittest
+
+from cubequery.profiling import TaskProfiler
+
+
+def busy_work():
+    end = time.perf_counter() + 0.2
+    total = 0
+    while time.perf_counter() < end:
+        total += sum(range(1000))
+    return total
+
+
+class TestTaskProfiler(unittest.TestCase):
+    def test_profile(self):
+        with tempfile.TemporaryDirectory() as d:
+            with TaskProfiler(interval=0.001) as profiler:
+                busy_work()
+            files = profiler.save(d, "task-1")
+            self.assertEqual([os.path.basename(f) for f in files], ["task-1_profile.pstats", "task-1_profile.collapsed"])
+
+            stats = pstats.Stats(files[0])
+            self.assertTrue(any(func[2] == "busy_work" for func in stats.stats))
+
+            with open(files[1]) as f:
+                lines = f.read().splitlines()
+            self.assertTrue(lines)
+            stack, count = lines[0].rsplit(" ", 1)
+            self.assertGreater(int(count), 0)
+            self.assertTrue(any("busy_work (test_profiling.py:" in line for line in lines))
+
+    def test_disabled(self):
+        with tempfile.TemporaryDirectory() as d:
+            with TaskProfiler(enabled=False) as profiler:
+                busy_work()
+            self.assertEqual(profiler.save(d, "task-1"), [])
+            self.assertEqual(os.listdir(d), [])
@@ -0,0 +1,60 @@
+import unittest
+from unittest import mock
+
+from cubequery import resources
+from cubequery.resources import ProcessResource
+
+
+class Thing(object):
+    def __init__(self):
+        self.healthy = True
+        self.closed = False
+
+
+def check(thing):
+    if not thing.healthy:
+        raise IOError("connection lost")
+
+
+class TestProcessResource(unittest.TestCase):
+    def test_shared(self):
+        created = []
+        resource = ProcessResource(lambda: created.append(Thing()) or created[-1])
+        self.assertIs(resource.get(), resource.get())
+        self.assertEqual(len(created), 1)
+
+    def test_recreated_after_fork(self):
+        resource = ProcessResource(Thing)
+        with mock.patch('os.getpid', return_value=100):
+            first = resource.get()
+        with mock.patch('os.getpid', return_value=200):
+            second = resource.get()
+        self.assertIsNot(first, second)
+        self.assertFalse(first.closed)
+
+    def test_health_check(self):
+        resource = ProcessResource(Thing, check=check, check_interval=0, close=lambda t: setattr(t, 'closed', True))
+        first = resource.get()
+        self.assertIs(resource.get(), first)
+
+        first.healthy = False
+        second = resource.get()
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+
+    def test_reset(self):
+        resource = ProcessResource(Thing, close=lambda t: setattr(t, 'closed', True))
+        first = resource.get()
+        resource.reset()
+        self.assertTrue(first.closed)
+        self.assertIsNot(resource.get(), first)
+
+    def test_s3_client_checked(self):
+        clients = [mock.Mock(), mock.Mock()]
+        clients[0].head_bucket.side_effect = IOError("expired")
+        with mock.patch('cubequery.resources._create_s3_client', side_effect=clients), \
+                mock.patch.dict('os.environ', {'AWS_CHECK_INTERVAL': '-1'}), \
+                mock.patch.dict(resources._s3_clients, clear=True):
+            self.assertIs(resources.s3_client("http://s3"), clients[0])
+            self.assertIs(resources.s3_client("http://s3"), clients[1])
+        clients[0].head_bucket.assert_called_once_with(Bucket=resources.get_config("AWS", "bucket"))
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from cubequery.result_dir import ResultDirectory, InsufficientDiskSpace
+
+
+class TestResultDirectory(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _run(self, results, task_id, size, age=0, success=True):
+        job_path = results.start(task_id)
+        with open(os.path.join(job_path, "output.tif"), 'wb') as f:
+            f.write(b"\0" * size)
+        results.finish(task_id, success)
+        if age and os.path.exists(job_path):
+            then = time.time() - age
+            os.utime(job_path, (then, then))
+
+    def test_removed_without_cache(self):
+        results = ResultDirectory(self.root)
+        self._run(results, "task-1", 100)
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_failed(self):
+        self._run(ResultDirectory(self.root), "task-1", 100, success=False)
+        self.assertEqual(os.listdir(self.root), [])
+
+        self._run(ResultDirectory(self.root, keep_failed=True), "task-2", 100, success=False)
+        self.assertEqual(os.listdir(self.root), ["task-2"])
+        self.assertFalse(os.path.exists(os.path.join(self.root, "task-2", ".running")))
+
+    def test_running_jobs_not_evicted(self):
+        results = ResultDirectory(self.root, min_free_bytes=500, keep_failed=True)
+        running = results.start("running")
+        with open(os.path.join(running, "partial.nc"), 'wb') as f:
+            f.write(b"\0" * 100)
+        self._run(results, "task-1", 100, success=False)
+        with mock.patch.object(ResultDirectory, 'free_bytes', side_effect=[400, 600]):
+            results.start("task-2")
+        self.assertEqual(sorted(os.listdir(self.root)), ["running", "task-2"])
+
+    def test_refuses_when_disk_full(self):
+        results = ResultDirectory(self.root, min_free_bytes=500, keep_failed=True)
+        self._run(results, "task-1", 100, age=10, success=False)
+        self._run(results, "task-2", 100, success=False)
+
+        # freeing the oldest kept job is enough.
+        with mock.patch.object(ResultDirectory, 'free_bytes', side_effect=[400, 600]):
+            results.start("task-3")
+        self.assertEqual(sorted(os.listdir(self.root)), ["task-2", "task-3"])
+
+        # nothing left that can be freed.
+        with mock.patch.object(ResultDirectory, 'free_bytes', return_value=100):
+            with self.assertRaises(InsufficientDiskSpace):
+                results.start("task-4")
+        self.assertFalse(os.path.exists(os.path.join(self.root, "task-4")))
+        self.assertTrue(os.path.exists(os.path.join(self.root, "task-3")))
@@ -0,0 +1,29 @@
+import unittest
+
+from shapely.geometry import box
+
+from cubequery.routing import area_km2, date_span, queue_for, submission_cost
+
+
+class TestRouting(unittest.TestCase):
+    def test_area(self):
+        self.assertAlmostEqual(area_km2(box(0, 0, 0.01, 0.01)), 1.231, places=3)
+        # a degree of longitude gets shorter away from the equator.
+        self.assertAlmostEqual(area_km2(box(0, 59.5, 1, 60.5)), area_km2(box(0, -0.5, 1, 0.5)) / 2, delta=1)
+
+    def test_date_span(self):
+        self.assertEqual(date_span(["2019-01-01", "2019-12-31"]), 365)
+        self.assertEqual(date_span(["2019-12-31", "2019-01-01", "2019-06-01"]), 365)
+        self.assertEqual(date_span(["2019-01-01"]), 1)
+        self.assertEqual(date_span([]), 1)
+
+    def test_cost(self):
+        # a square kilometre at 10m is 10000 pixels.
+        self.assertAlmostEqual(submission_cost(1, 365, 10), 3.65)
+        self.assertAlmostEqual(submission_cost(1, 365, -10, coefficient=2), 7.3)
+        self.assertAlmostEqual(submission_cost(1, 365, 30), 3.65 / 9)
+
+    def test_queue(self):
+        self.assertEqual(queue_for(3.65), {'queue': 'small', 'priority': 0})
+        self.assertEqual(queue_for(1000), {'queue': 'medium', 'priority': 3})
+        self.assertEqual(queue_for(1e6), {'queue': 'large', 'priority': 6})
@@ -0,0 +1,90 @@
+import io
+import threading
+import unittest
+import zipfile
+
+from cubequery.streaming_upload import S3MultipartWriter
+
+_mb = 1024 * 1024
+
+
+class FakeS3Client(object):
+    def __init__(self, fail_part=None):
+        self.parts = {}
+        self.completed = None
+        self.aborted = False
+        self.fail_part = fail_part
+        self._lock = threading.Lock()
+
+    def create_multipart_upload(self, Bucket, Key):
+        return {'UploadId': 'upload-1'}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self.fail_part:
+            raise IOError("part failed")
+        with self._lock:
+            self.parts[PartNumber] = Body
+        return {'ETag': f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.completed = MultipartUpload['Parts']
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted = True
+
+    def uploaded(self):
+        return b"".join(self.parts[p['PartNumber']] for p in self.completed)
+
+
+class TestS3MultipartWriter(unittest.TestCase):
+    def test_parts(self):
+        client = FakeS3Client()
+        data = bytes(range(256)) * (12 * _mb // 256 + 7)
+        with S3MultipartWriter(client, "bucket", "key", part_size=5 * _mb, max_concurrency=2) as writer:
+            for i in range(0, len(data), 100000):
+                writer.write(data[i:i + 100000])
+
+        self.assertEqual([p['PartNumber'] for p in client.completed], [1, 2, 3])
+        self.assertEqual([p['ETag'] for p in client.completed], ["etag-1", "etag-2", "etag-3"])
+        self.assertEqual(len(client.parts[1]), 5 * _mb)
+        self.assertEqual(client.uploaded(), data)
+        self.assertFalse(client.aborted)
+
+    def test_empty(self):
+        client = FakeS3Client()
+        with S3MultipartWriter(client, "bucket", "key"):
+            pass
+        self.assertEqual(client.uploaded(), b"")
+
+    def test_zip(self):
+        client = FakeS3Client()
+        with S3MultipartWriter(client, "bucket", "key") as writer:
+            with zipfile.ZipFile(writer, 'w') as zf:
+                zf.writestr("a.txt", "hello")
+                zf.writestr("b.txt", "world" * 1000)
+
+        with zipfile.ZipFile(io.BytesIO(client.uploaded())) as zf:
+            self.assertEqual(zf.read("a.txt"), b"hello")
+            self.assertEqual(zf.read("b.txt"), b"world" * 1000)
+
+    def test_failed_part_aborts(self):
+        client = FakeS3Client(fail_part=1)
+        with self.assertRaises(IOError):
+            with S3MultipartWriter(client, "bucket", "key", part_size=5 * _mb) as writer:
+                writer.write(b"x" * (6 * _mb))
+                writer.close()
+        self.assertTrue(client.aborted)
+        self.assertIsNone(client.completed)
+
+    def test_error_while_writing_aborts(self):
+        client = FakeS3Client()
+        with self.assertRaises(ValueError):
+            with S3MultipartWriter(client, "bucket", "key") as writer:
+                writer.write(b"x")
+                raise ValueError("generate failed")
+        self.assertTrue(client.aborted)
+        self.assertIsNone(client.completed)
+
+
+if __name__ == '__main__':
+    unittest.main()
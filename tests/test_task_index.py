@@ -0,0 +1,129 @@
+import json
+import unittest
+
+from cubequery.task_index import apply_event, list_tasks, merge_submission, record_event, record_failure, \
+    record_submission, _summarise
+from tests.fake_redis import FakeRedis
+
+
+class TestTaskIndexEvents(unittest.TestCase):
+    def test_unseen_task(self):
+        params = json.dumps({'user': 'basic', 'aoi': 'POLYGON ((0 0, 1 0, 1 1, 0 0))'})
+        event = {
+            'type': 'task-received',
+            'uuid': 'abc',
+            'name': 'fiji.NDVI_Task',
+            'kwargs': repr({'params': params}),
+            'hostname': 'celery@worker-1',
+            'timestamp': 100.0,
+        }
+        record = apply_event(None, event)
+        self.assertEqual(record['id'], 'abc')
+        self.assertEqual(record['name'], 'fiji.NDVI_Task')
+        self.assertEqual(record['state'], 'RECEIVED')
+        self.assertEqual(record['user'], 'basic')
+        self.assertEqual(record['server'], 'celery@worker-1')
+        self.assertFalse(record['ack'])
+
+    def test_state_progression(self):
+        record = {'id': 'abc', 'name': 'a', 'state': 'PENDING', 'user': 'basic', 'ack': False, 'server': None,
+                  'time_start': None, 'args': {}}
+
+        record = apply_event(record, {'type': 'task-started', 'uuid': 'abc', 'hostname': 'w', 'timestamp': 5.0})
+        self.assertEqual(record['state'], 'STARTED')
+        self.assertEqual(record['time_start'], 5.0)
+        self.assertTrue(record['ack'])
+
+        record = apply_event(record, {'type': 'task-succeeded', 'uuid': 'abc', 'runtime': 3.2, 'timestamp': 8.2})
+        self.assertEqual(record['state'], 'SUCCESS')
+        self.assertEqual(record['runtime'], 3.2)
+        self.assertEqual(record['user'], 'basic')
+
+    def test_unknown_event_keeps_state(self):
+        record = {'id': 'abc', 'name': 'a', 'state': 'STARTED', 'user': None, 'ack': True, 'server': 'w',
+                  'time_start': 1.0, 'args': {}}
+        record = apply_event(record, {'type': 'task-something', 'uuid': 'abc'})
+        self.assertEqual(record['state'], 'STARTED')
+
+
+class TestMergeSubmission(unittest.TestCase):
+    submission = {'id': 'abc', 'name': 'fiji.NDVI_Task', 'time_start': None, 'time_submitted': 90.0,
+                  'args': {'user': 'basic'}, 'ack': False, 'server': None, 'state': 'PENDING', 'user': 'basic',
+                  'queue': 'small'}
+
+    def test_new(self):
+        self.assertEqual(merge_submission(None, self.submission), self.submission)
+
+    def test_worker_got_there_first(self):
+        record = apply_event(None, {'type': 'task-started', 'uuid': 'abc', 'name': 'fiji.NDVI_Task',
+                                    'hostname': 'w', 'timestamp': 100.0})
+        merged = merge_submission(record, self.submission)
+        self.assertEqual(merged['state'], 'STARTED')
+        self.assertEqual(merged['time_start'], 100.0)
+        self.assertTrue(merged['ack'])
+        self.assertEqual(merged['time_submitted'], 90.0)
+        self.assertEqual(merged['user'], 'basic')
+        self.assertEqual(merged['queue'], 'small')
+
+
+class TestTaskSummaries(unittest.TestCase):
+    def test_summarise(self):
+        fields = {
+            b'runs': b'4',
+            b'last_run': b'1000.5',
+            b'seconds': b'40',
+            b'output_bytes': b'4000',
+            b'max_peak_rss_bytes': b'2048',
+            b'phases.generate_product.seconds': b'30',
+            b'phases.upload_results.seconds': b'8',
+        }
+        summary = _summarise('fiji.NDVI_Task', 'abc123', fields)
+        self.assertEqual(summary['runs'], 4)
+        self.assertEqual(summary['last_run'], 1000.5)
+        self.assertEqual(summary['max_peak_rss_bytes'], 2048)
+        self.assertEqual(summary['mean'], {'seconds': 10, 'output_bytes': 1000})
+        self.assertEqual(summary['phases'], {'generate_product': {'seconds': 7.5}, 'upload_results': {'seconds': 2}})
+
+
+
+class TestTaskIndexStore(unittest.TestCase):
+    def test_submission_after_worker_event(self):
+        client = FakeRedis()
+        record_event({'type': 'task-started', 'uuid': 'abc', 'name': 'a', 'hostname': 'w', 'timestamp': 100.0},
+                     client)
+        record_submission('abc', 'a', {'user': 'basic'}, client)
+        record = json.loads(client.get('cubequery:task:abc'))
+        self.assertEqual(record['state'], 'STARTED')
+        self.assertEqual(record['user'], 'basic')
+        self.assertEqual(list(client.sets['cubequery:tasks:state:STARTED']), ['abc'])
+        self.assertNotIn('abc', client.sets.get('cubequery:tasks:state:PENDING', {}))
+
+    def test_failure_without_events(self):
+        client = FakeRedis()
+        record_submission('merge', 'a', {'user': 'basic'}, client)
+        record_failure('merge', "part 1 failed", client)
+        record = json.loads(client.get('cubequery:task:merge'))
+        self.assertEqual(record['state'], 'FAILURE')
+        self.assertEqual(record['exception'], "part 1 failed")
+        self.assertEqual(record['user'], 'basic')
+        self.assertEqual(list(client.sets['cubequery:tasks:state:FAILURE']), ['merge'])
+        self.assertNotIn('merge', client.sets['cubequery:tasks:state:PENDING'])
+
+    def test_list_by_user_and_state(self):
+        client = FakeRedis()
+        # plenty of other users' finished tasks that would fill a page of the state index on their own.
+        for i in range(20):
+            record_submission(f"other-{i}", 'a', {'user': 'other'}, client)
+            record_event({'type': 'task-succeeded', 'uuid': f"other-{i}", 'timestamp': 200.0 + i}, client)
+        record_submission('mine', 'a', {'user': 'basic'}, client)
+        record_event({'type': 'task-succeeded', 'uuid': 'mine', 'timestamp': 300.0}, client)
+        client.sets['cubequery:tasks:state:SUCCESS']['mine'] = 1.0
+
+        tasks = list_tasks(user='basic', state='SUCCESS', limit=5, client=client)
+        self.assertEqual([t['id'] for t in tasks], ['mine'])
+        # redis would read a zero sized page as the whole index.
+        self.assertEqual(list_tasks(limit=0, client=client), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from cubequery import task_metrics
+from cubequery.task_metrics import RunMetrics
+
+
+class TestRunMetrics(unittest.TestCase):
+    def test_phases(self):
+        metrics = RunMetrics()
+        with metrics.phase("compute"):
+            sum(i * i for i in range(200000))
+        with tempfile.TemporaryDirectory() as d:
+            with metrics.phase("write"):
+                with open(os.path.join(d, "out.bin"), 'wb') as f:
+                    f.write(b"\0" * 1024 * 1024)
+                    f.flush()
+                    os.fsync(f.fileno())
+        with metrics.phase("compute"):
+            pass
+        metrics.values['output_bytes'] = 10
+
+        result = metrics.as_dict()
+        self.assertEqual(set(result['phases']), {"compute", "write"})
+        self.assertGreater(result['phases']['compute']['cpu_seconds'], 0)
+        self.assertGreater(result['phases']['compute']['peak_rss_bytes'], 0)
+        self.assertGreaterEqual(result['seconds'], result['phases']['compute']['seconds'])
+        self.assertGreaterEqual(result['peak_rss_bytes'], result['phases']['write']['peak_rss_bytes'])
+        self.assertGreaterEqual(result['bytes_written'], result['phases']['write']['bytes_written'])
+        self.assertEqual(result['output_bytes'], 10)
+
+    def test_failed_phase_recorded(self):
+        metrics = RunMetrics()
+        with self.assertRaises(ValueError):
+            with metrics.phase("generate_product"):
+                raise ValueError("bad")
+        self.assertIn("generate_product", metrics.as_dict()['phases'])
+
+    def test_dask_workers_measured(self):
+        class Cluster(object):
+            def run(self, function):
+                return {'tcp://w1': function(), 'tcp://w2': function()}
+
+        metrics = RunMetrics()
+        with metrics.phase("generate_product", cluster=Cluster()):
+            sum(i * i for i in range(200000))
+        result = metrics.as_dict()
+        phase = result['phases']['generate_product']
+        self.assertGreater(phase['dask_cpu_seconds'], 0)
+        self.assertGreater(phase['dask_peak_rss_bytes'], 0)
+        self.assertEqual(phase['peak_memory_bytes'], phase['peak_rss_bytes'] + phase['dask_peak_rss_bytes'])
+        self.assertEqual(result['dask_peak_rss_bytes'], phase['dask_peak_rss_bytes'])
+        self.assertGreaterEqual(result['peak_memory_bytes'], phase['peak_memory_bytes'])
+
+    def test_unreachable_cluster(self):
+        class Cluster(object):
+            def run(self, function):
+                raise IOError("gone")
+
+        metrics = RunMetrics()
+        with metrics.phase("generate_product", cluster=Cluster()):
+            pass
+        phase = metrics.as_dict()['phases']['generate_product']
+        self.assertEqual(phase['dask_peak_rss_bytes'], 0)
+        self.assertEqual(phase['peak_memory_bytes'], phase['peak_rss_bytes'])
+
+    def test_dask_worker_peaks_not_reset(self):
+        class Cluster(object):
+            def run(self, function):
+                return {'tcp://w1': function()}
+
+        metrics = RunMetrics()
+        with mock.patch('cubequery.task_metrics._reset_peak_rss') as reset:
+            with metrics.phase("generate_product", cluster=Cluster()):
+                pass
+        # only this process is reset, the workers are shared with other runs.
+        self.assertEqual(reset.call_count, 1)
+
+    def test_dask_worker_peak_sampled(self):
+        class Cluster(object):
+            """
+            One worker below its old high water mark, using 600 bytes midway through the phase.
+            """
+
+            def __init__(self):
+                self.sampled = threading.Event()
+
+            def run(self, function):
+                if function is task_metrics.current_rss:
+                    self.sampled.set()
+                    return {'tcp://w1': 600}
+                return {'tcp://w1': {'cpu_seconds': 1.0, 'peak_rss_bytes': 1000, 'rss_bytes': 100,
+                                     'bytes_written': 0}}
+
+        cluster = Cluster()
+        metrics = RunMetrics(memory_sample_interval=0.001)
+        with metrics.phase("generate_product", cluster=cluster):
+            self.assertTrue(cluster.sampled.wait(5))
+        self.assertEqual(metrics.as_dict()['phases']['generate_product']['dask_peak_rss_bytes'], 600)
+
+        # a new high water mark was reached during the phase.
+        self.assertEqual(task_metrics._cluster_difference(
+            {'w': {'cpu_seconds': 0, 'peak_rss_bytes': 1000, 'rss_bytes': 100, 'bytes_written': 0}},
+            {'w': {'cpu_seconds': 0, 'peak_rss_bytes': 1500, 'rss_bytes': 100, 'bytes_written': 0}},
+            {'w': 600})['dask_peak_rss_bytes'], 1500)
@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy
+import rasterio
+from rasterio.transform import from_origin
+
+from cubequery.temporal import time_windows, reduce_time_outputs
+
+
+class TestTimeWindows(unittest.TestCase):
+    def test_windows(self):
+        self.assertEqual(time_windows("2019-01-01", "2021-03-01", 365), [
+            ("2019-01-01", "2019-12-31"),
+            ("2020-01-01", "2020-12-30"),
+            ("2020-12-31", "2021-03-01"),
+        ])
+
+    def test_single_window(self):
+        self.assertEqual(time_windows("2019-2-1", "2019-2-10", 30), [("2019-02-01", "2019-02-10")])
+        self.assertEqual(time_windows("2019-02-10", "2019-02-01", 30), [])
+
+
+class TestReduceTimeOutputs(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _path(self, window, name):
+        os.makedirs(os.path.join(self.dir, "parts", str(window)), exist_ok=True)
+        return os.path.join(self.dir, "parts", str(window), name)
+
+    def _raster(self, window, name, values):
+        file_path = self._path(window, name)
+        data = numpy.array(values, dtype='int16').reshape((1, 2, 2))
+        with rasterio.open(file_path, 'w', driver='GTiff', height=2, width=2, count=1, dtype='int16',
+                           crs='EPSG:4326', transform=from_origin(0, 2, 1, 1), nodata=-1) as dst:
+            dst.write(data)
+        return file_path
+
+    def _csv(self, window, lines):
+        file_path = self._path(window, "series.csv")
+        with open(file_path, 'w') as f:
+            f.write("date,value\n")
+            f.writelines(lines)
+        return file_path
+
+    def _windows(self):
+        return {
+            0: [self._raster(0, "ndvi.tif", [1, 2, 3, -1]), self._csv(0, ["2019-01-01,1\n"])],
+            1: [self._raster(1, "ndvi.tif", [3, 4, -1, -1]), self._csv(1, ["2020-01-01,2\n", "2020-06-01,3\n"])],
+            2: [self._raster(2, "ndvi.tif", [5, 9, 5, -1])],
+        }
+
+    def test_median(self):
+        outputs = reduce_time_outputs(self._windows(), self.dir, "median")
+        self.assertEqual([os.path.basename(o) for o in outputs], ["ndvi.tif", "series.csv"])
+
+        with rasterio.open(outputs[0]) as merged:
+            data = merged.read(1)
+            self.assertEqual(merged.dtypes[0], 'float32')
+        self.assertEqual(data[0].tolist(), [3, 4])
+        self.assertEqual(data[1, 0], 4)
+        self.assertTrue(numpy.isnan(data[1, 1]))
+
+        with open(outputs[1]) as f:
+            self.assertEqual(f.read(), "date,value\n2019-01-01,1\n2020-01-01,2\n2020-06-01,3\n")
+
+    def test_per_output_reduce(self):
+        outputs = reduce_time_outputs(self._windows(), self.dir, {"ndvi.tif": "max"})
+        with rasterio.open(outputs[0]) as merged:
+            self.assertEqual(merged.dtypes[0], 'int16')
+            self.assertEqual(merged.read(1).tolist(), [[5, 9], [5, -1]])
+
+    def test_stack(self):
+        outputs = reduce_time_outputs(self._windows(), self.dir, "stack")
+        with rasterio.open(outputs[0]) as merged:
+            self.assertEqual(merged.count, 3)
+            self.assertEqual(merged.read(2).tolist(), [[3, 4], [-1, -1]])
+
+    def test_mean_weighted_by_days(self):
+        windows = self._windows()
+        outputs = reduce_time_outputs(windows, self.dir, "mean", window_days={0: 365, 1: 365, 2: 60})
+        with rasterio.open(outputs[0]) as merged:
+            data = merged.read(1)
+        self.assertAlmostEqual(float(data[0, 0]), (1 * 365 + 3 * 365 + 5 * 60) / 790, places=5)
+        # windows with no data for a pixel don't count.
+        self.assertAlmostEqual(float(data[1, 0]), (3 * 365 + 5 * 60) / 425, places=5)
+        self.assertTrue(numpy.isnan(data[1, 1]))
+
+    def test_reduced_by_block(self):
+        shape = (1, 64, 48)
+        files = {}
+        for window in range(3):
+            file_path = self._path(window, "big.tif")
+            with rasterio.open(file_path, 'w', driver='GTiff', height=shape[1], width=shape[2], count=1,
+                               dtype='uint16', crs='EPSG:4326', transform=from_origin(0, 64, 1, 1), tiled=True,
+                               blockxsize=16, blockysize=16) as dst:
+                dst.write(numpy.full(shape, window * 100, dtype='uint16') + numpy.arange(48, dtype='uint16'))
+            files[window] = [file_path]
+
+        with mock.patch('numpy.ma.stack', wraps=numpy.ma.stack) as stack:
+            outputs = reduce_time_outputs(files, self.dir, "sum")
+        # a stack per block rather than of the whole rasters.
+        self.assertEqual(stack.call_count, 12)
+        self.assertTrue(all(a[0][0][0].shape == (1, 16, 16) for a in stack.call_args_list))
+        with rasterio.open(outputs[0]) as merged:
+            self.assertEqual(merged.dtypes[0], 'uint16')
+            self.assertEqual(merged.read(1)[5].tolist(), [300 + 3 * c for c in range(48)])
@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import rasterio
+from rasterio.transform import from_origin
+from shapely import wkt
+
+from cubequery.tiling import tile_geometry, merge_tile_outputs
+
+
+class TestTiling(unittest.TestCase):
+    def test_tile_geometry(self):
+        aoi = wkt.loads("POLYGON ((177.1 -18.4, 178.7 -18.4, 178.7 -17.2, 177.1 -17.2, 177.1 -18.4))")
+        tiles = tile_geometry(aoi, 0.5)
+        # x cells 354..357, y cells -37..-35
+        self.assertEqual(len(tiles), 12)
+        self.assertAlmostEqual(sum(t.area for t in tiles), aoi.area)
+        for t in tiles:
+            self.assertLessEqual(t.area, 0.25 + 1e-9)
+            self.assertTrue(aoi.buffer(1e-9).contains(t))
+
+    def test_tile_geometry_skips_empty_cells(self):
+        # an L shape leaves the top right cell empty.
+        aoi = wkt.loads("POLYGON ((0 0, 1 0, 1 0.5, 0.5 0.5, 0.5 1, 0 1, 0 0))")
+        tiles = tile_geometry(aoi, 0.5)
+        self.assertEqual(len(tiles), 3)
+        self.assertAlmostEqual(sum(t.area for t in tiles), aoi.area)
+
+
+class TestMergeTileOutputs(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _raster(self, tile, name, west, value, north=10, size=4, **options):
+        os.makedirs(os.path.join(self.dir, "tiles", str(tile)), exist_ok=True)
+        file_path = os.path.join(self.dir, "tiles", str(tile), name)
+        data = numpy.full((1, size, size), value, dtype='float32')
+        with rasterio.open(file_path, 'w', driver='GTiff', height=size, width=size, count=1, dtype='float32',
+                           crs='EPSG:4326', transform=from_origin(west, north, 1, 1), nodata=-1, **options) as dst:
+            dst.write(data)
+        return file_path
+
+    def test_merge(self):
+        csv = os.path.join(self.dir, "tiles", "1", "stats.csv")
+        tile_files = {
+            0: [self._raster(0, "ndvi.tif", 0, 1)],
+            1: [self._raster(1, "ndvi.tif", 4, 2)],
+        }
+        with open(csv, 'w') as f:
+            f.write("a,b\n")
+        tile_files[1].append(csv)
+
+        outputs = merge_tile_outputs(tile_files, self.dir)
+        self.assertEqual([os.path.basename(o) for o in outputs], ["ndvi.tif", "tile_1_stats.csv"])
+        with rasterio.open(outputs[0]) as merged:
+            self.assertEqual((merged.width, merged.height), (8, 4))
+            data = merged.read(1)
+        self.assertTrue((data[:, :4] == 1).all())
+        self.assertTrue((data[:, 4:] == 2).all())
+
+    def test_overlaps_and_gaps(self):
+        # the second tile overlaps the first and is offset down, leaving corners no tile covers.
+        first = self._raster(0, "ndvi.tif", 0, 1, size=32, tiled=True, blockxsize=16, blockysize=16)
+        second = self._raster(1, "ndvi.tif", 16, 2, north=-6, size=32, tiled=True, blockxsize=16, blockysize=16)
+        with rasterio.open(second, 'r+') as dst:
+            # a corner of the second tile has no data and no other tile covers it.
+            dst.write(numpy.full((1, 16, 16), -1, dtype='float32'), window=rasterio.windows.Window(16, 16, 16, 16))
+
+        outputs = merge_tile_outputs({0: [first], 1: [second]}, self.dir)
+        with rasterio.open(outputs[0]) as merged:
+            self.assertEqual((merged.width, merged.height), (48, 48))
+            self.assertEqual(merged.transform, from_origin(0, 10, 1, 1))
+            data = merged.read(1)
+        # the first tile wins where they overlap.
+        self.assertTrue((data[:32, :32] == 1).all())
+        self.assertTrue((data[32:, 16:32] == 2).all())
+        self.assertTrue((data[16:32, 32:] == 2).all())
+        self.assertTrue((data[32:, 32:] == -1).all())
+        self.assertTrue((data[32:, :16] == -1).all())
@@ -0,0 +1,45 @@
+import unittest
+
+from cubequery.token_cache import TokenCache
+from tests.fake_redis import FakeClock
+
+
+class TestTokenCache(unittest.TestCase):
+    def test_hit_and_miss(self):
+        cache = TokenCache(max_size=10, clock=FakeClock())
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", "basic", 2000.0)
+        self.assertEqual(cache.get("a"), "basic")
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_expiry(self):
+        clock = FakeClock()
+        cache = TokenCache(max_size=10, clock=clock)
+        cache.put("a", "basic", 1010.0)
+        self.assertEqual(cache.get("a"), "basic")
+        clock.now = 1010.0
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_least_recently_used_evicted(self):
+        cache = TokenCache(max_size=2, clock=FakeClock())
+        cache.put("a", "basic", 2000.0)
+        cache.put("b", "basic", 2000.0)
+        cache.get("a")
+        cache.put("c", "basic", 2000.0)
+        self.assertEqual(cache.get("a"), "basic")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), "basic")
+
+    def test_evict_user(self):
+        cache = TokenCache(max_size=10, clock=FakeClock())
+        cache.put("a", "basic", 2000.0)
+        cache.put("b", "test_user", 2000.0)
+        cache.evict_user("basic")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), "test_user")
+
+
+if __name__ == '__main__':
+    unittest.main()
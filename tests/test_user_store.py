@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+
+from cubequery.user_store import FileUserStore, SqliteUserStore, parse_user_line
+
+
+class TestUserStores(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _write_users(self, path, lines, mtime):
+        with open(path, 'w') as f:
+            f.write("\n".join(lines))
+        os.utime(path, (mtime, mtime))
+
+    def test_parse_user_line(self):
+        self.assertIsNone(parse_user_line("# User, password hash (bcrypt), allowed addresses"))
+        self.assertIsNone(parse_user_line(""))
+        self.assertEqual(parse_user_line("basic,hash,127.0.0.1;172.*"), ("basic", "hash", ["127.0.0.1", "172.*"]))
+        self.assertEqual(parse_user_line("basic,hash"), ("basic", "hash", []))
+
+    def test_file_store_reload(self):
+        path = os.path.join(self.dir.name, "users.cfg")
+        self._write_users(path, ["# comment", "a,hash_a,127.0.0.1", "b,hash_b,10.*"], 1000)
+        store = FileUserStore(path)
+        self.assertEqual(store.refresh(), [])
+        self.assertEqual(store.lookup("a")[0], b"hash_a")
+        self.assertTrue(store.lookup("b")[1].match("10.1.1.1"))
+
+        # unchanged files are not re-read
+        self.assertEqual(store.refresh(), [])
+
+        self._write_users(path, ["a,new_hash,127.0.0.1", "c,hash_c,"], 2000)
+        self.assertEqual(store.refresh(), ["b"])
+        self.assertEqual(store.lookup("a")[0], b"new_hash")
+        self.assertIsNone(store.lookup("b"))
+        self.assertTrue(store.lookup("c")[1].match("anything"))
+
+    def test_sqlite_store(self):
+        path = os.path.join(self.dir.name, "users.db")
+        cfg = os.path.join(self.dir.name, "users.cfg")
+        self._write_users(cfg, ["a,hash_a,127.0.0.1", "b,hash_b,10.*"], 1000)
+
+        store = SqliteUserStore(path)
+        self.assertEqual(store.import_file(cfg), 2)
+        store.refresh()
+        self.assertEqual(store.lookup("a")[0], b"hash_a")
+        self.assertTrue(store.lookup("b")[1].match("10.1.1.1"))
+        self.assertIsNone(store.lookup("missing"))
+
+        # changes made through another connection are picked up on refresh
+        other = SqliteUserStore(path)
+        other.add_user("a", "new_hash", ["127.0.0.1"])
+        other.remove_user("b")
+        self.assertEqual(store.lookup("a")[0], b"hash_a")
+        self.assertEqual(store.refresh(), ["b"])
+        self.assertEqual(store.lookup("a")[0], b"new_hash")
+        self.assertIsNone(store.lookup("b"))
+        self.assertEqual(store.refresh(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()